@@ -0,0 +1,142 @@
+"""ANN索引召回率与延迟对比报告。
+
+在临时目录中生成随机向量表，分别用暴力搜索（精确结果）和ANN索引在不同
+nprobes / refine_factor组合下检索，输出recall@k和p50/p95延迟。
+
+用法:
+    python -m bench.ann_recall --rows 100000 --dim 128 --queries 200
+    python -m bench.ann_recall --nprobes 5 10 20 50 --refine 0 5 --output ann.json
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import Dict, List
+
+import lancedb  # type: ignore
+import numpy as np
+
+from src.vector_store import ensure_vector_index
+
+TABLE_NAME = "ann_bench"
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(np.array(values), q)) if values else 0.0
+
+
+def _run_queries(table, queries: np.ndarray, top_k: int, **params) -> Dict:
+    """执行一组查询，返回每个查询的结果id集合和延迟（毫秒）。"""
+    ids, latencies = [], []
+    for query in queries:
+        search = table.search(query).limit(top_k).select(["id", "_distance"])
+        if params.get("exact"):
+            search = search.bypass_vector_index()
+        else:
+            search = search.nprobes(params["nprobes"])
+            if params.get("refine_factor"):
+                search = search.refine_factor(params["refine_factor"])
+        start = time.perf_counter()
+        rows = search.to_arrow()
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(set(rows.column("id").to_pylist()))
+    return {"ids": ids, "latencies_ms": latencies}
+
+
+def run_report(
+    rows: int,
+    dim: int,
+    num_queries: int,
+    top_k: int,
+    nprobes_list: List[int],
+    refine_list: List[int],
+    seed: int = 42,
+) -> List[Dict]:
+    """生成数据、建索引并返回每组参数的召回率和延迟统计。"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((rows, dim), dtype=np.float32)
+    queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = lancedb.connect(tmp_dir)
+        data = [
+            {"vector": vector, "id": str(i)} for i, vector in enumerate(vectors)
+        ]
+        table = db.create_table(TABLE_NAME, data=data)
+
+        exact = _run_queries(table, queries, top_k, exact=True)
+
+        start = time.perf_counter()
+        if not ensure_vector_index(db, TABLE_NAME):
+            raise SystemExit(
+                f"未构建索引：行数 {rows} 低于 ANN_INDEX_MIN_ROWS，请增大 --rows"
+            )
+        build_seconds = time.perf_counter() - start
+        table = db.open_table(TABLE_NAME)
+
+        report = [
+            {
+                "mode": "exact",
+                "nprobes": None,
+                "refine_factor": None,
+                "recall_at_k": 1.0,
+                "p50_ms": _percentile(exact["latencies_ms"], 50),
+                "p95_ms": _percentile(exact["latencies_ms"], 95),
+            }
+        ]
+        for nprobes in nprobes_list:
+            for refine_factor in refine_list:
+                result = _run_queries(
+                    table, queries, top_k, nprobes=nprobes, refine_factor=refine_factor
+                )
+                recall = np.mean(
+                    [
+                        len(found & truth) / top_k
+                        for found, truth in zip(result["ids"], exact["ids"])
+                    ]
+                )
+                report.append(
+                    {
+                        "mode": "ann",
+                        "nprobes": nprobes,
+                        "refine_factor": refine_factor,
+                        "recall_at_k": float(recall),
+                        "p50_ms": _percentile(result["latencies_ms"], 50),
+                        "p95_ms": _percentile(result["latencies_ms"], 95),
+                    }
+                )
+
+    print(f"索引构建耗时 {build_seconds:.2f}s ({rows} 行, {dim} 维)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN召回率与延迟对比。")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[5, 10, 20, 50])
+    parser.add_argument("--refine", type=int, nargs="+", default=[0, 5])
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    report = run_report(
+        args.rows, args.dim, args.queries, args.top_k, args.nprobes, args.refine
+    )
+
+    print(f"{'mode':<6} {'nprobes':>8} {'refine':>7} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in report:
+        print(
+            f"{row['mode']:<6} {str(row['nprobes'] or '-'):>8} "
+            f"{str(row['refine_factor'] if row['refine_factor'] is not None else '-'):>7} "
+            f"{row['recall_at_k']:>9.3f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
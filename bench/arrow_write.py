@@ -0,0 +1,109 @@
+"""向量表写入吞吐对比：逐行字典 vs Arrow列式RecordBatch。
+
+"dicts" 是旧的写入方式：每行构建一个字典，向量用 vector.tolist() 转成Python
+浮点数列表，再交给 table.add 重新转换成Arrow；"arrow" 是当前
+write_document_batches 使用的方式：直接从NumPy嵌入矩阵构建FixedSizeListArray。
+两种方式都写入同一结构的表，分别报告构建批次和总体（构建+写入）的行/秒。
+
+用法:
+    python -m bench.arrow_write --rows 100000 --dim 128
+    python -m bench.arrow_write --batch-size 4096 --output arrow_write.json
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import Dict, List
+
+import lancedb  # type: ignore
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.vector_store import _to_record_batch, create_or_get_table
+
+
+def _dict_rows(documents: List[Document], embeddings: np.ndarray, ids: List[str]) -> List[Dict]:
+    """旧的写入方式：逐行构建字典。"""
+    return [
+        {
+            "vector": vector.tolist(),
+            "text": doc.page_content,
+            "metadata": json.dumps(doc.metadata),
+            "id": row_id,
+        }
+        for doc, vector, row_id in zip(documents, embeddings, ids)
+    ]
+
+
+def _run(mode: str, documents, embeddings, ids, batch_size: int) -> Dict:
+    """把全部数据按batch_size分批写入一张新表，返回耗时统计。"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = lancedb.connect(tmp_dir)
+        table = create_or_get_table(db, "write_bench", embeddings.shape[1])
+        build_seconds = write_seconds = 0.0
+        for start in range(0, len(documents), batch_size):
+            end = start + batch_size
+            t0 = time.perf_counter()
+            if mode == "dicts":
+                data = _dict_rows(documents[start:end], embeddings[start:end], ids[start:end])
+            else:
+                data = _to_record_batch(
+                    table.schema, documents[start:end], embeddings[start:end], ids[start:end]
+                )
+            t1 = time.perf_counter()
+            table.add(data)
+            build_seconds += t1 - t0
+            write_seconds += time.perf_counter() - t1
+        assert table.count_rows() == len(documents)
+
+    rows = len(documents)
+    total = build_seconds + write_seconds
+    return {
+        "mode": mode,
+        "rows": rows,
+        "build_seconds": build_seconds,
+        "write_seconds": write_seconds,
+        "build_rows_per_sec": rows / build_seconds if build_seconds else float("inf"),
+        "total_rows_per_sec": rows / total if total else float("inf"),
+    }
+
+
+def run_report(rows: int, dim: int, batch_size: int, seed: int = 42) -> List[Dict]:
+    """生成随机嵌入和文档，分别用两种方式写入。"""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((rows, dim), dtype=np.float32)
+    documents = [
+        Document(
+            page_content=f"第 {i} 个测试句子。",
+            metadata={"source": f"doc_{i % 100}.txt", "paragraph_num": i % 7},
+        )
+        for i in range(rows)
+    ]
+    ids = [f"bench#{i}" for i in range(rows)]
+    return [_run(mode, documents, embeddings, ids, batch_size) for mode in ("dicts", "arrow")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量表写入吞吐对比。")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    report = run_report(args.rows, args.dim, args.batch_size)
+
+    print(f"{'mode':<6} {'build s':>8} {'write s':>8} {'build rows/s':>13} {'total rows/s':>13}")
+    for row in report:
+        print(
+            f"{row['mode']:<6} {row['build_seconds']:>8.2f} {row['write_seconds']:>8.2f} "
+            f"{row['build_rows_per_sec']:>13,.0f} {row['total_rows_per_sec']:>13,.0f}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""端到端检索基准：合成语料 -> run_indexing -> search_vector_store。
+
+在工作目录中生成指定句子数（即向量表行数）的合成文本语料，用本地模型服务桩
+（tools.mock_server，由文本哈希确定性生成向量）代替嵌入服务，然后：
+
+1. 调用 run_indexing(reindex=True) 完成加载、分割、编码、写入和建索引，
+   报告耗时和行/秒；
+2. 从语料中抽样查询句子，预先批量编码后逐个调用 search_vector_store，
+   报告p50/p95/p99延迟（不含查询编码）；
+3. 对同一查询向量做暴力搜索（绕过ANN索引）作为真值，报告recall@k；
+4. 报告进程的内存峰值（ru_maxrss），桩服务运行在子进程中，不计入其中。
+
+哈希向量在空间中均匀分布、没有聚类结构，是IVF_PQ的最坏情况，recall@k明显
+低于真实嵌入，适合在提交之间或参数之间对比，而不是作为绝对值。
+
+配置通过环境变量在导入src之前设置（数据目录、数据库目录、API地址等），
+因此不会读写项目自己的 data/ 和 db/。结果写成JSON，--baseline 与之前的
+结果逐项对比，便于在提交之间发现性能回退。内存峰值在进程内单调不减，
+不同规模请分别运行。
+
+用法:
+    python -m bench.retrieval --chunks 10000 --output retrieval-10k.json
+    python -m bench.retrieval --chunks 100000 --queries 500 --top-k 10
+    python -m bench.retrieval --chunks 10000 --baseline retrieval-10k.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from tools.mock_server import start_mock_process
+
+TABLE_NAME = "retrieval_bench"
+
+# 合成句子使用的词表；每个句子带有唯一编号，保证语料中没有重复句子
+_WORDS = (
+    "vector index query latency storage paragraph sentence model answer context "
+    "retrieval ranking cache partition segment column schema filter batch stream "
+    "document corpus token embedding cluster replica shard commit snapshot version"
+).split()
+
+# 结果对比时报告的指标：(JSON路径, 是否越大越好)
+_COMPARED_METRICS = [
+    (("indexing", "rows_per_second"), True),
+    (("search", "p50_ms"), False),
+    (("search", "p95_ms"), False),
+    (("search", "p99_ms"), False),
+    (("recall_at_k",), True),
+    (("memory", "peak_rss_mb"), False),
+]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(np.array(values), q)) if values else 0.0
+
+
+def _peak_rss_mb() -> float:
+    # Linux上ru_maxrss的单位是KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def generate_corpus(
+    data_dir: Path,
+    chunks: int,
+    num_queries: int,
+    sentences_per_file: int = 2000,
+    sentences_per_paragraph: int = 5,
+    seed: int = 42,
+) -> List[str]:
+    """
+    生成合成文本语料，每个句子在索引后成为向量表的一行。
+
+    句子长度控制在句子分割器的chunk_size以内且两句之和超过它，
+    因此每个句子恰好成为一个文本块。
+
+    Args:
+        data_dir (Path): 写入 .txt 文件的目录。
+        chunks (int): 句子总数。
+        num_queries (int): 从语料中抽样作为查询的句子数。
+        sentences_per_file (int): 每个文件的句子数。
+        sentences_per_paragraph (int): 每个段落的句子数。
+        seed (int): 随机种子，相同参数总是生成相同的语料和查询。
+
+    Returns:
+        List[str]: 抽样的查询句子。
+    """
+    rng = np.random.default_rng(seed)
+    query_ids = set(rng.choice(chunks, size=min(num_queries, chunks), replace=False).tolist())
+    queries = []
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    for file_start in range(0, chunks, sentences_per_file):
+        paragraphs, sentences = [], []
+        for i in range(file_start, min(file_start + sentences_per_file, chunks)):
+            words = rng.choice(_WORDS, size=int(rng.integers(14, 20)))
+            sentence = f"Record {i} covers " + " ".join(words) + "."
+            if i in query_ids:
+                queries.append(sentence)
+            sentences.append(sentence)
+            if len(sentences) == sentences_per_paragraph:
+                paragraphs.append(" ".join(sentences))
+                sentences = []
+        if sentences:
+            paragraphs.append(" ".join(sentences))
+        path = data_dir / f"corpus_{file_start // sentences_per_file:05d}.txt"
+        path.write_text("\n\n".join(paragraphs) + "\n", encoding="utf-8")
+    return queries
+
+
+def configure_environment(workdir: Path, api_base: str, search_mode: str, small2big: bool):
+    """把项目配置指向工作目录和桩服务；必须在导入src之前调用。"""
+    os.environ.update(
+        {
+            "DATA_DIR": str(workdir / "data"),
+            "DB_DIR": str(workdir / "db"),
+            "SQLITE_DB_PATH": str(workdir / "chunks.db"),
+            "LANCEDB_TABLE_NAME": TABLE_NAME,
+            "DEEPSEEK_API_BASE": api_base,
+            "EMBEDDING_API_MODE": "embeddings",
+            "EMBEDDING_CACHE_ENABLED": "false",
+            "ANSWER_CACHE_ENABLED": "false",
+            "QUERY_LOG_ENABLED": "false",
+            "SEARCH_MODE": search_mode,
+            "SMALL2BIG_ENABLED": str(small2big).lower(),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+
+
+def run_benchmark(
+    queries: List[str],
+    top_k: int,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+) -> Dict:
+    """索引工作目录中的语料，执行查询并返回各项指标。"""
+    from src.config import LANCEDB_TABLE_NAME, SEARCH_MODE, setup_logging
+    from src.db_manager import open_table
+    from src.embedding_model import embedding_model
+    from src.indexing import run_indexing
+    from src.vector_store import get_db_connection, search_vector_store
+
+    setup_logging()
+
+    start = time.perf_counter()
+    result = run_indexing(reindex=True)
+    index_seconds = time.perf_counter() - start
+    if result.get("status") != "success":
+        raise SystemExit(f"索引失败: {result.get('message')}")
+    rss_after_indexing = _peak_rss_mb()
+
+    db = get_db_connection()
+    table = open_table(db, LANCEDB_TABLE_NAME)
+    rows = table.count_rows()
+    ann_index = any(index.index_type.upper().startswith("IVF") for index in table.list_indices())
+
+    query_vectors = embedding_model.encode(queries)
+    if query_vectors is None:
+        raise SystemExit("查询编码失败")
+
+    def search(query, vector):
+        return search_vector_store(
+            query,
+            db,
+            LANCEDB_TABLE_NAME,
+            top_k=top_k,
+            nprobes=nprobes,
+            refine_factor=refine_factor,
+            query_vector=vector,
+        )
+
+    search(queries[0], query_vectors[0])  # 预热
+    latencies, recalls = [], []
+    for query, vector in zip(queries, query_vectors):
+        start = time.perf_counter()
+        results = search(query, vector)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        truth = (
+            table.search(vector)
+            .bypass_vector_index()
+            .limit(top_k)
+            .select(["id", "_distance"])
+            .to_arrow()
+            .column("id")
+            .to_pylist()
+        )
+        found = {r.get("id") for r in results}
+        recalls.append(len(found & set(truth)) / max(1, len(truth)))
+
+    return {
+        "indexing": {
+            "seconds": round(index_seconds, 3),
+            "rows": rows,
+            "rows_per_second": round(rows / index_seconds, 1) if index_seconds else 0.0,
+            "ann_index": ann_index,
+        },
+        "search": {
+            "mode": SEARCH_MODE,
+            "queries": len(latencies),
+            "top_k": top_k,
+            "mean_ms": round(float(np.mean(latencies)), 3),
+            "p50_ms": round(_percentile(latencies, 50), 3),
+            "p95_ms": round(_percentile(latencies, 95), 3),
+            "p99_ms": round(_percentile(latencies, 99), 3),
+        },
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "memory": {
+            "peak_rss_mb_after_indexing": round(rss_after_indexing, 1),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+        },
+    }
+
+
+def compare(baseline: Dict, current: Dict) -> List[Dict]:
+    """逐项对比两次结果，change为相对变化，regression表示向不利方向变化超过5%。"""
+    rows = []
+    for path, higher_is_better in _COMPARED_METRICS:
+        old, new = baseline, current
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+            new = new.get(key) if isinstance(new, dict) else None
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        rows.append(
+            {
+                "metric": ".".join(path),
+                "baseline": old,
+                "current": new,
+                "change": round(change, 4),
+                "regression": worse > 0.05,
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端检索基准。")
+    parser.add_argument("--chunks", type=int, default=10000, help="合成语料的句子（行）数")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=128, help="桩服务返回的向量维度")
+    parser.add_argument("--nprobes", type=int, default=None)
+    parser.add_argument("--refine-factor", type=int, default=None)
+    parser.add_argument(
+        "--search-mode",
+        choices=["vector", "hybrid"],
+        default="vector",
+        help="混合检索会融合全文检索结果，recall@k相对纯向量真值会偏低",
+    )
+    parser.add_argument(
+        "--small2big",
+        action="store_true",
+        help="启用Small2Big；按段落去重会减少返回的结果数，recall@k随之偏低",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", type=Path, help="保留语料和数据库的目录，默认使用临时目录")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--baseline", help="与之前的JSON结果对比")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workdir = args.workdir or Path(tmp_dir)
+        start = time.perf_counter()
+        queries = generate_corpus(workdir / "data", args.chunks, args.queries, seed=args.seed)
+        print(f"生成语料 {args.chunks} 句，耗时 {time.perf_counter() - start:.1f}s")
+
+        process, api_base = start_mock_process([f"--dim={args.dim}"])
+        try:
+            configure_environment(workdir, api_base, args.search_mode, args.small2big)
+            metrics = run_benchmark(queries, args.top_k, args.nprobes, args.refine_factor)
+        finally:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "benchmark": "retrieval",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "params": {
+            "chunks": args.chunks,
+            "queries": len(queries),
+            "top_k": args.top_k,
+            "dim": args.dim,
+            "nprobes": args.nprobes,
+            "refine_factor": args.refine_factor,
+            "search_mode": args.search_mode,
+            "small2big": args.small2big,
+            "seed": args.seed,
+        },
+        **metrics,
+    }
+
+    indexing, search = report["indexing"], report["search"]
+    print(
+        f"索引: {indexing['rows']} 行, {indexing['seconds']:.2f}s, "
+        f"{indexing['rows_per_second']:.0f} 行/秒, ANN索引: {indexing['ann_index']}"
+    )
+    print(
+        f"检索: p50 {search['p50_ms']:.2f}ms  p95 {search['p95_ms']:.2f}ms  "
+        f"p99 {search['p99_ms']:.2f}ms  recall@{args.top_k} {report['recall_at_k']:.3f}"
+    )
+    print(f"内存峰值: {report['memory']['peak_rss_mb']:.0f} MB")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n与 {args.baseline}（{baseline.get('git_commit') or '-'}）对比:")
+        for row in compare(baseline, report):
+            flag = "  <-- 回退" if row["regression"] else ""
+            print(
+                f"{row['metric']:<26} {row['baseline']:>12} -> {row['current']:>12} "
+                f"({row['change']:+.1%}){flag}"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""检索结果物化开销对比：pandas iterrows vs Arrow列投影。
+
+"pandas" 是旧的结果处理方式：取回所有列（包括向量）转换成DataFrame，
+再用 iterrows 逐行构建结果；"arrow" 是当前 search_by_vector 的方式：只投影
+text、metadata和_distance列，直接在Arrow列上构建结果。两种方式使用相同的
+查询和暴力搜索，分别报告各top_k下的p50/p95延迟。
+
+用法:
+    python -m bench.search_results --rows 20000 --top-k 3 10 100 1000
+    python -m bench.search_results --queries 50 --output search_results.json
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import Dict, List
+
+import lancedb  # type: ignore
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.vector_store import RESULT_COLUMNS, _results_from_arrow, write_documents
+
+TABLE_NAME = "result_bench"
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(np.array(values), q)) if values else 0.0
+
+
+def _pandas_results(table, query: np.ndarray, top_k: int) -> List[Dict]:
+    """旧的结果处理方式。"""
+    results = table.search(query).limit(top_k).to_pandas()
+    search_results = []
+    for _, row in results.iterrows():
+        search_results.append(
+            {
+                "text": str(row["text"]),
+                "metadata": json.loads(str(row["metadata"])),
+                "score": float(row["_distance"]),
+            }
+        )
+    return search_results
+
+
+def _arrow_results(table, query: np.ndarray, top_k: int) -> List[Dict]:
+    """当前的结果处理方式。"""
+    results = table.search(query).limit(top_k).select(RESULT_COLUMNS).to_arrow()
+    return _results_from_arrow(results)
+
+
+def run_report(rows: int, dim: int, num_queries: int, top_k_list: List[int], seed: int = 42) -> List[Dict]:
+    """生成数据并返回每种方式、每个top_k的延迟统计。"""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((rows, dim), dtype=np.float32)
+    queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+    documents = [
+        Document(
+            page_content=f"第 {i} 个测试句子，内容长度与真实句子相近。" * 3,
+            metadata={
+                "source": f"/data/doc_{i % 100}.pdf",
+                "paragraph_num": i % 7,
+                "sentence_num_in_para": i % 5,
+            },
+        )
+        for i in range(rows)
+    ]
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = lancedb.connect(tmp_dir)
+        write_documents(db, TABLE_NAME, documents, embeddings, [str(i) for i in range(rows)])
+        table = db.open_table(TABLE_NAME)
+
+        for top_k in top_k_list:
+            for mode, fetch in (("pandas", _pandas_results), ("arrow", _arrow_results)):
+                fetch(table, queries[0], top_k)  # 预热
+                latencies = []
+                for query in queries:
+                    start = time.perf_counter()
+                    results = fetch(table, query, top_k)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                assert len(results) == min(top_k, rows)
+                report.append(
+                    {
+                        "mode": mode,
+                        "top_k": top_k,
+                        "p50_ms": _percentile(latencies, 50),
+                        "p95_ms": _percentile(latencies, 95),
+                    }
+                )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索结果物化开销对比。")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[3, 10, 50, 100, 500, 1000])
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    report = run_report(args.rows, args.dim, args.queries, args.top_k)
+
+    print(f"{'mode':<7} {'top_k':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in report:
+        print(
+            f"{row['mode']:<7} {row['top_k']:>6} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""命令行启动耗时基准：各子命令在开始工作前需要导入的模块及其耗时。
+
+每个目标在新的子进程中执行一段导入语句（与对应子命令开始工作前的导入一致），
+重复多次取挂钟时间的中位数，再用 python -X importtime 运行一次，按顶层包
+汇总各模块自身的导入耗时，列出最慢的包。
+
+子进程中socket的connect被替换为直接抛出异常，数据目录、数据库目录和日志
+都指向临时目录：导入阶段访问网络或依赖项目自己的数据都会让该目标失败。
+目标是所有子命令在1秒内启动；超过 --budget-ms 时以非零状态退出，
+可以在提交之间作为启动耗时的回归检查。
+
+用法:
+    python -m bench.startup
+    python -m bench.startup --repeat 10 --top 15 --output startup.json
+    python -m bench.startup --targets ask index --budget-ms 800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# 目标名 -> 该子命令开始工作前执行的导入。ask的lancedb在等待用户输入时由后台线程加载，
+# 不计入启动耗时；serve的主进程只需要uvicorn，工作进程各自导入src.api
+TARGETS: Dict[str, str] = {
+    "python": "pass",
+    "cli": "import main",
+    "ask": "import main; import src.rag_pipeline",
+    "index": "import main; import src.indexing",
+    "serve": "import main; import uvicorn",
+}
+
+# 导入耗时较大的依赖，报告每个目标是否导入了它们
+HEAVY_MODULES = ["lancedb", "langchain_community", "langsmith", "nltk", "fastapi", "uvicorn"]
+
+# 在目标代码之前执行：禁止网络连接
+_DENY_NETWORK = (
+    "import socket\n"
+    "def _deny(self, *args, **kwargs):\n"
+    "    raise OSError('bench.startup: 导入阶段不允许访问网络')\n"
+    "socket.socket.connect = _deny\n"
+    "socket.socket.connect_ex = _deny\n"
+)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=ROOT_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def isolated_environment(workdir: Path) -> Dict[str, str]:
+    """子进程的环境变量：数据、数据库和日志都写入workdir。"""
+    env = dict(os.environ)
+    env.update(
+        {
+            "DATA_DIR": str(workdir / "data"),
+            "DB_DIR": str(workdir / "db"),
+            "SQLITE_DB_PATH": str(workdir / "example.db"),
+            "QUERY_LOG_PATH": str(workdir / "logs" / "queries.jsonl"),
+            # 不可达的地址，真的发起请求时会在connect时被拒绝
+            "DEEPSEEK_API_BASE": "http://127.0.0.1:9/v1",
+        }
+    )
+    return env
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    解析 -X importtime 的输出。
+
+    Returns:
+        List[Tuple[str, int, int]]: (模块名, 自身耗时微秒, 累计耗时微秒)
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            # 表头行
+            continue
+        rows.append((parts[2].strip(), self_us, cumulative_us))
+    return rows
+
+
+def summarize_imports(rows: List[Tuple[str, int, int]], top: int) -> Dict:
+    """按顶层包汇总自身耗时，返回总耗时、最慢的包和导入过的重依赖。"""
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+    slowest = sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    modules = {name for name, _, _ in rows}
+    return {
+        "import_ms": round(sum(by_package.values()) / 1000, 1),
+        "modules": len(rows),
+        "top_packages": [{"package": name, "ms": round(us / 1000, 1)} for name, us in slowest],
+        "heavy_imported": [name for name in HEAVY_MODULES if name in modules],
+    }
+
+
+def _run(code: str, env: Dict[str, str], importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", _DENY_NETWORK + code]
+    return subprocess.run(command, cwd=ROOT_DIR, env=env, capture_output=True, text=True)
+
+
+def measure_target(code: str, env: Dict[str, str], repeat: int, top: int) -> Dict:
+    """测量一个目标：挂钟时间取repeat次的中位数，导入明细来自一次importtime运行。"""
+    # 第一次运行预热文件系统缓存和__pycache__，不计入结果
+    result = _run(code, env)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr else "failed"}
+
+    wall = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _run(code, env)
+        wall.append((time.perf_counter() - start) * 1000)
+
+    detail = summarize_imports(parse_importtime(_run(code, env, importtime=True).stderr), top)
+    return {
+        "wall_ms": round(statistics.median(wall), 1),
+        "wall_min_ms": round(min(wall), 1),
+        **detail,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="命令行启动耗时基准。")
+    parser.add_argument(
+        "--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS), help="要测量的目标"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="每个目标的重复次数")
+    parser.add_argument("--top", type=int, default=10, help="每个目标列出的最慢的包数")
+    parser.add_argument(
+        "--budget-ms", type=float, default=1000.0, help="启动耗时上限，任一子命令超过时返回非零状态"
+    )
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = isolated_environment(Path(tmp_dir))
+        results = {
+            name: measure_target(TARGETS[name], env, args.repeat, args.top)
+            for name in args.targets
+        }
+
+    over_budget = []
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<8} 失败: {result['error']}")
+            over_budget.append(name)
+            continue
+        packages = ", ".join(f"{p['package']} {p['ms']:.0f}ms" for p in result["top_packages"][:5])
+        print(
+            f"{name:<8} {result['wall_ms']:>7.0f}ms  (导入 {result['import_ms']:.0f}ms, "
+            f"{result['modules']} 个模块)  {packages}"
+        )
+        if result["heavy_imported"]:
+            print(f"{'':<8} 导入了: {', '.join(result['heavy_imported'])}")
+        if name != "python" and result["wall_ms"] > args.budget_ms:
+            over_budget.append(name)
+
+    report = {
+        "benchmark": "startup",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "params": {"repeat": args.repeat, "budget_ms": args.budget_ms},
+        "targets": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+    if over_budget:
+        print(f"\n超过 {args.budget_ms:.0f}ms 的目标: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+pytest共享夹具：测试不读写项目自己的db/和logs/目录
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# 在导入src之前设置：未显式指定时，向量库、关系库和嵌入缓存都放在临时目录，
+# 并关闭查询日志；测试查询日志的用例自行创建写入tmp_path的QueryLogWriter
+_TEST_DIR = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("DB_DIR", os.path.join(_TEST_DIR, "db"))
+os.environ.setdefault("SQLITE_DB_PATH", os.path.join(_TEST_DIR, "example.db"))
+os.environ.setdefault("QUERY_LOG_ENABLED", "false")
+os.environ.setdefault("QUERY_LOG_PATH", os.path.join(_TEST_DIR, "logs", "queries.jsonl"))
+
+from src.embedding_model import embedding_model  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def disable_embedding_cache(monkeypatch):
+    """默认不使用嵌入缓存；需要缓存的测试自行设置指向tmp_path的缓存"""
+    monkeypatch.setattr(embedding_model, "_cache", None)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_TEST_DIR, ignore_errors=True)
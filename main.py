@@ -5,13 +5,29 @@
 """
 
 import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
 import time
+from typing import Any, Dict, List, Optional
 
-import uvicorn
+from src.config import (
+    LANCEDB_TABLE_NAME,
+    SERVER_ACCESS_LOG,
+    SERVER_BACKLOG,
+    SERVER_GRACEFUL_TIMEOUT,
+    SERVER_HOST,
+    SERVER_KEEP_ALIVE,
+    SERVER_PORT,
+    SERVER_WORKERS,
+    setup_logging,
+    get_logger,
+)
 
-from src.config import setup_logging, get_logger
-from src.indexing import run_indexing
-from src.rag_pipeline import get_rag_response
+# 各子命令用到的模块（lancedb、langchain、uvicorn等）导入耗时数秒，
+# 只在对应的子命令函数中导入，见 bench/startup.py
 
 # 设置统一的日志配置
 setup_logging()
@@ -20,11 +36,28 @@ setup_logging()
 logger = get_logger(__name__)
 
 
-def run_chat_interface():
+def _warm_up_retrieval():
+    """导入问答流水线并打开向量表，失败时留到真正提问时再报告。"""
+    try:
+        import src.rag_pipeline  # noqa: F401
+        from src.db_manager import db_manager
+
+        db_manager.get_table(LANCEDB_TABLE_NAME)
+    except Exception as e:
+        logger.debug(f"预加载检索依赖失败: {e}")
+
+
+def run_chat_interface(stream: bool = False):
     """
     启动交互式命令行界面用于提问。
+
+    Args:
+        stream (bool): 如果为True，边生成边输出回答，并显示首个token的响应时间。
     """
     logger.info("--- 启动RAG聊天界面 ---")
+    # 等待用户输入第一个问题的同时在后台加载检索依赖和表句柄
+    warm_up = threading.Thread(target=_warm_up_retrieval, daemon=True)
+    warm_up.start()
     print("\n欢迎使用RAG问答系统！输入'exit'退出。")
 
     while True:
@@ -38,6 +71,13 @@ def run_chat_interface():
             continue
 
         start_time = time.time()
+        warm_up.join()
+        if stream:
+            print_streaming_answer(query, start_time)
+            continue
+
+        from src.rag_pipeline import get_rag_response
+
         response = get_rag_response(query)
         end_time = time.time()
 
@@ -53,6 +93,101 @@ def run_chat_interface():
         #     )
 
 
+def print_streaming_answer(query: str, start_time: float):
+    """流式输出单个问题的回答。"""
+    from src.rag_pipeline import stream_rag_response
+
+    first_token_time = None
+    print("\n--- 回答 ---")
+    for event in stream_rag_response(query):
+        if event["event"] == "token":
+            if first_token_time is None:
+                first_token_time = time.time()
+            print(event["data"], end="", flush=True)
+        elif event["event"] == "error":
+            print(event["data"])
+    end_time = time.time()
+
+    first_token = (
+        f"首个token {first_token_time - start_time:.2f}s, "
+        if first_token_time is not None
+        else ""
+    )
+    print(f"\n\n({first_token}响应时间 {end_time - start_time:.2f}s)")
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    读取JSON Lines格式的问题文件。
+
+    每行是一个包含 "query" 字段的JSON对象，其余字段（如 "id"）原样写入结果；
+    空行被跳过。
+
+    Raises:
+        ValueError: 某行不是合法的JSON对象或缺少query字段
+    """
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_num} 不是合法的JSON: {e}") from e
+            if not isinstance(record, dict) or not str(record.get("query", "")).strip():
+                raise ValueError(f"{path}:{line_num} 缺少query字段")
+            records.append(record)
+    return records
+
+
+async def run_batch_questions(
+    records: List[Dict[str, Any]], output, concurrency: Optional[int] = None
+) -> int:
+    """批量回答问题，每完成一个就向output写入一行JSON，返回写入的行数。"""
+    from src.http_client import aclose_async_client
+    from src.rag_pipeline import abatch_rag_responses
+
+    written = 0
+    try:
+        async for index, response in abatch_rag_responses(
+            [record["query"] for record in records], concurrency=concurrency
+        ):
+            line = {"index": index, **records[index], **response}
+            output.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+            output.flush()
+            written += 1
+    finally:
+        await aclose_async_client()
+    return written
+
+
+def run_batch_file(input_path: str, output_path: Optional[str], concurrency: Optional[int]):
+    """
+    从JSON Lines文件读取问题并批量回答，结果按完成顺序写入output_path（默认标准输出）。
+
+    Args:
+        input_path (str): 问题文件路径
+        output_path (str, optional): 结果文件路径
+        concurrency (int, optional): LLM生成的最大并发数
+    """
+    records = read_questions(input_path)
+    logger.info(f"从 {input_path} 读取了 {len(records)} 个问题")
+
+    start_time = time.time()
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as output:
+            written = asyncio.run(run_batch_questions(records, output, concurrency))
+    else:
+        written = asyncio.run(run_batch_questions(records, sys.stdout, concurrency))
+    elapsed = time.time() - start_time
+
+    logger.info(
+        f"批量问答完成: {written} 个问题, 用时 {elapsed:.2f}s "
+        f"({written / elapsed if elapsed else 0:.1f} 个/秒)"
+    )
+
+
 def main():
     """
     解析命令行参数并运行选定模式的主函数。
@@ -68,23 +203,49 @@ def main():
     parser_index.add_argument(
         "--reindex",
         action="store_true",
-        help="如果设置，在开始前删除现有索引。",
+        help="如果设置，在开始前删除现有索引并全量重建；否则只增量处理变化的文件。",
     )
 
     def index_func(args):
         """调用run_indexing的辅助函数。"""
+        from src.indexing import run_indexing
+
         run_indexing(reindex=args.reindex)
 
     parser_index.set_defaults(func=index_func)
 
     # 问答子命令
     parser_ask = subparsers.add_parser(
-        "ask", help="启动交互式聊天界面来提问。"
+        "ask", help="启动交互式聊天界面来提问，或用--file批量回答文件中的问题。"
+    )
+    parser_ask.add_argument(
+        "--stream",
+        action="store_true",
+        help="如果设置，边生成边输出回答。",
+    )
+    parser_ask.add_argument(
+        "--file",
+        help="JSON Lines格式的问题文件，每行一个包含query字段的对象。",
+    )
+    parser_ask.add_argument(
+        "--output",
+        help="与--file一起使用，结果写入的JSON Lines文件，默认输出到标准输出。",
+    )
+    parser_ask.add_argument(
+        "--concurrency",
+        type=int,
+        help="与--file一起使用，LLM生成的最大并发数，默认使用BATCH_LLM_CONCURRENCY。",
     )
 
     def ask_func(args):
-        """调用run_chat_interface的辅助函数。"""
-        run_chat_interface()
+        """有--file时批量回答，否则启动交互式聊天界面。"""
+        if args.file:
+            try:
+                run_batch_file(args.file, args.output, args.concurrency)
+            except (OSError, ValueError) as e:
+                parser_ask.error(str(e))
+            return
+        run_chat_interface(stream=args.stream)
 
     parser_ask.set_defaults(func=ask_func)
 
@@ -92,11 +253,58 @@ def main():
     parser_serve = subparsers.add_parser(
         "serve", help="启动FastAPI服务器。"
     )
+    parser_serve.add_argument("--host", default=SERVER_HOST, help="监听地址。")
+    parser_serve.add_argument("--port", type=int, default=SERVER_PORT, help="监听端口。")
+    parser_serve.add_argument(
+        "--workers",
+        type=int,
+        default=SERVER_WORKERS,
+        help="工作进程数，0表示按CPU核数启动。",
+    )
+    parser_serve.add_argument(
+        "--keep-alive",
+        type=int,
+        default=SERVER_KEEP_ALIVE,
+        help="空闲的keep-alive连接保持的秒数。",
+    )
+    parser_serve.add_argument(
+        "--backlog", type=int, default=SERVER_BACKLOG, help="监听队列的最大长度。"
+    )
+    parser_serve.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=SERVER_GRACEFUL_TIMEOUT,
+        help="关闭时等待正在处理的请求完成的最长秒数。",
+    )
+    parser_serve.add_argument(
+        "--reload",
+        action="store_true",
+        help="开发模式：单进程运行，代码变化时自动重启。",
+    )
 
     def run_server(args):
         """启动Uvicorn服务器。"""
-        logger.info("在 http://127.0.0.1:8000 启动FastAPI服务器")
-        uvicorn.run("src.api:app", host="127.0.0.1", port=8000, reload=True)
+        import uvicorn
+
+        if args.reload:
+            logger.info(f"在 http://{args.host}:{args.port} 以开发模式启动FastAPI服务器")
+            uvicorn.run("src.api:app", host=args.host, port=args.port, reload=True)
+            return
+
+        workers = args.workers or os.cpu_count() or 1
+        logger.info(
+            f"在 http://{args.host}:{args.port} 启动FastAPI服务器，{workers} 个工作进程"
+        )
+        uvicorn.run(
+            "src.api:app",
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            timeout_keep_alive=args.keep_alive,
+            backlog=args.backlog,
+            timeout_graceful_shutdown=args.graceful_timeout,
+            access_log=SERVER_ACCESS_LOG,
+        )
 
     parser_serve.set_defaults(func=run_server)
 
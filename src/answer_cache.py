@@ -0,0 +1,217 @@
+"""get_rag_response前面的语义回答缓存。
+
+先按规范化后的查询文本精确匹配，未命中时再在已回答查询的嵌入向量中做
+最近邻查找，余弦相似度达到阈值即视为命中。条目有TTL和LRU容量上限；
+索引流程提交新的表版本后，整个缓存失效。
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from src.config import get_logger
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+# 规范化时去掉的结尾标点
+_TRAILING_PUNCTUATION = "?？!！。.，,;；:： "
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询：去除首尾空白和结尾标点，合并连续空白，英文转小写。"""
+    query = re.sub(r"\s+", " ", query.strip()).lower()
+    return query.rstrip(_TRAILING_PUNCTUATION)
+
+
+@dataclass
+class _Entry:
+    scope: str
+    response: Dict[str, Any]
+    vector: Optional[np.ndarray]  # 已归一化的查询向量
+    created_at: float
+
+
+class AnswerCache:
+    """
+    线程安全的回答缓存，支持精确匹配和基于向量相似度的近似匹配。
+
+    条目按scope（如检索过滤条件）隔离，近似匹配只在同一scope内进行。
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        ttl_seconds: float,
+        similarity_threshold: float,
+        version_provider: Optional[Callable[[], Hashable]] = None,
+    ):
+        """
+        Args:
+            capacity (int): 最大条目数，超出后淘汰最久未使用的条目。
+            ttl_seconds (float): 条目有效期（秒）。
+            similarity_threshold (float): 近似匹配所需的最小余弦相似度。
+            version_provider (Callable, optional): 返回当前表版本标识的函数；
+                标识变化时清空缓存。
+        """
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_provider = version_provider
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[Hashable] = None
+        # 每个scope的近似匹配向量矩阵 (条目键列表, 矩阵)，条目变化后惰性重建
+        self._matrices: Dict[str, Tuple[list, np.ndarray]] = {}
+
+    def _check_version_locked(self):
+        if self.version_provider is None:
+            return
+        version = self.version_provider()
+        if version != self._version:
+            if self._entries:
+                logger.info("知识库版本已变化，清空回答缓存")
+            self._entries.clear()
+            self._matrices.clear()
+            self._version = version
+
+    def _expire_locked(self, key: Tuple[str, str], entry: _Entry) -> bool:
+        if time.time() - entry.created_at > self.ttl_seconds:
+            del self._entries[key]
+            self._matrices.pop(entry.scope, None)
+            return True
+        return False
+
+    def get(
+        self, query: str, query_vector: Optional[np.ndarray] = None, scope: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """
+        查询缓存。
+
+        Args:
+            query (str): 原始查询。
+            query_vector (np.ndarray, optional): 查询的嵌入向量；提供时在精确匹配
+                未命中后进行近似匹配。
+            scope (str): 缓存分区，只匹配同一分区中的条目。
+
+        Returns:
+            Optional[Dict[str, Any]]: 缓存的响应副本，未命中时返回None。
+        """
+        key = (scope, normalize_query(query))
+        with self._lock:
+            self._check_version_locked()
+
+            entry = self._entries.get(key)
+            if entry is not None and not self._expire_locked(key, entry):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return dict(entry.response)
+
+            if query_vector is None:
+                return None
+
+            match = self._nearest_locked(scope, query_vector)
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.semantic_hits += 1
+                return dict(self._entries[match].response)
+
+            self.misses += 1
+            return None
+
+    def _nearest_locked(
+        self, scope: str, query_vector: np.ndarray
+    ) -> Optional[Tuple[str, str]]:
+        """返回同一scope中相似度达到阈值的最近条目键。"""
+        # 先淘汰该scope中过期的条目，避免过期的最近条目挡住其他有效条目
+        now = time.time()
+        expired = [
+            key
+            for key, entry in self._entries.items()
+            if entry.scope == scope and now - entry.created_at > self.ttl_seconds
+        ]
+        for key in expired:
+            self._expire_locked(key, self._entries[key])
+        if scope not in self._matrices:
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if entry.scope == scope and entry.vector is not None
+            ]
+            matrix = (
+                np.vstack([self._entries[key].vector for key in keys])
+                if keys
+                else np.empty((0, 0), dtype=np.float32)
+            )
+            self._matrices[scope] = (keys, matrix)
+        keys, matrix = self._matrices[scope]
+        if not keys:
+            return None
+
+        vector = _normalize(query_vector)
+        if vector is None or vector.shape[0] != matrix.shape[1]:
+            return None
+        similarities = matrix @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        key = keys[best]
+        logger.info(f"回答缓存近似命中，相似度 {similarities[best]:.4f}")
+        return key
+
+    def put(
+        self,
+        query: str,
+        response: Dict[str, Any],
+        query_vector: Optional[np.ndarray] = None,
+        scope: str = "",
+    ):
+        """写入一条缓存，超出容量时淘汰最久未使用的条目。"""
+        key = (scope, normalize_query(query))
+        vector = _normalize(query_vector) if query_vector is not None else None
+        with self._lock:
+            self._check_version_locked()
+            self._entries[key] = _Entry(
+                scope=scope, response=dict(response), vector=vector, created_at=time.time()
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                _, evicted = self._entries.popitem(last=False)
+                self._matrices.pop(evicted.scope, None)
+            self._matrices.pop(scope, None)
+
+    def clear(self):
+        """清空缓存。"""
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计。"""
+        with self._lock:
+            total = self.exact_hits + self.semantic_hits + self.misses
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / total if total else 0.0,
+            }
+
+
+def _normalize(vector: np.ndarray) -> Optional[np.ndarray]:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0 or not np.isfinite(norm):
+        return None
+    return vector / norm
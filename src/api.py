@@ -4,33 +4,223 @@
 包括提问和触发索引过程。它使用FastAPI
 创建Web服务器，使用Pydantic进行数据验证。
 """
-from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import signal
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Annotated, Any, Dict, List, Optional, Union
 
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
 
-from src.config import get_logger
-from src.indexing import run_indexing
-from src.rag_pipeline import get_rag_response
+from src.config import (
+    BATCH_MAX_QUERIES,
+    EVENT_LOOP_LAG_INTERVAL,
+    LANCEDB_TABLE_NAME,
+    SERVER_DRAIN_DELAY,
+    get_logger,
+)
+from src.db_manager import db_manager
+from src.embedding_model import embedding_model
+from src.jobs import JobConflictError, job_manager
+from src.http_client import aclose_async_client, get_async_client
+from src.metrics import collect_timings, monitor_event_loop_lag, registry
+from src.rag_pipeline import (
+    abatch_rag_responses,
+    aget_rag_response,
+    answer_cache,
+    astream_rag_response,
+)
 
 # 获取模块专用的logger
 logger = get_logger(__name__)
 
+class InflightTracker:
+    """
+    统计正在处理的HTTP请求数（流式响应直到最后一个数据块发出才算完成），
+    以及服务是否已开始关闭。只在事件循环线程中访问，不需要加锁。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+
+
+class InflightMiddleware:
+    """用InflightTracker统计请求的ASGI中间件。"""
+
+    def __init__(self, app, tracker: InflightTracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.tracker.count += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.tracker.count -= 1
+
+
+inflight = InflightTracker()
+
+
+def install_drain_handler(loop: asyncio.AbstractEventLoop, delay: float):
+    """
+    包装uvicorn的SIGTERM处理函数：收到信号时立即标记draining，让就绪探测返回503，
+    delay秒后再交给uvicorn开始关闭（停止接受连接、等待请求完成）。
+
+    uvicorn在lifespan启动之前安装信号处理函数，关闭结束后恢复原来的处理函数。
+    再次收到SIGTERM时立即开始关闭。只能在主线程中调用。
+
+    Args:
+        loop: 服务所在的事件循环
+        delay (float): 标记draining到开始关闭之间的秒数
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous):
+        return
+
+    def on_sigterm(sig, frame):
+        if inflight.draining or delay <= 0:
+            inflight.draining = True
+            previous(sig, frame)
+            return
+        inflight.draining = True
+        logger.info(f"收到SIGTERM，就绪探测返回503，{delay:.1f}s 后开始关闭")
+        loop.call_soon_threadsafe(loop.call_later, delay, previous, sig, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    启动时预先建立数据库连接、打开表并创建HTTP客户端，开始采样事件循环延迟，
+    并安装SIGTERM处理函数（见install_drain_handler）；关闭阶段在uvicorn等待
+    正在处理的请求（最多 --graceful-timeout 秒）之后执行，只负责释放资源。
+
+    多进程部署时每个工作进程各自执行一次。
+    """
+    if not db_manager.warmup(LANCEDB_TABLE_NAME):
+        logger.warning(f"启动时未能打开表 '{LANCEDB_TABLE_NAME}'，请先运行索引。")
+    get_async_client()
+    lag_monitor = None
+    if EVENT_LOOP_LAG_INTERVAL > 0:
+        lag_monitor = asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL))
+    # 测试客户端等在其它线程中运行lifespan时不能安装信号处理函数
+    if threading.current_thread() is threading.main_thread():
+        install_drain_handler(asyncio.get_running_loop(), SERVER_DRAIN_DELAY)
+    yield
+    inflight.draining = True
+    if inflight.count:
+        logger.warning(f"关闭时仍有 {inflight.count} 个请求未完成")
+    if lag_monitor is not None:
+        lag_monitor.cancel()
+    job_manager.shutdown()
+    await aclose_async_client()
+    db_manager.close()
+
+
+def _cache_metrics():
+    """导出回答缓存和嵌入缓存的命中统计，在 /metrics 被请求时读取。"""
+    caches = []
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        caches.append(("answer", hits, stats["misses"], stats["hit_ratio"]))
+    if embedding_model.cache is not None:
+        stats = embedding_model.cache.stats()
+        caches.append(("embedding", stats["hits"], stats["misses"], stats["hit_ratio"]))
+    yield (
+        "rag_cache_hits_total",
+        "counter",
+        "缓存命中次数",
+        [({"cache": name}, hits) for name, hits, _, _ in caches],
+    )
+    yield (
+        "rag_cache_misses_total",
+        "counter",
+        "缓存未命中次数",
+        [({"cache": name}, misses) for name, _, misses, _ in caches],
+    )
+    yield (
+        "rag_cache_hit_ratio",
+        "gauge",
+        "缓存命中率",
+        [({"cache": name}, ratio) for name, _, _, ratio in caches],
+    )
+
+
+registry.register_collector(_cache_metrics)
+
+
 # 初始化FastAPI应用
 app = FastAPI(
     title="RAG系统API",
     description="用于索引文档和提问的API。",
     version="1.0.0",
+    lifespan=lifespan,
 )
+app.add_middleware(InflightMiddleware, tracker=inflight)
 
 
 # --- 用于请求/响应的Pydantic模型 ---
 
 
-class QueryRequest(BaseModel):
+class SearchFilters(BaseModel):
+    """检索预过滤条件，各字段之间为AND关系；列表表示取其中任意一个值，不能为空。"""
+
+    model_config = ConfigDict(extra="forbid")
+
+    # 相对于数据目录的文件路径
+    source: Optional[Union[str, Annotated[List[str], Field(min_length=1)]]] = None
+    # 路径前缀，如 "tenant_a/" 表示只检索该子目录下的文档
+    source_prefix: Optional[str] = None
+    # 文件扩展名，如 "pdf"
+    doc_type: Optional[Union[str, Annotated[List[str], Field(min_length=1)]]] = None
+    paragraph_num: Optional[Union[int, Annotated[List[int], Field(min_length=1)]]] = None
+    # 句子在所属段落中的序号
+    sentence_num_in_para: Optional[Union[int, Annotated[List[int], Field(min_length=1)]]] = None
+    ingested_after: Optional[datetime] = None
+    ingested_before: Optional[datetime] = None
+
+
+class SearchOptions(BaseModel):
+    """问答请求共用的检索参数。"""
+
+    # 可选的ANN检索参数，覆盖config中的SEARCH_NPROBES/SEARCH_REFINE_FACTOR
+    nprobes: Optional[int] = Field(default=None, ge=1)
+    refine_factor: Optional[int] = Field(default=None, ge=0)
+    # 可选的预过滤条件，只在匹配的文档中检索
+    filters: Optional[SearchFilters] = None
+
+    def filter_dict(self) -> Optional[Dict[str, Any]]:
+        """返回传给流水线的过滤条件，未设置时返回None。"""
+        if self.filters is None:
+            return None
+        return self.filters.model_dump(exclude_none=True) or None
+
+
+class QueryRequest(SearchOptions):
     """用于/ask端点的请求模型。"""
 
     query: str
+    # 为True时在响应中返回本次请求各阶段的耗时（毫秒）
+    include_timings: bool = False
+
+
+class BatchQueryRequest(SearchOptions):
+    """用于/ask/batch端点的请求模型；检索参数和过滤条件对所有查询生效。"""
+
+    queries: List[str] = Field(min_length=1, max_length=BATCH_MAX_QUERIES)
+    # LLM生成的最大并发数，覆盖config中的BATCH_LLM_CONCURRENCY
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64)
 
 
 class ContextItem(BaseModel):
@@ -39,6 +229,8 @@ class ContextItem(BaseModel):
     text: str
     metadata: Dict[str, Any]
     score: float
+    sentence: Optional[str] = None
+    paragraph: Optional[str] = None
 
 
 class AskResponse(BaseModel):
@@ -46,14 +238,25 @@ class AskResponse(BaseModel):
 
     llm_answer: str
     retrieved_context: List[ContextItem]
+    timings: Optional[Dict[str, float]] = None
 
 
-class IndexResponse(BaseModel):
-    """用于/index端点的响应模型。"""
+class IndexJobResponse(BaseModel):
+    """索引任务状态的响应模型。"""
 
+    job_id: str
+    reindex: bool
     status: str
-    message: str
-    duration_seconds: Optional[float] = None
+    stage: str
+    progress: Dict[str, int]
+    throughput_per_second: Dict[str, float]
+    elapsed_seconds: float
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
 
 
 # --- API端点 ---
@@ -63,6 +266,8 @@ class IndexResponse(BaseModel):
 async def ask_question(request: QueryRequest):
     """
     接收问题，检索相关上下文，并返回答案。
+
+    使用异步流水线，等待嵌入和LLM响应时不会阻塞其它请求。
     """
     if not request.query.strip():
         raise HTTPException(
@@ -71,7 +276,16 @@ async def ask_question(request: QueryRequest):
 
     logger.info(f"API /ask端点被调用，查询: '{request.query}'")
     try:
-        response_data = get_rag_response(request.query)
+        with collect_timings() as timings:
+            response_data = await aget_rag_response(
+                request.query,
+                nprobes=request.nprobes,
+                refine_factor=request.refine_factor,
+                filters=request.filter_dict(),
+            )
+        if request.include_timings:
+            # 命中缓存时response_data是缓存中的对象，不能直接修改
+            return {**response_data, "timings": {k: round(v, 3) for k, v in timings.items()}}
         return response_data
     except Exception as e:
         logger.error(f"RAG流水线错误: {e}", exc_info=True)
@@ -80,24 +294,143 @@ async def ask_question(request: QueryRequest):
         ) from e
 
 
-@app.post("/index", response_model=IndexResponse)
+def _format_sse(event: Dict[str, Any]) -> str:
+    """把流水线事件编码为一条Server-Sent Events消息。"""
+    data = json.dumps(event["data"], ensure_ascii=False)
+    return f"event: {event['event']}\ndata: {data}\n\n"
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest):
+    """
+    以Server-Sent Events流式返回答案。
+
+    先发送 context 事件（检索到的上下文），随后逐段发送 token 事件，
+    最后发送包含完整回答的 done 事件；出错时发送 error 事件。
+    """
+    if not request.query.strip():
+        raise HTTPException(
+            status_code=400, detail="查询不能为空。"
+        )
+
+    logger.info(f"API /ask/stream端点被调用，查询: '{request.query}'")
+
+    async def event_stream():
+        async for event in astream_rag_response(
+            request.query,
+            nprobes=request.nprobes,
+            refine_factor=request.refine_factor,
+            filters=request.filter_dict(),
+        ):
+            yield _format_sse(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 禁止中间代理缓冲，保证首个token尽快到达客户端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ask/batch")
+async def ask_questions_batch(request: BatchQueryRequest):
+    """
+    批量问答，以JSON Lines（application/x-ndjson）逐行返回结果。
+
+    每行是一个查询的结果：{"index", "query", "llm_answer", "retrieved_context"}，
+    按完成顺序输出，index是查询在queries中的下标。所有查询一次批量编码并合并
+    为多向量检索，LLM生成以有限的并发执行。
+    """
+    if any(not query.strip() for query in request.queries):
+        raise HTTPException(
+            status_code=400, detail="查询不能为空。"
+        )
+
+    logger.info(f"API /ask/batch端点被调用，查询数: {len(request.queries)}")
+
+    async def result_lines():
+        async for index, response in abatch_rag_responses(
+            request.queries,
+            nprobes=request.nprobes,
+            refine_factor=request.refine_factor,
+            filters=request.filter_dict(),
+            concurrency=request.concurrency,
+        ):
+            line = {"index": index, "query": request.queries[index], **response}
+            yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/health/live")
+async def liveness():
+    """存活探测：进程能响应请求即返回200。"""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """就绪探测：表已打开且服务没有在关闭时返回200，否则返回503。"""
+    if inflight.draining:
+        raise HTTPException(status_code=503, detail="服务正在关闭。")
+    table = await asyncio.to_thread(db_manager.get_table, LANCEDB_TABLE_NAME)
+    if table is None:
+        raise HTTPException(status_code=503, detail=f"表 '{LANCEDB_TABLE_NAME}' 尚未打开。")
+    return {"status": "ready", "table": LANCEDB_TABLE_NAME}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    以Prometheus文本格式导出各阶段耗时直方图、token用量和缓存命中统计。
+
+    指标保存在各工作进程的内存中，多进程部署时只反映处理这次抓取的那个进程。
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/index", response_model=IndexJobResponse, status_code=202)
 async def trigger_indexing(reindex: bool = False):
     """
-    触发文档索引流水线。
+    提交后台索引任务并立即返回任务信息。
+
+    同一时刻只允许一个索引任务（包括其它工作进程和命令行发起的索引）；
+    已有任务在进行时返回409。通过 GET /index/{job_id} 查询进度，
+    POST /index/{job_id}/cancel 取消，两者可以由任一工作进程处理。
 
     Args:
-        reindex (bool): 如果为True，将在处理文档前删除现有索引。默认为False。
+        reindex (bool): 如果为True，重新处理所有文档并在完成后替换现有索引。默认为False。
     """
     logger.info(f"API /index端点被调用，reindex={reindex}")
     try:
-        # 注意：这是同步运行的，会阻塞服务器。
-        # 在生产环境中，这应该是一个后台任务
-        # （例如，使用Celery）。
-        result = run_indexing(reindex=reindex)
-        return result
-    except Exception as e:
-        logger.error(f"索引过程中的错误: {e}", exc_info=True)
+        job = await asyncio.to_thread(job_manager.submit, reindex)
+    except JobConflictError as e:
         raise HTTPException(
-            status_code=500,
-            detail=f"索引过程中的内部服务器错误: {e}",
+            status_code=409,
+            detail=f"已有索引任务正在进行: {e.active_job_id}",
         ) from e
+    return job.to_dict()
+
+
+@app.get("/index", response_model=List[IndexJobResponse])
+async def list_indexing_jobs():
+    """列出最近的索引任务。"""
+    return await asyncio.to_thread(job_manager.list)
+
+
+@app.get("/index/{job_id}", response_model=IndexJobResponse)
+async def get_indexing_job(job_id: str):
+    """查询索引任务的状态、各阶段进度和吞吐量。"""
+    job = await asyncio.to_thread(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"索引任务不存在: {job_id}")
+    return job
+
+
+@app.post("/index/{job_id}/cancel", response_model=IndexJobResponse)
+async def cancel_indexing_job(job_id: str):
+    """请求取消索引任务，任务会在下一个检查点停止。"""
+    job = await asyncio.to_thread(job_manager.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"索引任务不存在: {job_id}")
+    return job
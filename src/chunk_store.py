@@ -0,0 +1,183 @@
+"""Small2Big的段落存储。
+
+向量表中只保存句子级的行，句子所属的段落原文保存在SQLite中（见
+db_manager.SQLITE_SCHEMA）。检索命中句子后，用一条查询批量取回这些句子的
+父段落，把段落作为LLM的上下文。所有数据按向量表的物理表名隔离，与表的
+代（generation）一起创建和删除。增量索引先把段落写入暂存区（staging_name），
+提交时在一个事务中替换对应文件的段落。
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.config import get_logger
+from src.db_manager import DatabaseManager, db_manager
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+
+def staging_name(table_name: str) -> str:
+    """增量索引暂存段落使用的表名，提交前查询路径读取不到。"""
+    return f"{table_name}#staging"
+
+
+class ParagraphStore:
+    """
+    段落及句子-段落关联的存储，使用db_manager的SQLite连接池。
+    """
+
+    def __init__(self, manager: DatabaseManager):
+        self.manager = manager
+
+    def put_file(
+        self,
+        table_name: str,
+        file_key: str,
+        paragraphs: List[Tuple[str, str]],
+        relations: List[Tuple[str, str]],
+    ):
+        """
+        在一个事务中写入一个文件的段落和句子关联，先删除该文件已有的数据。
+
+        Args:
+            table_name (str): 向量表的物理表名。
+            file_key (str): 文件键（见index_manifest.file_key）。
+            paragraphs (List[Tuple[str, str]]): (段落id, 段落原文)。
+            relations (List[Tuple[str, str]]): (句子行id, 段落id)。
+        """
+        with self.manager.sqlite_connection() as conn:
+            with conn:
+                self._delete_files(conn, table_name, [file_key])
+                conn.executemany(
+                    "INSERT INTO detail_para_chunk (table_name, chunk_id, file_key, chunk_content) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(table_name, chunk_id, file_key, text) for chunk_id, text in paragraphs],
+                )
+                conn.executemany(
+                    "INSERT INTO rel_para_sentence (table_name, sentence_id, chunk_id, file_key) "
+                    "VALUES (?, ?, ?, ?)",
+                    [
+                        (table_name, sentence_id, chunk_id, file_key)
+                        for sentence_id, chunk_id in relations
+                    ],
+                )
+
+    @staticmethod
+    def _delete_files(conn, table_name: str, file_keys: List[str]):
+        for table in ("detail_para_chunk", "rel_para_sentence"):
+            conn.executemany(
+                f"DELETE FROM {table} WHERE table_name = ? AND file_key = ?",
+                [(table_name, file_key) for file_key in file_keys],
+            )
+
+    def delete_files(self, table_name: str, file_keys: Iterable[str]):
+        """删除若干文件的段落和关联，用于增量索引时移除已修改或已删除的文件。"""
+        file_keys = list(file_keys)
+        if not file_keys:
+            return
+        with self.manager.sqlite_connection() as conn:
+            with conn:
+                self._delete_files(conn, table_name, file_keys)
+
+    def commit_staged(self, table_name: str, file_keys: Iterable[str]):
+        """
+        在一个事务中提交增量索引暂存的段落：删除若干文件在table_name下的旧段落，
+        再把暂存区的段落移到table_name下。
+
+        Args:
+            table_name (str): 向量表的物理表名。
+            file_keys (Iterable[str]): 已修改或已删除的文件键，暂存区中的文件是其子集。
+        """
+        file_keys = list(file_keys)
+        with self.manager.sqlite_connection() as conn:
+            with conn:
+                self._delete_files(conn, table_name, file_keys)
+                for table in ("detail_para_chunk", "rel_para_sentence"):
+                    conn.execute(
+                        f"UPDATE {table} SET table_name = ? WHERE table_name = ?",
+                        (table_name, staging_name(table_name)),
+                    )
+
+    def drop_table(self, table_name: str):
+        """删除某张物理表对应的全部数据。"""
+        with self.manager.sqlite_connection() as conn:
+            with conn:
+                for table in ("detail_para_chunk", "rel_para_sentence"):
+                    conn.execute(f"DELETE FROM {table} WHERE table_name = ?", (table_name,))
+
+    def fetch_parents(
+        self, table_name: str, sentence_ids: List[str]
+    ) -> Dict[str, Tuple[str, str]]:
+        """
+        用一条查询批量取回句子所属的段落。
+
+        Args:
+            table_name (str): 向量表的物理表名。
+            sentence_ids (List[str]): 命中的句子行id。
+
+        Returns:
+            Dict[str, Tuple[str, str]]: {句子id: (段落id, 段落原文)}，没有段落的句子不在其中。
+        """
+        if not sentence_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in sentence_ids)
+        with self.manager.sqlite_connection() as conn:
+            rows = conn.execute(
+                "SELECT r.sentence_id, p.chunk_id, p.chunk_content "
+                "FROM rel_para_sentence AS r JOIN detail_para_chunk AS p "
+                "ON p.table_name = r.table_name AND p.chunk_id = r.chunk_id "
+                f"WHERE r.table_name = ? AND r.sentence_id IN ({placeholders})",
+                [table_name, *sentence_ids],
+            ).fetchall()
+        return {sentence_id: (chunk_id, text) for sentence_id, chunk_id, text in rows}
+
+
+def attach_parent_paragraphs(
+    store: Optional[ParagraphStore], table_name: str, results: List[dict]
+) -> List[dict]:
+    """
+    为句子级检索结果附加父段落，并按段落去重。
+
+    每个结果增加 sentence（命中的句子）和 paragraph（所属段落）字段，text替换为
+    段落原文，metadata["has_context"] 表示是否找到了段落。多个句子属于同一段落时
+    只保留得分最好（排在最前）的一个，避免LLM上下文中出现重复段落。
+
+    Args:
+        store (ParagraphStore, optional): 段落存储；为None时只补充sentence字段。
+        table_name (str): 向量表的物理表名。
+        results (List[dict]): search_by_vector的结果（需包含id），按得分排序。
+
+    Returns:
+        List[dict]: 附加了段落上下文的结果。
+    """
+    parents = {}
+    if store is not None:
+        try:
+            parents = store.fetch_parents(
+                table_name, [r["id"] for r in results if r.get("id")]
+            )
+        except Exception as e:
+            logger.error(f"获取父段落失败，使用句子作为上下文: {e}")
+
+    seen_paragraphs = set()
+    merged = []
+    for result in results:
+        parent = parents.get(result.get("id"))
+        result = dict(result, sentence=result["text"])
+        result["metadata"] = dict(result["metadata"], has_context=parent is not None)
+        if parent is not None:
+            chunk_id, paragraph = parent
+            if chunk_id in seen_paragraphs:
+                continue
+            seen_paragraphs.add(chunk_id)
+            result["paragraph"] = paragraph
+            result["text"] = paragraph
+        else:
+            result["paragraph"] = None
+        merged.append(result)
+
+    if len(merged) < len(results):
+        logger.info(f"{len(results)} 个命中句子合并为 {len(merged)} 个段落上下文")
+    return merged
+
+
+paragraph_store = ParagraphStore(db_manager)
@@ -15,22 +15,139 @@ load_dotenv()
 ROOT_DIR = Path(__file__).parent.parent
 
 # 数据和数据库目录
-DATA_DIR = ROOT_DIR / "data"
-DB_DIR = ROOT_DIR / "db"
+DATA_DIR = Path(os.getenv("DATA_DIR", str(ROOT_DIR / "data")))
+DB_DIR = Path(os.getenv("DB_DIR", str(ROOT_DIR / "db")))
 
 # LanceDB配置
 LANCEDB_URI = DB_DIR
 LANCEDB_TABLE_NAME = os.getenv("LANCEDB_TABLE_NAME", "rag_table")
 
+# 关系库（段落/句子关联）配置
+SQLITE_DB_PATH = Path(os.getenv("SQLITE_DB_PATH", str(ROOT_DIR / "example.db")))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 4))
+# 缓存的表句柄检查其它进程是否发布了新版本的最小间隔（秒）
+TABLE_REFRESH_INTERVAL = float(os.getenv("TABLE_REFRESH_INTERVAL", 5))
+
+# 增量索引使用的文件指纹清单
+INDEX_MANIFEST_PATH = Path(
+    os.getenv("INDEX_MANIFEST_PATH", str(DB_DIR / "index_manifest.json"))
+)
+# 跨进程的索引写锁：命令行和所有API工作进程同一时刻只有一个在运行索引流水线
+INDEX_LOCK_PATH = Path(os.getenv("INDEX_LOCK_PATH", str(DB_DIR / "indexing.lock")))
+# 后台索引任务的状态文件目录，多个工作进程共享，任一进程都能查询和取消任务
+INDEX_JOB_DIR = Path(os.getenv("INDEX_JOB_DIR", str(DB_DIR / "index_jobs")))
+# 同一阶段内两次写入任务状态文件的最小间隔（秒）；阶段变化和任务结束时总是立即写入
+INDEX_JOB_SAVE_INTERVAL = float(os.getenv("INDEX_JOB_SAVE_INTERVAL", 1.0))
+# 索引时每次编码并写入的文本块数量；每个批次之间汇报进度并检查取消请求
+INDEX_WRITE_BATCH_SIZE = int(os.getenv("INDEX_WRITE_BATCH_SIZE", 1024))
+# 索引流水线相邻阶段之间最多缓冲的批次数；峰值内存约为 批大小 x 阶段数 x 该值
+INDEX_QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", 2))
+# 文档加载的进程数：0表示使用CPU核数，1表示在当前进程中逐个加载
+DOCUMENT_LOADER_WORKERS = int(os.getenv("DOCUMENT_LOADER_WORKERS", 0))
+# 并行加载时单个文件的超时时间（秒），超时的worker进程会被终止
+DOCUMENT_LOADER_TIMEOUT = float(os.getenv("DOCUMENT_LOADER_TIMEOUT", 120))
+# 文件数不超过该值时直接在当前进程中加载，不为少量文件启动进程池
+DOCUMENT_LOADER_INLINE_MAX_FILES = int(os.getenv("DOCUMENT_LOADER_INLINE_MAX_FILES", 2))
+
 # DeepSeek API配置
 DEEPSEEK_API_BASE = os.getenv("DEEPSEEK_API_BASE", "http://192.168.188.146:1234/v1")
 DEEPSEEK_CHAT_MODEL = os.getenv("DEEPSEEK_CHAT_MODEL", "deepseek-r1-distill-qwen-14b")
 DEEPSEEK_EMBEDDING_MODEL = os.getenv("DEEPSEEK_EMBEDDING_MODEL", "text-embedding-nomic-embed-text-v1.5")
 DEEPSEEK_MAX_TOKENS = int(os.getenv("DEEPSEEK_MAX_TOKENS", 1000))
 DEEPSEEK_TEMPERATURE = float(os.getenv("DEEPSEEK_TEMPERATURE", 0.7))
+DEEPSEEK_CHAT_TIMEOUT = float(os.getenv("DEEPSEEK_CHAT_TIMEOUT", 60))
+
+# API服务中共享异步HTTP客户端的最大连接数
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+
+# 嵌入配置
+# EMBEDDING_API_MODE: "embeddings" 使用OpenAI兼容的 /v1/embeddings 批量接口，
+# "analyze" 使用旧的 /api/analyze 逐条分析接口，
+# "local" 在进程内用CPU编码（见 src/embedding_backends.py），不访问网络
+EMBEDDING_API_MODE = os.getenv("EMBEDDING_API_MODE", "embeddings").lower()
+# 本地嵌入后端及其参数：字符n-gram哈希投影的维度和最大n-gram阶数
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "hashing").lower()
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", 256))
+LOCAL_EMBEDDING_MAX_NGRAM = int(os.getenv("LOCAL_EMBEDDING_MAX_NGRAM", 3))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", 30))
+# 并发编码时同时在途的最大请求数，以及单个批次失败后的重试次数和退避基数（秒）
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 2))
+EMBEDDING_RETRY_BACKOFF = float(os.getenv("EMBEDDING_RETRY_BACKOFF", 0.5))
+# 持久化嵌入缓存，按 (模型, 文本哈希) 缓存向量，超过容量后按LRU淘汰
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = Path(
+    os.getenv("EMBEDDING_CACHE_PATH", str(DB_DIR / "embedding_cache.sqlite"))
+)
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", 512))
 
 # RAG配置
 TOP_K = int(os.getenv("TOP_K", 3))
+# Small2Big：向量表只保存句子，命中后从段落库取回父段落作为LLM上下文（需要显式开启）
+SMALL2BIG_ENABLED = os.getenv("SMALL2BIG_ENABLED", "false").lower() == "true"
+
+# 批量问答（/ask/batch 和 main.py ask --file）：查询按BATCH_SEARCH_SIZE分组，每组一次
+# 批量编码和一次多向量检索；LLM生成同时在途的请求数不超过BATCH_LLM_CONCURRENCY
+BATCH_SEARCH_SIZE = int(os.getenv("BATCH_SEARCH_SIZE", 64))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 1000))
+
+# 回答缓存：先精确匹配规范化后的查询，再按查询向量的余弦相似度近似匹配
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+
+# ANN向量索引配置
+# 表行数达到ANN_INDEX_MIN_ROWS后构建索引；未索引行占比超过ANN_REBUILD_RATIO时
+# 重新训练索引，否则只把新增行合并进现有索引
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "IVF_PQ").upper()
+ANN_INDEX_MIN_ROWS = int(os.getenv("ANN_INDEX_MIN_ROWS", 10000))
+ANN_NUM_PARTITIONS = int(os.getenv("ANN_NUM_PARTITIONS", 0))  # 0表示按sqrt(行数)自动选择
+ANN_NUM_SUB_VECTORS = int(os.getenv("ANN_NUM_SUB_VECTORS", 0))  # 0表示按维度自动选择
+ANN_REBUILD_RATIO = float(os.getenv("ANN_REBUILD_RATIO", 0.2))
+# 查询时的ANN参数，可在/ask请求中按次覆盖；refine_factor为0表示不做精排
+SEARCH_NPROBES = int(os.getenv("SEARCH_NPROBES", 20))
+SEARCH_REFINE_FACTOR = int(os.getenv("SEARCH_REFINE_FACTOR", 0))
+# 相关度判断：检索结果的score是L2距离（越小越相似），最小距离不超过该阈值时认为
+# 检索结果相关，否则由模型直接回答。单位长度的嵌入向量之间距离在[0, 4]之间，
+# 默认值1.0约对应余弦相似度0.5
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", 1.0))
+# 检索模式："vector" 只做向量检索；"hybrid" 同时做全文检索（BM25），两路结果用
+# 加权倒数排名融合（RRF）合并，需要显式开启。每路各取 top_k * HYBRID_CANDIDATE_FACTOR 个候选
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector").lower()
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 1.0))
+HYBRID_KEYWORD_WEIGHT = float(os.getenv("HYBRID_KEYWORD_WEIGHT", 1.0))
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", 4))
+
+# 查询明细日志：每个查询的回答和检索明细以JSON Lines追加写入，后台线程攒批写入，
+# 文件超过QUERY_LOG_MAX_MB或打开超过QUERY_LOG_ROTATE_SECONDS秒后轮转为归档
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG_ENABLED", "true").lower() == "true"
+QUERY_LOG_PATH = Path(os.getenv("QUERY_LOG_PATH", str(ROOT_DIR / "logs" / "queries.jsonl")))
+QUERY_LOG_MAX_MB = float(os.getenv("QUERY_LOG_MAX_MB", 64))
+QUERY_LOG_ROTATE_SECONDS = float(os.getenv("QUERY_LOG_ROTATE_SECONDS", 86400))
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", 14))
+QUERY_LOG_COMPRESS = os.getenv("QUERY_LOG_COMPRESS", "true").lower() == "true"
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", 1.0))
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", 10000))
+
+# API服务（main.py serve）：工作进程数为0时按CPU核数启动；每个工作进程独立加载表句柄和HTTP客户端，
+# 关闭时最多等待SERVER_GRACEFUL_TIMEOUT秒让正在处理的请求（包括LLM调用）完成
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 0))
+SERVER_KEEP_ALIVE = int(os.getenv("SERVER_KEEP_ALIVE", 5))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 2048))
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+# 收到SIGTERM后先让 /health/ready 返回503并继续服务这么多秒，负载均衡摘除该进程后才开始关闭；
+# 应不短于负载均衡的健康检查间隔。SIGINT（Ctrl+C）不等待
+SERVER_DRAIN_DELAY = float(os.getenv("SERVER_DRAIN_DELAY", 5))
+SERVER_ACCESS_LOG = os.getenv("SERVER_ACCESS_LOG", "false").lower() == "true"
+
+# 事件循环延迟的采样间隔（秒），0表示不采样；延迟计入 /metrics 的 rag_event_loop_lag_seconds
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", 0.1))
 
 # 日志配置
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
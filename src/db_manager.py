@@ -0,0 +1,332 @@
+"""进程级的数据库连接管理器。
+
+在进程内只建立一次LanceDB连接，缓存已打开的表句柄，并维护一个线程安全的
+SQLite连接池。索引流程写入或删除表后调用 publish()，查询路径只有在表版本
+发生变化时才重新打开表句柄；其它进程（例如命令行索引）通过版本标记文件通知，
+标记文件最多每 TABLE_REFRESH_INTERVAL 秒检查一次。
+
+逻辑表名（如 LANCEDB_TABLE_NAME）通过指针文件映射到物理表及其已提交的版本。
+全量重建时写入一张新的物理表，完成后调用 activate() 切换指针，重建期间查询
+继续使用旧表；增量索引在同一张表上写入新版本，查询路径固定读取指针中的版本，
+提交时 activate() 把指针移到新版本。
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from src.config import (
+    DB_DIR,
+    LANCEDB_URI,
+    SQLITE_DB_PATH,
+    SQLITE_POOL_SIZE,
+    TABLE_REFRESH_INTERVAL,
+    get_logger,
+)
+
+if TYPE_CHECKING:
+    from lancedb import DBConnection, Table
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+# 关系库的建表语句，只在连接池初始化时执行一次
+# Small2Big的段落库：段落只存一份，句子通过rel_para_sentence关联到所属段落。
+# table_name是向量表的物理表名，全量重建写入新表时段落也写入新的一代。
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS detail_para_chunk (
+        table_name TEXT NOT NULL,
+        chunk_id TEXT NOT NULL,
+        file_key TEXT NOT NULL,
+        chunk_content TEXT NOT NULL,
+        PRIMARY KEY (table_name, chunk_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rel_para_sentence (
+        table_name TEXT NOT NULL,
+        sentence_id TEXT NOT NULL,
+        chunk_id TEXT NOT NULL,
+        file_key TEXT NOT NULL,
+        PRIMARY KEY (table_name, sentence_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_para_file ON detail_para_chunk (table_name, file_key)",
+    "CREATE INDEX IF NOT EXISTS idx_rel_file ON rel_para_sentence (table_name, file_key)",
+]
+# 关系库结构版本（PRAGMA user_version）；旧版本的这两张表从未写入过数据，直接重建
+SQLITE_SCHEMA_VERSION = 1
+SQLITE_LEGACY_TABLES = ["detail_para_chunk", "rel_para_sentence"]
+
+
+class SQLitePool:
+    """
+    固定大小的SQLite连接池，连接可以在线程之间传递。
+    """
+
+    def __init__(self, path: Path, size: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=size)
+        for i in range(size):
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if i == 0:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < SQLITE_SCHEMA_VERSION:
+                    for table in SQLITE_LEGACY_TABLES:
+                        conn.execute(f"DROP TABLE IF EXISTS {table}")
+                    conn.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+                for statement in SQLITE_SCHEMA:
+                    conn.execute(statement)
+                conn.commit()
+            self._pool.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """借出一个连接，使用完毕后自动归还；池为空时阻塞等待。"""
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        """关闭池中所有空闲连接。"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class DatabaseManager:
+    """
+    线程安全的数据库连接与表句柄管理器，整个进程共享一个实例。
+    """
+
+    def __init__(self, uri: Path, sqlite_path: Path, pool_size: int):
+        self.uri = uri
+        self.sqlite_path = sqlite_path
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._connection: Optional["DBConnection"] = None
+        self._sqlite_pool: Optional[SQLitePool] = None
+        # {表名: (句柄或None, 打开时的本地版本, 打开时的标记文件mtime)}
+        self._tables: Dict[str, Tuple[Optional["Table"], int, float]] = {}
+        self._versions: Dict[str, int] = {}
+        self._last_marker_check: Dict[str, float] = {}
+
+    @property
+    def connection(self) -> Optional["DBConnection"]:
+        """共享的LanceDB连接，首次访问时建立。"""
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    try:
+                        # lancedb的导入耗时数秒，推迟到首次连接时
+                        import lancedb  # type: ignore
+
+                        logger.info(f"正在连接到LanceDB: {self.uri}")
+                        self._connection = lancedb.connect(self.uri)
+                    except Exception as e:
+                        logger.error(f"连接LanceDB失败: {e}")
+                        return None
+        return self._connection
+
+    @property
+    def sqlite_pool(self) -> Optional[SQLitePool]:
+        """共享的SQLite连接池，首次访问时创建并执行建表语句。"""
+        if self._sqlite_pool is None:
+            with self._lock:
+                if self._sqlite_pool is None:
+                    try:
+                        self._sqlite_pool = SQLitePool(self.sqlite_path, self.pool_size)
+                    except Exception as e:
+                        logger.error(f"创建SQLite连接池失败: {e}")
+                        return None
+        return self._sqlite_pool
+
+    @contextmanager
+    def sqlite_connection(self) -> Iterator[sqlite3.Connection]:
+        """从连接池借出一个SQLite连接。"""
+        pool = self.sqlite_pool
+        if pool is None:
+            raise RuntimeError("SQLite连接池不可用")
+        with pool.connection() as conn:
+            yield conn
+
+    def _marker_path(self, table_name: str) -> Path:
+        return DB_DIR / f".{table_name}.version"
+
+    def _marker_mtime(self, table_name: str) -> float:
+        try:
+            return os.stat(self._marker_path(table_name)).st_mtime_ns
+        except FileNotFoundError:
+            return 0.0
+
+    def _pointer_path(self, table_name: str) -> Path:
+        return DB_DIR / f".{table_name}.active"
+
+    def _read_pointer(self, table_name: str) -> Tuple[str, Optional[int]]:
+        """读取指针文件：第一行为物理表名，第二行（可选）为已提交的表版本。"""
+        try:
+            lines = self._pointer_path(table_name).read_text(encoding="utf-8").split()
+        except FileNotFoundError:
+            return table_name, None
+        physical = lines[0] if lines else table_name
+        version = int(lines[1]) if len(lines) > 1 else None
+        return physical, version
+
+    def resolve_table_name(self, table_name: str) -> str:
+        """返回逻辑表名当前指向的物理表名；没有指针文件时两者相同。"""
+        return self._read_pointer(table_name)[0]
+
+    def committed_version(self, table_name: str) -> Optional[int]:
+        """返回查询路径读取的已提交版本；None表示读取物理表的最新版本。"""
+        return self._read_pointer(table_name)[1]
+
+    def new_generation_name(self, table_name: str) -> str:
+        """为全量重建生成一个新的物理表名。"""
+        return f"{table_name}__{time.strftime('%Y%m%d%H%M%S')}_{time.time_ns() % 1000000:06d}"
+
+    def generation_names(self, table_name: str) -> List[str]:
+        """列出属于某个逻辑表的所有物理表（包括当前指向的表）。"""
+        db = self.connection
+        if db is None:
+            return []
+        return [
+            name
+            for name in list_table_names(db)
+            if name == table_name or name.startswith(f"{table_name}__")
+        ]
+
+    def activate(self, table_name: str, physical_name: str, version: Optional[int] = None):
+        """
+        原子地把逻辑表指向新的物理表（或同一张表的新版本），并发布新版本。
+
+        Args:
+            table_name: 逻辑表名
+            physical_name: 物理表名
+            version: 查询路径读取的表版本；None表示始终读取最新版本
+        """
+        pointer = self._pointer_path(table_name)
+        pointer.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = pointer.with_suffix(".tmp")
+        content = physical_name if version is None else f"{physical_name}\n{version}"
+        tmp_path.write_text(content, encoding="utf-8")
+        os.replace(tmp_path, pointer)
+        suffix = "" if version is None else f" 版本 {version}"
+        logger.info(f"表 '{table_name}' 已切换到 '{physical_name}'{suffix}")
+        self.publish(table_name)
+
+    def publish(self, table_name: str):
+        """
+        通知表已被写入、重建或删除。
+
+        本进程内缓存的句柄立即失效；同时更新版本标记文件，
+        让其它进程在下次检查时重新打开表。
+        """
+        with self._lock:
+            self._versions[table_name] = self._versions.get(table_name, 0) + 1
+        try:
+            marker = self._marker_path(table_name)
+            marker.parent.mkdir(parents=True, exist_ok=True)
+            marker.write_text(str(time.time()), encoding="utf-8")
+        except OSError as e:
+            logger.warning(f"更新表版本标记失败: {e}")
+
+    def version_token(self, table_name: str) -> Tuple[int, float]:
+        """返回表的版本标识，本进程或其它进程发布新版本后会变化。"""
+        return self._versions.get(table_name, 0), self._marker_mtime(table_name)
+
+    def get_table(self, table_name: str) -> Optional["Table"]:
+        """
+        返回缓存的表句柄，仅在表版本变化后重新打开。
+
+        Args:
+            table_name: 表名
+
+        Returns:
+            Optional[Table]: 表句柄，表不存在或打开失败时返回None
+        """
+        now = time.monotonic()
+        version = self._versions.get(table_name, 0)
+        cached = self._tables.get(table_name)
+
+        if cached is not None and cached[1] == version:
+            last_check = self._last_marker_check.get(table_name, 0.0)
+            if now - last_check < TABLE_REFRESH_INTERVAL:
+                return cached[0]
+            self._last_marker_check[table_name] = now
+            if self._marker_mtime(table_name) == cached[2]:
+                return cached[0]
+
+        db = self.connection
+        if db is None:
+            return None
+
+        with self._lock:
+            marker_mtime = self._marker_mtime(table_name)
+            physical_name, version = self._read_pointer(table_name)
+            try:
+                table = db.open_table(physical_name)
+                if version is not None:
+                    # 固定在已提交的版本，正在进行的增量索引写入的新版本对查询不可见
+                    try:
+                        table.checkout(version)
+                    except Exception as e:
+                        logger.warning(f"表 '{physical_name}' 的版本 {version} 不可用，读取最新版本: {e}")
+                logger.info(f"已打开表 '{physical_name}' 并缓存句柄")
+            except Exception as e:
+                logger.error(f"打开表 '{table_name}' 失败: {e}")
+                table = None
+            self._tables[table_name] = (table, version, marker_mtime)
+            self._last_marker_check[table_name] = now
+        return table
+
+    def warmup(self, table_name: str) -> bool:
+        """在服务启动时预先建立连接、连接池并打开表，返回表是否可用。"""
+        self.sqlite_pool
+        return self.get_table(table_name) is not None
+
+    def close(self):
+        """释放缓存的句柄和SQLite连接。"""
+        with self._lock:
+            self._tables.clear()
+            if self._sqlite_pool is not None:
+                self._sqlite_pool.close()
+                self._sqlite_pool = None
+
+
+# 进程级单例
+db_manager = DatabaseManager(LANCEDB_URI, SQLITE_DB_PATH, SQLITE_POOL_SIZE)
+
+
+def list_table_names(db: "DBConnection") -> List[str]:
+    """列出数据库中的全部表名，逐页读取list_tables的结果。"""
+    names: List[str] = []
+    page_token = None
+    while True:
+        response = db.list_tables(page_token=page_token)
+        names.extend(response.tables)
+        page_token = response.page_token
+        if not page_token:
+            return names
+
+
+def open_table(db: "DBConnection", table_name: str) -> Optional["Table"]:
+    """
+    打开表：db为共享连接时返回缓存句柄，否则直接打开。
+
+    Raises:
+        Exception: db不是共享连接且打开失败时，原样抛出open_table的异常
+    """
+    if db is db_manager.connection:
+        return db_manager.get_table(table_name)
+    return db.open_table(table_name)
@@ -1,63 +1,342 @@
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Type
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Type
 
 from langchain.docstore.document import Document
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    UnstructuredWordDocumentLoader,
-    TextLoader,
-    UnstructuredMarkdownLoader,
-)
 
-from src.config import DATA_DIR, get_logger
+from src.config import (
+    DATA_DIR,
+    DOCUMENT_LOADER_INLINE_MAX_FILES,
+    DOCUMENT_LOADER_TIMEOUT,
+    DOCUMENT_LOADER_WORKERS,
+    get_logger,
+)
 
 # 获取模块专用的logger
 logger = get_logger(__name__)
 
-# 文件扩展名到加载器类的映射
-LOADER_MAPPING: Dict[str, Type] = {
-    ".pdf": PyPDFLoader,
-    ".docx": UnstructuredWordDocumentLoader,
-    ".md": UnstructuredMarkdownLoader,
-    ".txt": TextLoader,
+# 文件扩展名到langchain_community.document_loaders中加载器类名的映射。
+# 导入该包需要近一秒，只在第一次真正加载文件时才导入（见_loader_class），
+# 增量索引没有变化的文件时不必为此付出代价
+LOADER_MAPPING: Dict[str, str] = {
+    ".pdf": "PyPDFLoader",
+    ".docx": "UnstructuredWordDocumentLoader",
+    ".md": "UnstructuredMarkdownLoader",
+    ".txt": "TextLoader",
 }
 
 
-def load_documents(source_dir: Path = DATA_DIR) -> List[Document]:
+def _loader_class(name: str) -> Type:
+    """按类名返回langchain_community中的加载器类。"""
+    from langchain_community import document_loaders
+
+    return getattr(document_loaders, name)
+
+
+@dataclass
+class FileLoadStats:
+    """单个文件的加载结果统计。"""
+
+    path: Path
+    status: str  # "ok"、"error" 或 "timeout"
+    num_docs: int
+    seconds: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+
+def list_document_files(source_dir: Path = DATA_DIR) -> List[Path]:
     """
-    从指定的源目录加载所有文档，根据文件扩展名使用相应的加载器。
+    递归列出源目录中所有受支持格式的文件（按路径排序）。
+
+    以 "." 开头的隐藏文件和目录会被跳过。
 
     Args:
         source_dir (Path): 包含文档的目录路径。
 
     Returns:
-        List[Document]: 已加载的文档列表。
+        List[Path]: 可由LOADER_MAPPING中的加载器处理的文件。
     """
-    all_docs = []
-    logger.info(f"Loading documents from: {source_dir}")
+    files = []
+    for root, dirs, names in os.walk(source_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if name.startswith("."):
+                continue
+            file_path = Path(root) / name
+            if file_path.suffix.lower() in LOADER_MAPPING:
+                files.append(file_path)
+            else:
+                logger.warning(
+                    f"Unsupported file type: {file_path.suffix}. Skipping."
+                )
+    return sorted(files)
+
+
+def _load_file_with_stats(file_path: Path) -> Tuple[List[Document], FileLoadStats]:
+    """加载单个文件并记录耗时；异常被转换为status为"error"的统计。"""
+    start = time.perf_counter()
+    loader_name = LOADER_MAPPING.get(file_path.suffix.lower())
+    if loader_name is None:
+        logger.warning(f"Unsupported file type: {file_path.suffix}. Skipping.")
+        return [], FileLoadStats(file_path, "error", 0, 0.0, "unsupported file type")
+    try:
+        logger.info(f"Loading file: {file_path}")
+        docs = _loader_class(loader_name)(str(file_path)).load()
+    except Exception as e:
+        logger.error(f"Failed to load {file_path}: {e}")
+        return [], FileLoadStats(
+            file_path, "error", 0, time.perf_counter() - start, str(e)
+        )
+    return docs, FileLoadStats(file_path, "ok", len(docs), time.perf_counter() - start)
 
-    if not source_dir.is_dir():
-        logger.error(f"Source directory not found: {source_dir}")
-        return []
 
-    for file_path in source_dir.iterdir():
-        if file_path.is_file():
-            loader_class = LOADER_MAPPING.get(file_path.suffix.lower())
-            if loader_class:
+def load_file(file_path: Path) -> List[Document]:
+    """
+    使用与扩展名对应的加载器加载单个文件。
+
+    Args:
+        file_path (Path): 文件路径。
+
+    Returns:
+        List[Document]: 文件中的文档，加载失败时返回空列表。
+    """
+    docs, _ = _load_file_with_stats(file_path)
+    return docs
+
+
+def resolve_loader_workers(workers: Optional[int] = None) -> int:
+    """把配置的进程数（0表示CPU核数）转换为实际进程数。"""
+    if workers is None:
+        workers = DOCUMENT_LOADER_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _register_worker(worker_pids):
+    """进程池worker的初始化函数：把自己的PID报告给父进程。"""
+    worker_pids.put(os.getpid())
+
+
+def _new_pool(workers: int, context) -> Tuple[ProcessPoolExecutor, object]:
+    """创建进程池，返回 (进程池, 记录worker PID的队列)。"""
+    worker_pids = context.SimpleQueue()
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_register_worker,
+        initargs=(worker_pids,),
+    )
+    return executor, worker_pids
+
+
+def _terminate_pool(executor: ProcessPoolExecutor, worker_pids):
+    """终止进程池中的所有worker，包括正在执行卡住任务的进程。"""
+    terminate_workers = getattr(executor, "terminate_workers", None)
+    if terminate_workers is not None:
+        terminate_workers()
+        return
+    # Python 3.14之前没有公开的终止接口：按worker初始化时报告的PID逐个终止
+    while not worker_pids.empty():
+        try:
+            os.kill(worker_pids.get(), signal.SIGTERM)
+        except (ProcessLookupError, OSError):
+            pass
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _iter_load_parallel(
+    files: List[Path], workers: int, timeout: float
+) -> Iterator[Tuple[Path, List[Document], FileLoadStats]]:
+    """
+    在进程池中加载文件，按完成顺序产出结果。
+
+    同时在途的任务数不超过worker数，因此任务提交后即开始执行，提交时间就是
+    超时计时的起点。某个文件超时后整个进程池被终止并重建，其余在途文件重新提交。
+    """
+    # 使用spawn而不是fork：调用方（如API的后台任务线程）所在进程中可能有其它线程持有锁
+    context = multiprocessing.get_context("spawn")
+    queue = list(reversed(files))
+    executor, worker_pids = _new_pool(workers, context)
+    in_flight: Dict[Future, Tuple[Path, float]] = {}
+    retried = set()
+    try:
+        while queue or in_flight:
+            while queue and len(in_flight) < workers:
+                # 重试的文件单独执行，避免再次被其它文件的崩溃牵连
+                if queue[-1] in retried and in_flight:
+                    break
+                path = queue.pop()
+                in_flight[executor.submit(_load_file_with_stats, path)] = (
+                    path,
+                    time.monotonic(),
+                )
+                if path in retried:
+                    break
+
+            next_deadline = min(started for _, started in in_flight.values()) + timeout
+            done, _ = wait(
+                in_flight,
+                timeout=max(0.0, next_deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+
+            broken = False
+            for future in done:
+                path, started = in_flight.pop(future)
                 try:
-                    logger.info(f"Loading file: {file_path}")
-                    loader = loader_class(str(file_path))
-                    docs = loader.load()
-                    all_docs.extend(docs)
+                    docs, stats = future.result()
+                except BrokenProcessPool as e:
+                    # 某个worker进程异常退出（如解析器崩溃），同一进程池中的在途任务
+                    # 都会失败；无法区分是哪个文件导致的，因此每个文件重试一次
+                    broken = True
+                    if path not in retried:
+                        retried.add(path)
+                        queue.insert(0, path)
+                        continue
+                    logger.error(f"Failed to load {path}: {e}")
+                    docs = []
+                    stats = FileLoadStats(
+                        path, "error", 0, time.monotonic() - started, str(e)
+                    )
                 except Exception as e:
-                    logger.error(f"Failed to load {file_path}: {e}")
-            else:
-                logger.warning(
-                    f"Unsupported file type: {file_path.suffix}. Skipping."
+                    logger.error(f"Failed to load {path}: {e}")
+                    docs = []
+                    stats = FileLoadStats(
+                        path, "error", 0, time.monotonic() - started, str(e)
+                    )
+                yield path, docs, stats
+
+            now = time.monotonic()
+            expired = [
+                future
+                for future, (_, started) in in_flight.items()
+                if now - started >= timeout and not future.done()
+            ]
+            for future in expired:
+                path, started = in_flight.pop(future)
+                logger.error(f"Timed out loading {path} after {timeout:.0f}s")
+                yield path, [], FileLoadStats(
+                    path, "timeout", 0, now - started, f"timed out after {timeout}s"
                 )
+            if not expired and not broken:
+                continue
 
-    logger.info(f"Successfully loaded {len(all_docs)} documents.")
-    return all_docs
+            # 卡住的worker无法单独中止：终止整个进程池（或替换已失效的进程池），
+            # 重新提交其余在途文件
+            _terminate_pool(executor, worker_pids)
+            queue.extend(path for path, _ in in_flight.values())
+            in_flight.clear()
+            executor, worker_pids = _new_pool(workers, context)
+    finally:
+        if in_flight:
+            _terminate_pool(executor, worker_pids)
+        else:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_load_files(
+    files: Iterable[Path],
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[Tuple[Path, List[Document], FileLoadStats]]:
+    """
+    加载一组文件，逐个产出 (文件路径, 文档列表, 加载统计)。
 
+    worker数大于1且文件数超过DOCUMENT_LOADER_INLINE_MAX_FILES时在进程池中并行加载，
+    结果按完成顺序产出，单个文件超过timeout秒即放弃并记为 "timeout"；否则在当前
+    进程中按顺序加载，不做超时控制。调用方提前停止迭代时，进程池随之关闭。
 
+    Args:
+        files (Iterable[Path]): 要加载的文件。
+        workers (int, optional): 进程数，默认使用DOCUMENT_LOADER_WORKERS（0表示CPU核数）。
+        timeout (float, optional): 单个文件的超时时间（秒），默认使用DOCUMENT_LOADER_TIMEOUT。
+
+    Yields:
+        Tuple[Path, List[Document], FileLoadStats]: 每个文件的加载结果。
+    """
+    files = list(files)
+    workers = min(resolve_loader_workers(workers), len(files))
+    if timeout is None:
+        timeout = DOCUMENT_LOADER_TIMEOUT
+
+    if workers > 1 and len(files) > DOCUMENT_LOADER_INLINE_MAX_FILES:
+        logger.info(f"Loading {len(files)} files with {workers} worker processes")
+        yield from _iter_load_parallel(files, workers, timeout)
+        return
+
+    for path in files:
+        docs, stats = _load_file_with_stats(path)
+        yield path, docs, stats
+
+
+def summarize_load_stats(stats: List[FileLoadStats], slowest: int = 5) -> Dict:
+    """
+    汇总加载统计：成功/失败/超时文件数、总耗时和最慢的几个文件。
+
+    Args:
+        stats (List[FileLoadStats]): 每个文件的加载统计。
+        slowest (int): 列出的最慢文件数量。
 
+    Returns:
+        Dict: 汇总结果。
+    """
+    ranked = sorted(stats, key=lambda s: s.seconds, reverse=True)[:slowest]
+    return {
+        "files_ok": sum(1 for s in stats if s.status == "ok"),
+        "files_failed": sum(1 for s in stats if s.status == "error"),
+        "files_timed_out": sum(1 for s in stats if s.status == "timeout"),
+        "load_seconds": round(sum(s.seconds for s in stats), 3),
+        "slowest": [
+            {"path": str(s.path), "status": s.status, "seconds": round(s.seconds, 3)}
+            for s in ranked
+        ],
+    }
+
+
+def load_documents(
+    source_dir: Path = DATA_DIR,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> List[Document]:
+    """
+    从指定的源目录（包括子目录）加载所有文档，根据文件扩展名使用相应的加载器。
+
+    Args:
+        source_dir (Path): 包含文档的目录路径。
+        workers (int, optional): 见iter_load_files。
+        timeout (float, optional): 见iter_load_files。
+
+    Returns:
+        List[Document]: 已加载的文档列表，顺序与文件路径顺序一致。
+    """
+    logger.info(f"Loading documents from: {source_dir}")
+
+    if not source_dir.is_dir():
+        logger.error(f"Source directory not found: {source_dir}")
+        return []
+
+    files = list_document_files(source_dir)
+    loaded: Dict[Path, List[Document]] = {}
+    stats = []
+    for path, docs, file_stats in iter_load_files(files, workers, timeout):
+        loaded[path] = docs
+        stats.append(file_stats)
+
+    all_docs = [doc for path in files for doc in loaded.get(path, [])]
+    summary = summarize_load_stats(stats)
+    logger.info(
+        f"Successfully loaded {len(all_docs)} documents from {summary['files_ok']} files "
+        f"({summary['files_failed']} failed, {summary['files_timed_out']} timed out)."
+    )
+    return all_docs
@@ -0,0 +1,132 @@
+"""本地（进程内、不访问网络）的嵌入后端。
+
+EMBEDDING_API_MODE 为 "local" 时，EmbeddingModel 不调用远程嵌入服务，
+而是用这里的后端在CPU上直接编码，适合测试、无法访问外网的节点，以及省去
+查询编码的网络往返。新的后端继承 EmbeddingBackend 并登记到 BACKENDS，
+通过 LOCAL_EMBEDDING_BACKEND 选择。
+
+内置的 "hashing" 后端把文本的字符n-gram用带符号的特征哈希投影到固定维度，
+词频取对数压缩后做L2归一化。整批文本的n-gram哈希、分桶和计数都是NumPy
+数组运算，Python层面只按文本和n-gram阶数循环。它没有语义理解能力，
+但字面上相近的文本向量也相近，远好于逐字符统计的占位向量。
+"""
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from src.config import (
+    LOCAL_EMBEDDING_BACKEND,
+    LOCAL_EMBEDDING_DIM,
+    LOCAL_EMBEDDING_MAX_NGRAM,
+    get_logger,
+)
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+# 64位乘法哈希使用的常数（splitmix64），乘法溢出按2^64取模
+_PRIME = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+class EmbeddingBackend(ABC):
+    """本地嵌入后端的基类。"""
+
+    # 写入嵌入缓存键的后端标识，参数不同产生的向量不可混用时应体现在其中
+    name = "base"
+
+    def __init__(self, dim: int):
+        if dim <= 0:
+            raise ValueError(f"向量维度必须为正数: {dim}")
+        self.dim = dim
+
+    @abstractmethod
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        一次编码一批文本。
+
+        Args:
+            texts (List[str]): 要编码的文本。
+
+        Returns:
+            np.ndarray: 形状为 (len(texts), dim) 的float32矩阵。
+        """
+
+
+class HashingNgramBackend(EmbeddingBackend):
+    """
+    字符n-gram特征哈希：1到max_ngram阶的n-gram经64位哈希后映射到dim个桶，
+    哈希的最高位决定计数的正负号，以抵消哈希冲突带来的偏差。
+    """
+
+    def __init__(self, dim: int = 256, max_ngram: int = 3):
+        super().__init__(dim)
+        if max_ngram <= 0:
+            raise ValueError(f"n-gram阶数必须为正数: {max_ngram}")
+        self.max_ngram = max_ngram
+        self.name = f"hashing-{dim}-{max_ngram}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        num_texts = len(texts)
+        counts = np.zeros(num_texts * self.dim, dtype=np.float64)
+        # 所有文本的码点首尾相接，rows记录每个码点属于哪个文本
+        codes = [np.frombuffer(text.lower().encode("utf-32-le"), dtype=np.uint32) for text in texts]
+        lengths = np.fromiter((len(c) for c in codes), dtype=np.int64, count=num_texts)
+        if lengths.sum() > 0:
+            flat = np.concatenate(codes).astype(np.uint64)
+            rows = np.repeat(np.arange(num_texts, dtype=np.int64), lengths)
+            for n in range(1, self.max_ngram + 1):
+                size = flat.size - n + 1
+                if size <= 0:
+                    break
+                # 位置i的n-gram是flat[i:i+n]；首尾码点属于同一文本时才有效
+                valid = rows[:size] == rows[n - 1 : n - 1 + size]
+                hashes = np.full(size, n, dtype=np.uint64)
+                for offset in range(n):
+                    hashes = (hashes ^ flat[offset : offset + size]) * _PRIME
+                hashes = _mix(hashes[valid])
+                buckets = (hashes % np.uint64(self.dim)).astype(np.int64)
+                signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+                counts += np.bincount(
+                    rows[:size][valid] * self.dim + buckets,
+                    weights=signs,
+                    minlength=counts.size,
+                )
+
+        vectors = counts.reshape(num_texts, self.dim)
+        # 对数压缩词频，避免高频字符（如"的"）主导向量
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors.astype(np.float32)
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    """splitmix64的终结步骤，让低位也充分混合后再取模分桶。"""
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * _MIX_1
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * _MIX_2
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+# 后端名 -> 按 (dim, max_ngram) 创建后端的工厂
+BACKENDS: Dict[str, Callable[..., EmbeddingBackend]] = {
+    "hashing": lambda dim, max_ngram: HashingNgramBackend(dim, max_ngram),
+}
+
+_local_backend: Optional[EmbeddingBackend] = None
+
+
+def get_local_backend() -> EmbeddingBackend:
+    """返回按配置创建的进程共享本地后端，首次调用时创建。"""
+    global _local_backend
+    if _local_backend is None:
+        factory = BACKENDS.get(LOCAL_EMBEDDING_BACKEND)
+        if factory is None:
+            raise ValueError(
+                f"未知的本地嵌入后端: {LOCAL_EMBEDDING_BACKEND}，可选 {sorted(BACKENDS)}"
+            )
+        _local_backend = factory(LOCAL_EMBEDDING_DIM, LOCAL_EMBEDDING_MAX_NGRAM)
+        logger.info(f"已创建本地嵌入后端: {_local_backend.name}")
+    return _local_backend
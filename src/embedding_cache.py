@@ -0,0 +1,220 @@
+"""持久化的内容寻址嵌入缓存。
+
+缓存以 (模型名, 文本SHA-256) 为键，把向量以float32二进制形式保存在
+SQLite中，按总字节数做LRU淘汰。EmbeddingModel在发起任何HTTP请求前
+先查询此缓存，因此对未修改的语料重新索引不会产生嵌入调用。
+"""
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.config import get_logger
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+# SQLite单条语句中参数个数的安全上限
+_SQL_CHUNK = 500
+
+
+def text_hash(text: str) -> str:
+    """返回文本的SHA-256十六进制摘要。"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    基于SQLite的线程安全嵌入缓存，按最近访问时间做LRU淘汰。
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        """
+        Args:
+            path (Path): SQLite数据库文件路径。
+            max_bytes (int): 向量数据的最大总字节数，超出后淘汰最久未访问的条目。
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_access INTEGER NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embedding_cache_access "
+            "ON embedding_cache (last_access)"
+        )
+        self._conn.commit()
+
+        row = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0), COALESCE(MAX(last_access), 0) "
+            "FROM embedding_cache"
+        ).fetchone()
+        self._total_bytes, self._clock = int(row[0]), int(row[1])
+
+    def _tick(self) -> int:
+        """返回单调递增的访问序号，用作LRU时间戳。"""
+        self._clock += 1
+        return self._clock
+
+    def get_many(self, model: str, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+        """
+        批量查询缓存。
+
+        Args:
+            model (str): 模型标识。
+            texts (Sequence[str]): 要查询的文本。
+
+        Returns:
+            Dict[int, np.ndarray]: 命中的 {输入下标: 向量}。
+        """
+        hashes = [text_hash(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), _SQL_CHUNK):
+                chunk = unique[start : start + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                stamp = self._tick()
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_access = ? "
+                    "WHERE model = ? AND text_hash = ?",
+                    [(stamp, model, digest) for digest in found],
+                )
+                self._conn.commit()
+
+            hits = {i: found[digest] for i, digest in enumerate(hashes) if digest in found}
+            self.hits += len(hits)
+            self.misses += len(texts) - len(hits)
+        return hits
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: np.ndarray):
+        """
+        批量写入缓存，写入后按需淘汰最久未访问的条目。
+
+        Args:
+            model (str): 模型标识。
+            texts (Sequence[str]): 文本列表。
+            vectors (np.ndarray): 与texts一一对应的向量矩阵。
+        """
+        if len(texts) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        with self._lock:
+            stamp = self._tick()
+            rows = {
+                text_hash(text): vector.tobytes() for text, vector in zip(texts, vectors)
+            }
+            existing = 0
+            digests = list(rows)
+            for start in range(0, len(digests), _SQL_CHUNK):
+                chunk = digests[start : start + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                existing += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchone()[0]
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache "
+                "(model, text_hash, dim, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (model, digest, vectors.shape[1], blob, stamp)
+                    for digest, blob in rows.items()
+                ],
+            )
+            self._total_bytes += sum(len(blob) for blob in rows.values()) - existing
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        """总字节数超过上限时，删除最久未访问的条目直到降到上限的90%。"""
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        cursor = self._conn.execute(
+            "SELECT model, text_hash, LENGTH(vector) FROM embedding_cache "
+            "ORDER BY last_access ASC"
+        )
+        victims: List[tuple] = []
+        for model, digest, size in cursor:
+            if self._total_bytes <= target:
+                break
+            victims.append((model, digest))
+            self._total_bytes -= size
+            evicted += 1
+        self._conn.executemany(
+            "DELETE FROM embedding_cache WHERE model = ? AND text_hash = ?", victims
+        )
+        logger.info(f"嵌入缓存超出容量，淘汰了 {evicted} 个条目")
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中/未命中计数、条目数和占用字节数。"""
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embedding_cache"
+            ).fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "entries": entries,
+                "bytes": self._total_bytes,
+            }
+
+    def clear(self):
+        """清空缓存并重置计数。"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embedding_cache")
+            self._conn.commit()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        """关闭底层SQLite连接。"""
+        with self._lock:
+            self._conn.close()
+
+
+def open_embedding_cache(path: Path, max_bytes: int) -> Optional[EmbeddingCache]:
+    """打开嵌入缓存，失败时记录错误并返回None，调用方退化为不使用缓存。"""
+    try:
+        return EmbeddingCache(path, max_bytes)
+    except Exception as e:
+        logger.error(f"打开嵌入缓存失败 {path}: {e}")
+        return None
@@ -1,15 +1,64 @@
+import asyncio
 import json
 import threading
-from typing import List, Optional, Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Union
 
+import httpx
 import numpy as np
 import requests
 
-from src.config import DEEPSEEK_API_BASE, DEEPSEEK_EMBEDDING_MODEL, get_logger
+from src.config import (
+    DEEPSEEK_API_BASE,
+    DEEPSEEK_EMBEDDING_MODEL,
+    EMBEDDING_API_MODE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_MAX_MB,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_MAX_WORKERS,
+    EMBEDDING_RETRY_BACKOFF,
+    EMBEDDING_TIMEOUT,
+    get_logger,
+)
+from src.embedding_backends import get_local_backend
+from src.embedding_cache import EmbeddingCache, open_embedding_cache
+from src.http_client import get_async_client
+from src.metrics import span
 
 # 获取模块专用的logger
 logger = get_logger(__name__)
 
+# EmbeddingModel._cache尚未打开时的占位值；None表示缓存未启用
+_CACHE_UNOPENED = object()
+
+
+@dataclass
+class EncodeResult:
+    """
+    并发编码的结果，允许部分批次失败。
+
+    Attributes:
+        embeddings: 形状为 (n, dim) 的矩阵，失败文本对应的行填充为NaN；
+                    所有批次都失败时为None。
+        failed_indices: 编码失败的文本在输入列表中的下标（升序）。
+        num_batches: 总批次数。
+        failed_batches: 重试后仍失败的批次数。
+    """
+
+    embeddings: Optional[np.ndarray]
+    failed_indices: List[int] = field(default_factory=list)
+    num_batches: int = 0
+    failed_batches: int = 0
+
+    @property
+    def ok(self) -> bool:
+        """所有文本都编码成功时为True。"""
+        return self.embeddings is not None and not self.failed_indices
+
 
 class EmbeddingModel:
     """
@@ -18,7 +67,8 @@ class EmbeddingModel:
 
     _instance = None
     _lock = threading.Lock()
-    api_available: bool
+    # /api/config的探测结果，None表示尚未探测
+    _api_available: Optional[bool] = None
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
@@ -29,11 +79,47 @@ class EmbeddingModel:
         return cls._instance
 
     def __init__(self):
-        if not hasattr(self, "api_available"):  # 确保只初始化一次
+        if not hasattr(self, "_session"):  # 确保只初始化一次
             with self._lock:
                 # 再次检查，防止多线程重复初始化
-                if not hasattr(self, "api_available"):
-                    self._test_api_connection()
+                if not hasattr(self, "_session"):
+                    # 复用HTTP连接，避免每个批次重新建立TCP连接
+                    self._session = requests.Session()
+                    # 第一次编码时才打开嵌入缓存，导入模块不创建数据库文件
+                    self._cache = _CACHE_UNOPENED
+
+    @property
+    def cache(self) -> Optional[EmbeddingCache]:
+        """嵌入缓存，首次访问时打开；未启用或打开失败时为None。"""
+        if self._cache is _CACHE_UNOPENED:
+            with self._lock:
+                if self._cache is _CACHE_UNOPENED:
+                    self._cache = (
+                        open_embedding_cache(
+                            EMBEDDING_CACHE_PATH,
+                            int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024),
+                        )
+                        if EMBEDDING_CACHE_ENABLED
+                        else None
+                    )
+        return self._cache
+
+    @cache.setter
+    def cache(self, value: Optional[EmbeddingCache]):
+        self._cache = value
+
+    @property
+    def api_available(self) -> bool:
+        """
+        嵌入API是否可用。
+
+        首次访问（第一次encode）时才探测连接，导入模块不发起网络请求。
+        """
+        if EMBEDDING_API_MODE == "local":
+            return True
+        if self._api_available is None:
+            self._test_api_connection()
+        return self._api_available
 
     def _test_api_connection(self):
         """测试DeepSeek API连接。"""
@@ -45,13 +131,259 @@ class EmbeddingModel:
 
             config_data = response.json()
             logger.info(f"DeepSeek API连接成功，配置: {config_data}")
-            self.api_available = True
+            self._api_available = True
 
         except Exception as e:
             logger.error(f"DeepSeek API连接测试失败: {e}")
             # 即使配置端点失败，也尝试继续使用API
             logger.warning("将尝试直接使用分析端点")
-            self.api_available = True
+            self._api_available = True
+
+    def _call_embeddings_batch(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        调用OpenAI兼容的 /v1/embeddings 接口，一次请求编码一批文本。
+
+        Args:
+            texts (List[str]): 同一批次中要编码的文本。
+
+        Returns:
+            Optional[np.ndarray]: 形状为 (len(texts), dim) 的float32矩阵，失败时返回None。
+        """
+        try:
+            embeddings_url = f"{DEEPSEEK_API_BASE}/embeddings"
+            request_data = {
+                "model": DEEPSEEK_EMBEDDING_MODEL,
+                "input": texts,
+            }
+
+            response = self._session.post(
+                embeddings_url,
+                json=request_data,
+                headers={"Content-Type": "application/json"},
+                timeout=EMBEDDING_TIMEOUT,
+            )
+
+            response.raise_for_status()
+            return self._parse_embeddings_response(response.json(), len(texts))
+
+        except requests.exceptions.Timeout:
+            logger.error("DeepSeek嵌入API请求超时")
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.error(f"DeepSeek嵌入API请求失败: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"调用DeepSeek嵌入API时发生未知错误: {e}")
+            return None
+
+    @staticmethod
+    def _parse_embeddings_response(
+        response_data: Any, expected: int
+    ) -> Optional[np.ndarray]:
+        """把 /v1/embeddings 的响应解析为按输入顺序排列的向量矩阵。"""
+        items = response_data.get("data") if isinstance(response_data, dict) else None
+        if not items or len(items) != expected:
+            logger.error(
+                f"嵌入API返回的向量数量与输入不一致: "
+                f"期望 {expected}，实际 {len(items) if items else 0}"
+            )
+            return None
+
+        # 服务端不保证按输入顺序返回，按index字段重新排序
+        items = sorted(items, key=lambda item: item.get("index", 0))
+        return np.array([item["embedding"] for item in items], dtype=np.float32)
+
+    async def _acall_embeddings_batch(self, texts: List[str]) -> Optional[np.ndarray]:
+        """_call_embeddings_batch的异步版本，使用共享的异步HTTP客户端。"""
+        try:
+            response = await get_async_client().post(
+                f"{DEEPSEEK_API_BASE}/embeddings",
+                json={"model": DEEPSEEK_EMBEDDING_MODEL, "input": texts},
+                timeout=EMBEDDING_TIMEOUT,
+            )
+            response.raise_for_status()
+            return self._parse_embeddings_response(response.json(), len(texts))
+
+        except httpx.TimeoutException:
+            logger.error("DeepSeek嵌入API请求超时")
+            return None
+        except httpx.HTTPError as e:
+            logger.error(f"DeepSeek嵌入API请求失败: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"调用DeepSeek嵌入API时发生未知错误: {e}")
+            return None
+
+    def _encode_batch_with_retry(
+        self, batch: List[str], max_retries: int, backoff: float
+    ) -> Optional[np.ndarray]:
+        """编码单个批次，失败时按指数退避重试。"""
+        for attempt in range(max_retries + 1):
+            if EMBEDDING_API_MODE == "analyze":
+                batch_embeddings = self._call_embedding_api(batch)
+            else:
+                batch_embeddings = self._call_embeddings_batch(batch)
+            if batch_embeddings is not None:
+                return batch_embeddings
+            if attempt < max_retries:
+                delay = backoff * (2**attempt)
+                logger.warning(
+                    f"批次编码失败，{delay:.2f}s 后进行第 {attempt + 1} 次重试"
+                )
+                time.sleep(delay)
+        return None
+
+    @property
+    def cache_model_key(self) -> str:
+        """缓存键中的模型标识；不同接口模式产生的向量不可混用。"""
+        if EMBEDDING_API_MODE == "local":
+            return f"local:{get_local_backend().name}"
+        return f"{EMBEDDING_API_MODE}:{DEEPSEEK_EMBEDDING_MODEL}"
+
+    def encode_concurrent(
+        self,
+        texts: List[str],
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_workers: int = EMBEDDING_MAX_WORKERS,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        backoff: float = EMBEDDING_RETRY_BACKOFF,
+    ) -> EncodeResult:
+        """
+        将文本切分成批次，通过线程池并发调用嵌入接口。
+
+        同时在途的请求数不超过max_workers；每个批次独立重试，
+        结果按输入顺序重新组装，失败的批次不会影响其它批次。
+        启用嵌入缓存时，只有未命中缓存的文本才会发起请求。
+
+        Args:
+            texts (List[str]): 要编码的文本列表。
+            batch_size (int): 每个请求包含的文本数量。
+            max_workers (int): 最大并发请求数。
+            max_retries (int): 单个批次的最大重试次数。
+            backoff (float): 重试退避基数（秒），第n次重试等待 backoff * 2**n。
+
+        Returns:
+            EncodeResult: 编码结果和失败明细。
+        """
+        if not texts:
+            return EncodeResult(embeddings=None)
+        if EMBEDDING_API_MODE == "local":
+            # 本地编码整批只需一次矩阵运算，比查询嵌入缓存更快，不经过缓存和线程池
+            return EncodeResult(embeddings=get_local_backend().encode(texts), num_batches=1)
+
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(self.cache_model_key, texts)
+            if cached:
+                logger.info(f"嵌入缓存命中 {len(cached)}/{len(texts)} 个文本")
+        if len(cached) == len(texts):
+            return EncodeResult(embeddings=np.vstack([cached[i] for i in range(len(texts))]))
+
+        missing = [i for i in range(len(texts)) if i not in cached]
+        result = self._encode_uncached(
+            [texts[i] for i in missing], batch_size, max_workers, max_retries, backoff
+        )
+
+        # 先检查维度再写缓存，避免一次维度错误的响应污染之后的运行
+        dim = next(iter(cached.values())).shape[0] if cached else None
+        if result.embeddings is not None and dim is not None and result.embeddings.shape[1] != dim:
+            logger.error("缓存向量与新编码向量维度不一致，忽略缓存结果且不写入缓存")
+            return self._encode_uncached(
+                texts, batch_size, max_workers, max_retries, backoff
+            )
+
+        if self.cache is not None and result.embeddings is not None:
+            succeeded = sorted(set(range(len(missing))) - set(result.failed_indices))
+            if succeeded:
+                self.cache.put_many(
+                    self.cache_model_key,
+                    [texts[missing[i]] for i in succeeded],
+                    result.embeddings[succeeded],
+                )
+
+        if not cached:
+            return result
+
+        # 把缓存命中的向量和新编码的向量按原始顺序合并
+        embeddings = np.full((len(texts), dim), np.nan, dtype=np.float32)
+        for i, vector in cached.items():
+            embeddings[i] = vector
+        if result.embeddings is not None:
+            embeddings[missing] = result.embeddings
+        return EncodeResult(
+            embeddings=embeddings,
+            failed_indices=[missing[i] for i in result.failed_indices],
+            num_batches=result.num_batches,
+            failed_batches=result.failed_batches,
+        )
+
+    def _encode_uncached(
+        self,
+        texts: List[str],
+        batch_size: int,
+        max_workers: int,
+        max_retries: int,
+        backoff: float,
+    ) -> EncodeResult:
+        """不经过缓存，直接分批并发请求嵌入接口。"""
+        batch_size = max(1, batch_size)
+        starts = list(range(0, len(texts), batch_size))
+        batches = [texts[start : start + batch_size] for start in starts]
+        if not batches:
+            return EncodeResult(embeddings=None)
+
+        def encode_batch(batch: List[str]) -> Optional[np.ndarray]:
+            return self._encode_batch_with_retry(batch, max_retries, backoff)
+
+        workers = max(1, min(max_workers, len(batches)))
+        if workers == 1:
+            results = [encode_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="embedding"
+            ) as executor:
+                # executor.map 按提交顺序返回结果，保证重新组装时顺序不变
+                results = list(executor.map(encode_batch, batches))
+
+        dims = {result.shape[1] for result in results if result is not None}
+        if not dims:
+            logger.error(f"全部 {len(batches)} 个批次编码失败")
+            return EncodeResult(
+                embeddings=None,
+                failed_indices=list(range(len(texts))),
+                num_batches=len(batches),
+                failed_batches=len(batches),
+            )
+        if len(dims) > 1:
+            logger.error(f"不同批次返回的向量维度不一致: {sorted(dims)}")
+            return EncodeResult(
+                embeddings=None,
+                failed_indices=list(range(len(texts))),
+                num_batches=len(batches),
+                failed_batches=len(batches),
+            )
+
+        embeddings = np.full((len(texts), dims.pop()), np.nan, dtype=np.float32)
+        failed_indices: List[int] = []
+        failed_batches = 0
+        for start, batch, result in zip(starts, batches, results):
+            if result is None:
+                failed_batches += 1
+                failed_indices.extend(range(start, start + len(batch)))
+            else:
+                embeddings[start : start + len(batch)] = result
+
+        if failed_batches:
+            logger.warning(
+                f"{failed_batches}/{len(batches)} 个批次编码失败，"
+                f"涉及 {len(failed_indices)} 个文本"
+            )
+        return EncodeResult(
+            embeddings=embeddings,
+            failed_indices=failed_indices,
+            num_batches=len(batches),
+            failed_batches=failed_batches,
+        )
 
     def _call_embedding_api(self, texts: List[str]) -> Optional[np.ndarray]:
         """调用DeepSeek分析API获取文本特征向量。"""
@@ -65,7 +397,7 @@ class EmbeddingModel:
                     "mode": "topic",  # 使用主题分析模式
                 }
 
-                response = requests.post(
+                response = self._session.post(
                     analyze_url,
                     json=request_data,
                     headers={"Content-Type": "application/json"},
@@ -76,19 +408,16 @@ class EmbeddingModel:
                 response_data = response.json()
 
                 # 从分析结果中提取特征向量
-                # 这里需要根据实际API响应格式调整
-                if isinstance(response_data, dict):
-                    # 尝试提取数值特征作为向量
-                    features = self._extract_features_from_analysis(response_data, text)
-                    if features is not None:
-                        embeddings.append(features)
-                    else:
-                        logger.warning(f"无法从分析结果中提取特征: {response_data}")
-                        # 使用简单的文本哈希作为备用方案
-                        embeddings.append(self._text_to_simple_vector(text))
-                else:
+                # 这里需要根据实际API响应格式调整。提取失败时整批失败：
+                # 其它来源的备用向量与分析特征不在同一个向量空间，距离无法比较
+                if not isinstance(response_data, dict):
                     logger.warning(f"意外的API响应格式: {response_data}")
-                    embeddings.append(self._text_to_simple_vector(text))
+                    return None
+                features = self._extract_features_from_analysis(response_data, text)
+                if features is None:
+                    logger.warning(f"无法从分析结果中提取特征: {response_data}")
+                    return None
+                embeddings.append(features)
 
             if embeddings:
                 return np.array(embeddings)
@@ -163,48 +492,6 @@ class EmbeddingModel:
             logger.error(f"提取特征时发生错误: {e}")
             return None
 
-    def _text_to_simple_vector(self, text: str) -> np.ndarray:
-        """将文本转换为简单的数值向量（备用方案）。"""
-        # 使用简单的字符统计和哈希方法
-        features = []
-
-        # 基础统计特征
-        features.extend(
-            [
-                len(text),
-                len(text.split()),
-                len(set(text.split())),
-                text.count("。"),
-                text.count("，"),
-                text.count("的"),
-                text.count("是"),
-                text.count("在"),
-                text.count("有"),
-                text.count("和"),
-            ]
-        )
-
-        # 字符频率特征
-        char_counts = {}
-        for char in text:
-            char_counts[char] = char_counts.get(char, 0) + 1
-
-        # 取最常见的字符频率
-        common_chars = sorted(char_counts.items(), key=lambda x: x[1], reverse=True)[
-            :20
-        ]
-        char_features = [count for _, count in common_chars]
-        features.extend(char_features)
-
-        # 补齐到128维
-        target_dim = 128
-        if len(features) < target_dim:
-            features.extend([0.0] * (target_dim - len(features)))
-        elif len(features) > target_dim:
-            features = features[:target_dim]
-
-        return np.array(features, dtype=np.float32)
-
     def encode(self, texts: Union[str, List[str]]) -> Union[np.ndarray, None]:
         """
         将单个文本或文本列表编码为向量嵌入。
@@ -220,25 +507,109 @@ class EmbeddingModel:
             return None
 
         # 确保texts是列表格式
-        if isinstance(texts, str):
+        is_single = isinstance(texts, str)
+        if is_single:
             texts = [texts]
 
         num_texts = len(texts)
         logger.info(f"正在使用DeepSeek API编码 {num_texts} 个文本。")
 
-        # 调用DeepSeek API
-        embeddings = self._call_embedding_api(texts)
+        # 调用DeepSeek API；encode保持"全部成功或返回None"的语义，
+        # 需要部分失败明细的调用方应直接使用encode_concurrent
+        with span("embed"):
+            result = self.encode_concurrent(texts)
+        embeddings = result.embeddings if result.ok else None
 
         if embeddings is not None:
             logger.info(f"成功获取 {num_texts} 个文本的嵌入向量")
             # 如果原始输入是单个字符串，返回单个向量
-            if len(embeddings) == 1 and not isinstance(texts, list):
+            if is_single:
                 return embeddings[0]
             return embeddings
         else:
             logger.error("获取嵌入向量失败")
             return None
 
+    async def aencode(
+        self, texts: Union[str, List[str]]
+    ) -> Union[np.ndarray, None]:
+        """
+        encode的异步版本，供API服务在事件循环中使用。
+
+        先查询嵌入缓存，未命中的文本分批通过共享的异步HTTP客户端并发请求，
+        同时在途的批次数不超过EMBEDDING_MAX_WORKERS。analyze模式没有异步接口，
+        local模式是CPU计算，两者都在线程池中执行encode，不阻塞事件循环。
+
+        Args:
+            texts (Union[str, List[str]]): 要编码的文本或文本列表。
+
+        Returns:
+            Union[np.ndarray, None]: 同encode。
+        """
+        if EMBEDDING_API_MODE in ("analyze", "local"):
+            return await asyncio.to_thread(self.encode, texts)
+
+        is_single = isinstance(texts, str)
+        if is_single:
+            texts = [texts]
+        if not texts:
+            return None
+
+        with span("embed"):
+            embeddings = await self._aencode_texts(texts)
+        if embeddings is None:
+            return None
+        return embeddings[0] if is_single else embeddings
+
+    async def _aencode_texts(self, texts: List[str]) -> Optional[np.ndarray]:
+        """aencode的实现：先查缓存，未命中的文本分批并发请求。"""
+        cached = {}
+        if self.cache is not None:
+            cached = await asyncio.to_thread(
+                self.cache.get_many, self.cache_model_key, texts
+            )
+        missing = [i for i in range(len(texts)) if i not in cached]
+
+        vectors = dict(cached)
+        if missing:
+            semaphore = asyncio.Semaphore(max(1, EMBEDDING_MAX_WORKERS))
+            batch_size = max(1, EMBEDDING_BATCH_SIZE)
+
+            async def encode_batch(indices: List[int]) -> Optional[np.ndarray]:
+                batch = [texts[i] for i in indices]
+                async with semaphore:
+                    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+                        result = await self._acall_embeddings_batch(batch)
+                        if result is not None:
+                            return result
+                        if attempt < EMBEDDING_MAX_RETRIES:
+                            await asyncio.sleep(EMBEDDING_RETRY_BACKOFF * (2**attempt))
+                return None
+
+            groups = [
+                missing[start : start + batch_size]
+                for start in range(0, len(missing), batch_size)
+            ]
+            results = await asyncio.gather(*(encode_batch(group) for group in groups))
+            if any(result is None for result in results):
+                logger.error("获取嵌入向量失败")
+                return None
+
+            encoded = np.vstack(results)
+            if cached and next(iter(cached.values())).shape[0] != encoded.shape[1]:
+                logger.error("缓存向量与新编码向量维度不一致，无法合并")
+                return None
+            if self.cache is not None:
+                await asyncio.to_thread(
+                    self.cache.put_many,
+                    self.cache_model_key,
+                    [texts[i] for i in missing],
+                    encoded,
+                )
+            vectors.update(zip(missing, encoded))
+
+        return np.vstack([vectors[i] for i in range(len(texts))])
+
 
 # 单例实例，便于在整个应用程序中导入和使用
 embedding_model = EmbeddingModel()
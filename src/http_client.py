@@ -0,0 +1,39 @@
+"""共享的异步HTTP客户端。
+
+API服务中的嵌入和聊天请求都通过同一个 httpx.AsyncClient 发出，
+复用连接池而不是每次请求重新建立连接。客户端在首次使用时创建，
+服务关闭时调用 aclose_async_client() 释放。
+"""
+from typing import Optional
+
+import httpx
+
+from src.config import HTTP_MAX_CONNECTIONS, get_logger
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """返回进程共享的异步HTTP客户端，首次调用时创建。"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+        logger.info(f"已创建共享异步HTTP客户端，最大连接数 {HTTP_MAX_CONNECTIONS}")
+    return _async_client
+
+
+async def aclose_async_client():
+    """关闭共享的异步HTTP客户端。"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,140 @@
+"""增量索引使用的文件指纹清单。
+
+清单记录每个已索引文件的大小、修改时间和内容哈希，并为文件分配一个
+稳定的键（file_key）。向量表中每一行的 id 都以 "file_key#" 为前缀，
+因此文件变化或被删除时可以通过 id 列精确删除它对应的所有行。
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple
+
+from src.config import get_logger
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+class ManifestDiff(NamedTuple):
+    """当前文件集合与清单的差异。"""
+
+    changed: List[Path]  # 新增或内容已修改的文件
+    removed: List[str]  # 清单中存在、磁盘上已删除的文件（相对路径）
+    unchanged: List[Path]
+
+
+def file_key(relative_path: str) -> str:
+    """根据相对路径生成稳定的文件键，用作向量表行id的前缀。"""
+    return hashlib.sha1(relative_path.encode("utf-8")).hexdigest()[:16]
+
+
+def row_id_prefix(relative_path: str) -> str:
+    """返回某个文件所有行id的公共前缀。"""
+    return f"{file_key(relative_path)}#"
+
+
+def hash_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    """流式计算文件内容的SHA-256。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(path: Path, relative_path: str) -> Dict:
+    """计算单个文件的指纹。"""
+    stat = path.stat()
+    return {
+        "path": relative_path,
+        "key": file_key(relative_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": hash_file(path),
+    }
+
+
+def load_manifest(manifest_path: Path) -> Dict[str, Dict]:
+    """
+    读取清单文件。
+
+    Returns:
+        Dict[str, Dict]: {相对路径: 指纹}，文件不存在或损坏时返回空字典。
+    """
+    if not manifest_path.exists():
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            logger.warning(f"清单版本不匹配，将忽略: {manifest_path}")
+            return {}
+        return data.get("files", {})
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"读取索引清单失败 {manifest_path}: {e}")
+        return {}
+
+
+def save_manifest(manifest_path: Path, files: Dict[str, Dict]):
+    """原子地写入清单文件（先写临时文件再替换）。"""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix(manifest_path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": MANIFEST_VERSION, "files": files},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    os.replace(tmp_path, manifest_path)
+
+
+def diff_manifest(
+    files: Iterable[Path], source_dir: Path, manifest: Dict[str, Dict]
+) -> ManifestDiff:
+    """
+    比较磁盘上的文件与清单。
+
+    大小和修改时间都未变化的文件直接视为未修改；否则再比较内容哈希，
+    这样仅被touch过的文件不会触发重新索引。
+
+    Args:
+        files: 当前待索引的文件路径。
+        source_dir: 文件所在的根目录，用于计算相对路径。
+        manifest: load_manifest返回的清单。
+
+    Returns:
+        ManifestDiff: 变化、删除和未变化的文件。
+    """
+    changed: List[Path] = []
+    unchanged: List[Path] = []
+    seen = set()
+
+    for path in files:
+        relative = relative_key(path, source_dir)
+        seen.add(relative)
+        entry = manifest.get(relative)
+        if entry is None:
+            changed.append(path)
+            continue
+
+        stat = path.stat()
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            unchanged.append(path)
+        elif entry["size"] == stat.st_size and entry["sha256"] == hash_file(path):
+            # 内容未变，仅修改时间变化：更新清单中的mtime即可
+            entry["mtime_ns"] = stat.st_mtime_ns
+            unchanged.append(path)
+        else:
+            changed.append(path)
+
+    removed = [relative for relative in manifest if relative not in seen]
+    return ManifestDiff(changed=changed, removed=removed, unchanged=unchanged)
+
+
+def relative_key(path: Path, source_dir: Path) -> str:
+    """返回文件相对于source_dir的POSIX路径，作为清单中的键。"""
+    return path.resolve().relative_to(source_dir.resolve()).as_posix()
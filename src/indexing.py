@@ -2,34 +2,370 @@
 
 此模块包含处理文档并将其索引到向量存储中的核心逻辑。
 它可以从命令行或API调用。
+
+非reindex运行是增量的：根据文件指纹清单只处理新增或修改过的文件，
+并通过id列删除已修改或已删除文件的旧行。删除和写入都是表的新版本，查询路径
+固定读取指针中已提交的版本，运行成功后才把指针移到最新版本；被取消或失败时
+表回滚到已提交的版本。reindex运行把数据写入一张新的物理表，完成后才切换过去。
+两种方式下，索引期间查询都使用上一个已提交的版本。
 """
+import threading
 import time
+from collections import Counter, deque
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，只在进程内保证单写入
+    fcntl = None
 
-from src.config import DATA_DIR, LANCEDB_TABLE_NAME, get_logger
-from src.document_loader import load_documents
-from src.text_splitter import split_documents
-from src.vector_store import add_documents_to_store, get_db_connection
+from src.config import (
+    DATA_DIR,
+    INDEX_LOCK_PATH,
+    INDEX_MANIFEST_PATH,
+    INDEX_QUEUE_SIZE,
+    INDEX_WRITE_BATCH_SIZE,
+    LANCEDB_TABLE_NAME,
+    SMALL2BIG_ENABLED,
+    get_logger,
+)
+from src.chunk_store import paragraph_store, staging_name
+from src.db_manager import db_manager, list_table_names
+from src.document_loader import (
+    FileLoadStats,
+    iter_load_files,
+    list_document_files,
+    summarize_load_stats,
+)
+from src.index_manifest import (
+    diff_manifest,
+    file_key,
+    fingerprint,
+    load_manifest,
+    relative_key,
+    row_id_prefix,
+    save_manifest,
+)
+from src.streaming import batched, bounded
+from src.text_splitter import iter_split_documents
+from src.vector_store import (
+    delete_rows_by_id_prefix,
+    encode_documents,
+    ensure_fts_index,
+    ensure_scalar_indices,
+    ensure_vector_index,
+    get_db_connection,
+    has_current_schema,
+    write_document_batches,
+)
 
 # 获取模块专用的logger
 logger = get_logger(__name__)
 
+# 进度回调：progress(阶段名, 计数器快照)
+ProgressCallback = Callable[[str, Dict[str, int]], None]
+
+
+class IndexingCancelled(Exception):
+    """索引任务被取消。"""
+
+
+class _Progress:
+    """维护各阶段计数器，变化时通知回调，并在检查点响应取消请求。"""
+
+    def __init__(
+        self,
+        callback: Optional[ProgressCallback],
+        cancel_event: Optional[threading.Event],
+    ):
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self._lock = threading.Lock()
+        self.stage = "starting"
+        self.counters = {
+            "files_total": 0,
+            "files_loaded": 0,
+            "files_failed": 0,
+            "chunks_split": 0,
+            "chunks_embedded": 0,
+            "rows_written": 0,
+        }
+
+    def update(self, stage: Optional[str] = None, **increments: int):
+        # 流水线各阶段在不同线程中汇报进度
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            for name, value in increments.items():
+                self.counters[name] += value
+            if self.callback is not None:
+                self.callback(self.stage, dict(self.counters))
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise IndexingCancelled()
+
+
+def _drop_stale_generations(db_conn, active_name: str):
+    """删除不再被指向的旧物理表（上一次全量重建之前的版本）。"""
+    for name in db_manager.generation_names(LANCEDB_TABLE_NAME):
+        if name != active_name:
+            logger.info(f"正在删除旧表: {name}")
+            db_conn.drop_table(name)
+            paragraph_store.drop_table(name)
+            paragraph_store.drop_table(staging_name(name))
+
+
+def _drop_all_generations(db_conn):
+    """删除逻辑表的所有物理表，并通知查询路径。"""
+    for name in db_manager.generation_names(LANCEDB_TABLE_NAME):
+        logger.info(f"正在删除现有表: {name}")
+        db_conn.drop_table(name)
+        paragraph_store.drop_table(name)
+        paragraph_store.drop_table(staging_name(name))
+    db_manager.publish(LANCEDB_TABLE_NAME)
+
+
+def _begin_staging(db_conn, table_name: str) -> Optional[int]:
+    """
+    开始增量运行：把查询路径固定在已提交的版本上，并丢弃上次被中断的运行留下的写入。
+
+    Returns:
+        Optional[int]: 已提交的表版本，本次运行被取消或失败时回滚到该版本；
+            无法回滚到已提交的版本时返回None，调用方改为全量重建
+    """
+    try:
+        table = db_conn.open_table(table_name)
+        committed = db_manager.committed_version(LANCEDB_TABLE_NAME)
+        if committed is None:
+            committed = table.version
+            db_manager.activate(LANCEDB_TABLE_NAME, table_name, committed)
+        elif table.version != committed:
+            logger.warning(f"丢弃表 '{table_name}' 上未提交的写入，回滚到版本 {committed}")
+            table.restore(committed)
+        paragraph_store.drop_table(staging_name(table_name))
+        return committed
+    except Exception as e:
+        logger.error(f"准备增量写入失败: {e}")
+        return None
+
+
+def _rollback_staging(db_conn, table_name: str, committed: int):
+    """丢弃增量运行的写入：表回滚到已提交的版本，删除暂存的段落。"""
+    try:
+        table = db_conn.open_table(table_name)
+        if table.version != committed:
+            table.restore(committed)
+        paragraph_store.drop_table(staging_name(table_name))
+    except Exception as e:
+        # 下次运行开始时会再次回滚
+        logger.error(f"回滚表 '{table_name}' 到版本 {committed} 失败: {e}")
+
+
+def _commit_staging(db_conn, table_name: str, committed: int, stale_file_keys: List[str]):
+    """提交增量运行：替换已修改和已删除文件的段落，再把查询路径切换到表的最新版本。"""
+    paragraph_store.commit_staged(table_name, stale_file_keys)
+    version = db_conn.open_table(table_name).version
+    if version != committed or stale_file_keys:
+        db_manager.activate(LANCEDB_TABLE_NAME, table_name, version)
+
+
+class _Chunk(NamedTuple):
+    """流水线中的一个元素：一个待写入的句子块，或某个文件已全部产出的标记。"""
+
+    document: Optional[Document]
+    row_id: Optional[str]
+    # 句子块所属文件的相对路径
+    relative: Optional[str] = None
+    # 文件的最后一个块之后产出：(相对路径, 指纹, 文档数, 句子块数)
+    completes: Optional[Tuple[str, Dict, int, int]] = None
+
+
+def _stat_key(path: Path) -> Optional[Tuple[int, int]]:
+    """返回文件的 (大小, 修改时间)，文件不存在时返回None。"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _fingerprint_if_unchanged(
+    path: Path, relative: str, expected: Optional[Tuple[int, int]]
+) -> Optional[Dict]:
+    """计算文件指纹；文件的大小或修改时间与expected不同（或文件已删除）时返回None。"""
+    try:
+        file_fingerprint = fingerprint(path, relative)
+    except OSError:
+        return None
+    recorded = (file_fingerprint["size"], file_fingerprint["mtime_ns"])
+    # 哈希之后再取一次stat，覆盖计算指纹期间发生的修改
+    if expected == recorded == _stat_key(path):
+        return file_fingerprint
+    return None
+
+
+def _iter_file_chunks(
+    files: List[Path],
+    paragraph_table: str,
+    tracker: _Progress,
+    load_stats: List[FileLoadStats],
+) -> Iterator[_Chunk]:
+    """
+    加载和分割阶段：逐个文件产出句子块，行id以文件键为前缀。
+
+    启用Small2Big时，文件的段落原文和句子-段落关联同时写入段落库的paragraph_table下。
+    加载前记录每个文件的大小和修改时间，加载并计算指纹后再次比较；加载期间被修改
+    的文件按加载失败处理，避免清单中的新指纹对应旧内容。
+    """
+    before = {path: _stat_key(path) for path in files}
+    with closing(iter_load_files(files)) as loaded_files:
+        for path, docs, stats in loaded_files:
+            tracker.check_cancelled()
+            relative = relative_key(path, DATA_DIR)
+            if stats.ok:
+                file_fingerprint = _fingerprint_if_unchanged(path, relative, before[path])
+                if file_fingerprint is None:
+                    logger.warning(f"文件 {relative} 在加载期间被修改，下次运行时重新索引")
+                    stats = FileLoadStats(
+                        path, "error", 0, stats.seconds, "file changed during loading"
+                    )
+            load_stats.append(stats)
+            if not stats.ok:
+                tracker.update(files_failed=1)
+                continue
+            prefix = row_id_prefix(relative)
+            paragraphs, relations, sentences = [], [], []
+            for para_num, item in enumerate(iter_split_documents(docs)):
+                paragraph_id = f"{prefix}p{para_num}"
+                paragraphs.append((paragraph_id, item["para"].page_content))
+                for sentence in item["sentences"]:
+                    sentence_id = f"{prefix}{len(sentences)}"
+                    relations.append((sentence_id, paragraph_id))
+                    sentences.append(_Chunk(sentence, sentence_id, relative))
+            if SMALL2BIG_ENABLED:
+                paragraph_store.put_file(paragraph_table, file_key(relative), paragraphs, relations)
+            yield from sentences
+            tracker.update(files_loaded=1, chunks_split=len(sentences))
+            yield _Chunk(
+                None, None, completes=(relative, file_fingerprint, len(docs), len(sentences))
+            )
+
 
-def run_indexing(reindex: bool = False):
+def _encode_chunk_batches(
+    batches: Iterable[List[_Chunk]], tracker: _Progress
+) -> Iterator[Tuple[Tuple[List[Document], List[str], Optional[np.ndarray]], Counter, List]]:
+    """
+    编码阶段：产出 ((文档, id, 嵌入矩阵), 每个文件编码成功的块数, 本批中已全部产出的文件)。
+
+    Raises:
+        RuntimeError: 某一批全部编码失败
+    """
+    for batch in batches:
+        documents = [chunk.document for chunk in batch if chunk.document is not None]
+        ids = [chunk.row_id for chunk in batch if chunk.document is not None]
+        completed = [chunk.completes for chunk in batch if chunk.completes is not None]
+        if documents:
+            encoded = encode_documents(documents, ids)
+            if encoded is None:
+                raise RuntimeError("生成嵌入失败")
+        else:
+            encoded = ([], [], None)
+        # encode_documents会丢弃编码失败的块，按保留下来的id统计每个文件的块数
+        sources = {chunk.row_id: chunk.relative for chunk in batch if chunk.document is not None}
+        kept = Counter(sources[row_id] for row_id in encoded[1])
+        tracker.update(chunks_embedded=len(encoded[0]))
+        yield encoded, kept, completed
+
+
+# 进程内的索引锁；跨进程由INDEX_LOCK_PATH上的flock保证
+_process_lock = threading.Lock()
+
+
+@contextmanager
+def indexing_lock() -> Iterator[bool]:
+    """
+    非阻塞地获取索引写锁。
+
+    Yields:
+        bool: 是否获得了锁；其它线程或进程正在运行索引流水线时为False
+    """
+    if not _process_lock.acquire(blocking=False):
+        yield False
+        return
+    try:
+        if fcntl is None:
+            yield True
+            return
+        INDEX_LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(INDEX_LOCK_PATH, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        _process_lock.release()
+
+
+def indexing_in_progress() -> bool:
+    """当前是否有线程或进程持有索引写锁。"""
+    with indexing_lock() as acquired:
+        return not acquired
+
+
+def run_indexing(
+    reindex: bool = False,
+    progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+):
     """
     运行完整的索引流水线：加载、分割、编码和存储。
 
     此函数编排从数据目录读取文档、将其分割成可管理的块，
-    然后将它们添加到LanceDB向量存储的过程。
+    然后将它们添加到LanceDB向量存储的过程。默认以增量模式运行，
+    只重新处理指纹发生变化的文件。整个运行期间持有跨进程的索引写锁，
+    其它进程（命令行或另一个API工作进程）正在索引时直接返回错误。
 
     Args:
-        reindex (bool): 如果为True，在索引新文档前删除现有的LanceDB表。
-                       默认为False。
+        reindex (bool): 如果为True，重新处理所有文件并写入一张新表，
+                       完成后替换现有表。默认为False。
+        progress (ProgressCallback, optional): 进度回调，每个阶段或计数变化时调用。
+        cancel_event (threading.Event, optional): 被设置后，流水线在下一个检查点停止。
 
     Returns:
         dict: 包含索引操作状态、描述性消息和总持续时间（秒）的字典。
+              被取消时status为"cancelled"。
     """
+    with indexing_lock() as acquired:
+        if not acquired:
+            logger.error("另一个进程正在运行索引流水线")
+            return {
+                "status": "error",
+                "message": "另一个进程正在运行索引流水线，请稍后重试。",
+                "duration_seconds": 0.0,
+            }
+        return _run_indexing(reindex, progress, cancel_event)
+
+
+def _run_indexing(
+    reindex: bool,
+    progress: Optional[ProgressCallback],
+    cancel_event: Optional[threading.Event],
+):
+    """在持有索引写锁时运行流水线，参数和返回值见run_indexing。"""
     logger.info("--- 开始索引流水线 ---")
     start_time = time.time()
+    tracker = _Progress(progress, cancel_event)
 
     db_conn = get_db_connection()
     if db_conn is None:
@@ -39,13 +375,57 @@ def run_indexing(reindex: bool = False):
             "duration_seconds": time.time() - start_time,
         }
 
-    if reindex and LANCEDB_TABLE_NAME in db_conn.table_names():
-        logger.info(f"正在删除现有表: {LANCEDB_TABLE_NAME}")
-        db_conn.drop_table(LANCEDB_TABLE_NAME)
+    active_name = db_manager.resolve_table_name(LANCEDB_TABLE_NAME)
+    manifest = {} if reindex else load_manifest(INDEX_MANIFEST_PATH)
+    table_exists = active_name in list_table_names(db_conn)
+    if table_exists and not manifest and not reindex:
+        # 没有清单就无法判断表中已有哪些文件的数据，退化为全量重建以避免重复行
+        logger.warning("未找到索引清单，将执行全量重建。")
+        reindex = True
+    if table_exists and not reindex and not has_current_schema(db_conn, active_name):
+        # 旧版本创建的表缺少结构化元数据列，无法增量写入
+        logger.warning("表结构已过期，将执行全量重建。")
+        reindex = True
+    if not table_exists and not reindex:
+        # 没有可以增量更新的表：与全量重建一样写入新表，完成后切换
+        reindex = True
+
+    committed_version = None
+    if not reindex:
+        committed_version = _begin_staging(db_conn, active_name)
+        if committed_version is None:
+            logger.warning("无法回滚到已提交的版本，将执行全量重建。")
+            reindex = True
+
+    if reindex:
+        # 全量重建不参考清单，所有文件都写入新表
+        manifest = {}
+        # 先清理上一代旧表，再把本次数据写入新表，完成后切换
+        _drop_stale_generations(db_conn, active_name)
+        target_name = db_manager.new_generation_name(LANCEDB_TABLE_NAME)
+        paragraph_table = target_name
+        logger.info(f"全量重建将写入新表: {target_name}")
+    else:
+        # 增量运行的段落先写入暂存区，提交时替换
+        target_name = active_name
+        paragraph_table = staging_name(target_name)
+
+    if not DATA_DIR.is_dir():
+        logger.error(f"Source directory not found: {DATA_DIR}")
+        files = []
+    else:
+        files = list_document_files(DATA_DIR)
+    diff = diff_manifest(files, DATA_DIR, manifest)
+    logger.info(
+        f"文件变化: {len(diff.changed)} 个新增或修改，{len(diff.removed)} 个删除，"
+        f"{len(diff.unchanged)} 个未变化"
+    )
+    tracker.update("scanning", files_total=len(diff.changed))
 
-    docs = load_documents(DATA_DIR)
-    if not docs:
+    if not files and not manifest:
         logger.warning("在数据目录中未找到文档。")
+        if reindex:
+            _drop_all_generations(db_conn)
         duration = time.time() - start_time
         return {
             "status": "warning",
@@ -53,25 +433,140 @@ def run_indexing(reindex: bool = False):
             "duration_seconds": duration,
         }
 
-    chunks = split_documents(docs)
-    success = add_documents_to_store(chunks, db_conn, LANCEDB_TABLE_NAME)
+    num_docs = 0
+    fingerprints = {}
+    load_stats = []
+    stale = [relative_key(path, DATA_DIR) for path in diff.changed] + diff.removed
+    success = True
+    try:
+        # 1. 删除已修改和已删除文件的旧行（包括上次写入、但未记入清单的部分数据）。
+        #    删除只进入表的新版本，提交前查询仍读取已提交的版本
+        if not reindex:
+            stale_prefixes = [row_id_prefix(relative) for relative in stale]
+            if not delete_rows_by_id_prefix(db_conn, target_name, stale_prefixes):
+                _rollback_staging(db_conn, target_name, committed_version)
+                duration = time.time() - start_time
+                logger.error(f"--- 索引流水线在 {duration:.2f}s 内失败 ---")
+                return {
+                    "status": "error",
+                    "message": "删除已修改文件的旧数据失败。",
+                    "duration_seconds": duration,
+                }
+        for relative in stale:
+            manifest.pop(relative, None)
+
+        # 2. 流式处理发生变化的文件：加载 -> 分割 -> 分批 -> 编码 -> 写入。
+        #    阶段之间用有界队列连接，内存占用取决于批大小而不是语料大小。
+        #    一个文件的全部行写入后才记录它的指纹；加载失败、超时或有块编码失败的文件不记入清单，
+        #    下次运行会重试
+        tracker.update("ingesting")
+        chunks = _iter_file_chunks(diff.changed, paragraph_table, tracker, load_stats)
+        batches = bounded(
+            batched(chunks, INDEX_WRITE_BATCH_SIZE), INDEX_QUEUE_SIZE, name="index-split"
+        )
+        encoded = bounded(
+            _encode_chunk_batches(batches, tracker), INDEX_QUEUE_SIZE, name="index-encode"
+        )
+        completed_batches = deque()
+        # 每个文件已写入表中的块数
+        written = Counter()
+
+        def unzip_completed():
+            for encoded_batch, kept, completed in encoded:
+                completed_batches.append((kept, completed))
+                yield encoded_batch
+
+        with closing(encoded):
+            try:
+                for rows in write_document_batches(db_conn, target_name, unzip_completed()):
+                    kept, completed = completed_batches.popleft()
+                    written.update(kept)
+                    for relative, file_fingerprint, file_docs, file_chunks in completed:
+                        file_written = written.pop(relative, 0)
+                        num_docs += file_docs
+                        if file_written < file_chunks:
+                            # 有块编码失败的文件不记入清单，下次运行会重新处理
+                            logger.warning(
+                                f"文件 {relative} 只写入了 {file_written}/{file_chunks} 个文本块，"
+                                f"下次运行时重新索引"
+                            )
+                            continue
+                        fingerprints[relative] = file_fingerprint
+                    tracker.update(rows_written=rows)
+                    tracker.check_cancelled()
+            except IndexingCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"向向量存储添加文档失败: {e}")
+                success = False
+
+        load_summary = summarize_load_stats(load_stats)
+        logger.info(
+            f"文件加载耗时 {load_summary['load_seconds']:.2f}s，"
+            f"失败 {load_summary['files_failed']} 个，超时 {load_summary['files_timed_out']} 个"
+        )
+
+    except IndexingCancelled:
+        duration = time.time() - start_time
+        if not reindex:
+            # 回滚到已提交的版本；磁盘上的清单仍与该版本一致
+            _rollback_staging(db_conn, target_name, committed_version)
+        tracker.update("cancelled")
+        logger.warning(f"--- 索引流水线在 {duration:.2f}s 后被取消 ---")
+        return {
+            "status": "cancelled",
+            "message": "索引任务已取消，表仍保持上一个已提交的版本。",
+            "duration_seconds": duration,
+        }
+
+    # 3. 只有写入成功后才记录新指纹，失败的文件下次运行会重新处理
+    if success:
+        manifest.update(fingerprints)
+        tracker.update("indexing")
+        ensure_vector_index(db_conn, target_name)
+        ensure_scalar_indices(db_conn, target_name)
+        ensure_fts_index(db_conn, target_name)
+
+    # 4. 提交：全量重建切换到新表；增量运行替换暂存的段落并切换到表的最新版本，
+    #    失败时回滚。先提交再保存清单：两步之间中断时，下次运行只会重复处理这些文件
+    if reindex:
+        if success and target_name in list_table_names(db_conn):
+            version = db_conn.open_table(target_name).version
+            db_manager.activate(LANCEDB_TABLE_NAME, target_name, version)
+            save_manifest(INDEX_MANIFEST_PATH, manifest)
+        elif success:
+            # 没有任何文本块写入：与重建前删除旧表的语义一致，清空表和清单
+            save_manifest(INDEX_MANIFEST_PATH, manifest)
+            _drop_all_generations(db_conn)
+    elif success:
+        _commit_staging(db_conn, target_name, committed_version, [file_key(r) for r in stale])
+        save_manifest(INDEX_MANIFEST_PATH, manifest)
+    else:
+        _rollback_staging(db_conn, target_name, committed_version)
 
     duration = time.time() - start_time
     if success:
+        tracker.update("done")
         message = (
-            f"索引完成。处理了 {len(docs)} 个文档，"
-            f"生成了 {len(chunks)} 个文本块。"
+            f"索引完成。处理了 {len(diff.changed)} 个变化文件中的 {num_docs} 个文档，"
+            f"生成了 {tracker.counters['chunks_split']} 个文本块；跳过 {len(diff.unchanged)} 个未变化文件，"
+            f"移除 {len(diff.removed)} 个已删除文件。"
         )
+        failed = tracker.counters["files_failed"]
+        if failed:
+            message += f"{failed} 个文件加载失败或超时，将在下次运行时重试。"
         logger.info(f"--- 索引流水线在 {duration:.2f}s 内完成 ---")
         return {
             "status": "success",
             "message": message,
             "duration_seconds": duration,
+            "load_stats": load_summary,
         }
     else:
+        tracker.update("failed")
         logger.error(f"--- 索引流水线在 {duration:.2f}s 内失败 ---")
         return {
             "status": "error",
             "message": "向向量存储添加文档失败。",
             "duration_seconds": duration,
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,306 @@
+"""后台索引任务。
+
+POST /index 不再在请求中同步运行索引流水线，而是提交一个任务后立即返回
+任务id。任务在单线程的后台执行器中运行，run_indexing本身持有跨进程的
+索引写锁，因此即使服务以多个工作进程运行，同一时刻也只有一个写入任务；
+查询在任务完成并提交新版本之前继续使用上一个已提交的表版本。
+
+任务状态同时写入INDEX_JOB_DIR下的 <job_id>.json，负载均衡把查询或取消请求
+分配到其它工作进程时也能找到任务：查询直接读取状态文件，取消时创建
+<job_id>.cancel 标记文件，运行任务的进程在下一个检查点看到它后停止。
+同一阶段内的进度最多每INDEX_JOB_SAVE_INTERVAL秒写入一次状态文件，本进程的
+查询直接读取内存中的最新进度。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.config import INDEX_JOB_DIR, INDEX_JOB_SAVE_INTERVAL, get_logger
+from src.indexing import indexing_in_progress, run_indexing
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+# 内存中最多保留的已结束任务数
+MAX_FINISHED_JOBS = 100
+
+ACTIVE_STATUSES = ("pending", "running")
+
+
+class JobConflictError(Exception):
+    """已有索引任务在排队或运行时提交新任务。"""
+
+    def __init__(self, active_job_id: str):
+        super().__init__(f"索引任务 {active_job_id} 正在进行中")
+        self.active_job_id = active_job_id
+
+
+class SharedCancelEvent(threading.Event):
+    """
+    取消事件：本进程调用set()，或其它进程创建了取消标记文件，都视为已请求取消。
+
+    run_indexing在检查点只调用is_set()，因此检查标记文件只多一次stat。
+    """
+
+    def __init__(self, marker: Path):
+        super().__init__()
+        self.marker = marker
+
+    def is_set(self) -> bool:
+        return super().is_set() or self.marker.exists()
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@dataclass
+class IndexingJob:
+    """单个索引任务的状态和进度。"""
+
+    job_id: str
+    reindex: bool
+    status: str = "pending"  # pending / running / succeeded / failed / cancelled
+    stage: str = "pending"
+    counters: Dict[str, int] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """返回可序列化的任务快照，附带已运行时间和各阶段吞吐量（个/秒）。"""
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        throughput = {
+            name: round(value / elapsed, 2) if elapsed > 0 else 0.0
+            for name, value in self.counters.items()
+            if name != "files_total"
+        }
+        return {
+            "job_id": self.job_id,
+            "reindex": self.reindex,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": dict(self.counters),
+            "throughput_per_second": throughput,
+            "elapsed_seconds": round(elapsed, 3),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "cancel_requested": self.cancel_event.is_set(),
+        }
+
+
+class IndexingJobManager:
+    """
+    管理后台索引任务：提交、查询进度和取消。
+
+    本进程提交的任务保存在内存中，状态同步写入state_dir，其它工作进程的任务
+    通过读取state_dir查询。
+    """
+
+    def __init__(self, state_dir: Path = INDEX_JOB_DIR):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="indexing")
+        self._jobs: Dict[str, IndexingJob] = {}
+        self._lock = threading.Lock()
+        self.state_dir = Path(state_dir)
+
+    def submit(self, reindex: bool = False) -> IndexingJob:
+        """
+        提交索引任务。
+
+        Raises:
+            JobConflictError: 已有任务在排队或运行
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status in ACTIVE_STATUSES:
+                    raise JobConflictError(job.job_id)
+            # 其它工作进程的任务，或命令行正在运行的索引（没有任务id）
+            for snapshot in self._shared_snapshots():
+                if snapshot["status"] in ACTIVE_STATUSES:
+                    raise JobConflictError(snapshot["job_id"])
+            if indexing_in_progress():
+                raise JobConflictError("unknown")
+            job_id = uuid.uuid4().hex
+            job = IndexingJob(
+                job_id=job_id,
+                reindex=reindex,
+                cancel_event=SharedCancelEvent(self._cancel_marker(job_id)),
+            )
+            self._jobs[job.job_id] = job
+            self._save(job)
+            self._prune_locked()
+
+        logger.info(f"已提交索引任务 {job.job_id}，reindex={reindex}")
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: IndexingJob):
+        if job.cancel_event.is_set():
+            job.status, job.stage = "cancelled", "cancelled"
+            job.finished_at = time.time()
+            self._save(job)
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        self._save(job)
+
+        last_saved = time.monotonic()
+
+        def on_progress(stage: str, counters: Dict[str, int]):
+            nonlocal last_saved
+            stage_changed = stage != job.stage
+            job.stage = stage
+            job.counters = counters
+            now = time.monotonic()
+            if stage_changed or now - last_saved >= INDEX_JOB_SAVE_INTERVAL:
+                last_saved = now
+                self._save(job)
+
+        try:
+            result = run_indexing(
+                reindex=job.reindex, progress=on_progress, cancel_event=job.cancel_event
+            )
+            job.result = result
+            job.status = {
+                "success": "succeeded",
+                "warning": "succeeded",
+                "cancelled": "cancelled",
+            }.get(result.get("status"), "failed")
+            if job.status == "failed":
+                job.error = result.get("message")
+        except Exception as e:
+            logger.error(f"索引任务 {job.job_id} 失败: {e}", exc_info=True)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            self._cancel_marker(job.job_id).unlink(missing_ok=True)
+            logger.info(f"索引任务 {job.job_id} 结束，状态: {job.status}")
+
+    def _state_path(self, job_id: str) -> Path:
+        return self.state_dir / f"{job_id}.json"
+
+    def _cancel_marker(self, job_id: str) -> Path:
+        return self.state_dir / f"{job_id}.cancel"
+
+    def _save(self, job: IndexingJob):
+        """把任务快照原子地写入状态文件，写入失败只影响其它进程的查询。"""
+        try:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            path = self._state_path(job.job_id)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(
+                json.dumps({**job.to_dict(), "pid": os.getpid()}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入索引任务状态失败: {e}")
+
+    def _load(self, path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            snapshot = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        # 运行任务的工作进程已退出（如被强制终止），任务不会再更新
+        if snapshot.get("status") in ACTIVE_STATUSES and not _process_alive(
+            int(snapshot.get("pid") or 0)
+        ):
+            snapshot["status"] = "failed"
+            snapshot["error"] = "运行该任务的工作进程已退出"
+        return snapshot
+
+    def _shared_snapshots(self) -> List[Dict[str, Any]]:
+        """其它进程提交的任务快照。"""
+        if not self.state_dir.is_dir():
+            return []
+        snapshots = []
+        for path in self.state_dir.glob("*.json"):
+            if path.stem in self._jobs:
+                continue
+            snapshot = self._load(path)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        按id查询任务快照，包括其它工作进程提交的任务。
+
+        Returns:
+            Optional[Dict[str, Any]]: 同IndexingJob.to_dict()，不存在时返回None
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self._load(self._state_path(job_id))
+
+    def list(self) -> List[Dict[str, Any]]:
+        """按提交时间倒序返回所有工作进程的任务快照。"""
+        snapshots = [job.to_dict() for job in self._jobs.values()] + self._shared_snapshots()
+        return sorted(snapshots, key=lambda snapshot: snapshot["created_at"], reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        请求取消任务；运行中的任务在下一个检查点停止。
+
+        任务属于其它工作进程时创建取消标记文件，由该进程在检查点发现。
+
+        Returns:
+            Optional[Dict[str, Any]]: 任务快照，不存在时返回None
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            if job.status in ACTIVE_STATUSES:
+                logger.info(f"请求取消索引任务 {job_id}")
+                job.cancel_event.set()
+            return job.to_dict()
+
+        snapshot = self._load(self._state_path(job_id))
+        if snapshot is not None and snapshot["status"] in ACTIVE_STATUSES:
+            logger.info(f"请求取消其它工作进程的索引任务 {job_id}")
+            self._cancel_marker(job_id).touch()
+            snapshot["cancel_requested"] = True
+        return snapshot
+
+    def _prune_locked(self):
+        finished = sorted(
+            (job for job in self._jobs.values() if job.status not in ACTIVE_STATUSES),
+            key=lambda job: job.created_at,
+            reverse=True,
+        )
+        for job in finished[MAX_FINISHED_JOBS:]:
+            del self._jobs[job.job_id]
+            self._state_path(job.job_id).unlink(missing_ok=True)
+
+    def shutdown(self):
+        """取消所有未完成的任务并等待执行器退出。"""
+        for job in list(self._jobs.values()):
+            if job.status in ACTIVE_STATUSES:
+                job.cancel_event.set()
+        self._executor.shutdown(wait=True)
+
+
+# 进程级单例
+job_manager = IndexingJobManager()
@@ -0,0 +1,288 @@
+"""进程内指标：分阶段耗时直方图、计数器，以Prometheus文本格式导出。
+
+RAG流水线的每个阶段用 span(stage) 包裹，耗时同时记入全局直方图
+rag_stage_duration_seconds 和当前请求的耗时明细（collect_timings），
+后者用于在 /ask 响应中返回本次请求的分阶段耗时。请求上下文通过contextvars
+传递，asyncio.to_thread 启动的线程会继承它。
+
+不依赖prometheus_client，render() 直接生成Prometheus文本格式（0.0.4）。
+指标只保存在当前进程的内存中：main.py serve 以多个工作进程运行时，
+每个进程有自己的一份，/metrics 返回的是处理该次抓取的那个进程的数据。
+"""
+import asyncio
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# 请求级耗时明细（毫秒），不在collect_timings范围内时为None
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "request_timings", default=None
+)
+
+# 默认的耗时分桶（秒），覆盖毫秒级的检索到数十秒的LLM生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_bound(bound: float) -> str:
+    # 与prometheus_client一致，分桶上界总是写成浮点数形式，如 le="1.0"
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+class _Metric(ABC):
+    """指标基类：按标签值分组保存数据。"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.label_names}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> List[Sample]:
+        """返回导出时的全部样本。"""
+
+
+class Counter(_Metric):
+    """单调递增的计数器。"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.label_names, key)), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Histogram(_Metric):
+    """累计分桶直方图。"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # 标签值 -> (每个桶的计数, 总和, 总数)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            items = sorted((key, (list(c), s, n)) for key, (c, s, n) in self._values.items())
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": _format_bound(bound)}, cumulative)
+                )
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+# 采集函数在导出时被调用，返回 (指标名, 类型, 说明, [(标签, 值)])，
+# 用于导出其它模块自己维护的统计（如缓存命中数），不在热路径上增加开销
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class MetricsRegistry:
+    """指标注册表。"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标已注册: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def register_collector(self, collector: Collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """生成Prometheus文本格式的全部指标。"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in collectors:
+            for name, type_name, documentation, values in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "rag_stage_duration_seconds",
+    "RAG流水线各阶段耗时（秒）",
+    ["stage"],
+)
+LLM_TOKENS = registry.counter(
+    "rag_llm_tokens_total",
+    "LLM服务报告的token用量",
+    ["type"],
+)
+QUERIES = registry.counter(
+    "rag_queries_total",
+    "处理的查询数，cached表示是否命中回答缓存",
+    ["cached"],
+)
+EVENT_LOOP_LAG = registry.histogram(
+    "rag_event_loop_lag_seconds",
+    "事件循环的调度延迟（秒），即定时唤醒比预期晚的时间",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    """记录一个阶段的耗时；同一请求中多次出现的阶段耗时累加。"""
+    STAGE_DURATION.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """用with块包裹一个阶段并记录其耗时，见observe_stage。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """
+    收集当前请求内各阶段的耗时。
+
+    Yields:
+        Dict[str, float]: {阶段名: 毫秒}，在with块结束前持续更新
+    """
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+async def monitor_event_loop_lag(interval: float):
+    """
+    每隔interval秒唤醒一次并记录实际唤醒时间比预期晚了多少。
+
+    同步代码阻塞事件循环（如在协程中直接做磁盘IO或CPU密集计算）时延迟会升高，
+    所有并发请求都会被拖慢。在事件循环中作为后台任务运行，取消即停止。
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+
+def record_token_usage(usage: Optional[Dict[str, int]]):
+    """记录LLM响应中的usage字段（prompt_tokens/completion_tokens）。"""
+    if not usage:
+        return
+    for field, token_type in (("prompt_tokens", "prompt"), ("completion_tokens", "completion")):
+        value = usage.get(field)
+        if isinstance(value, (int, float)) and value >= 0:
+            LLM_TOKENS.inc(value, type=token_type)
@@ -0,0 +1,407 @@
+"""查询明细日志：异步、缓冲的JSON Lines写入器，按大小和时间轮转。
+
+每个查询的回答和检索明细作为一行JSON追加到日志文件，写入在后台线程中进行：
+请求路径只把记录放进队列（队列满时丢弃并计数，不会阻塞请求），后台线程
+攒批写入，当前文件超过大小上限或打开时间超过轮转间隔时重命名为带时间戳的
+归档文件（可选gzip压缩），只保留最近的若干个归档。
+
+多个工作进程可以写同一个日志文件：每批以追加模式写入，轮转在文件锁内进行，
+其它进程发现文件已被轮转（inode变化）后重新打开新文件。
+
+读取函数按时间顺序遍历归档和当前文件，供 tools/query_log.py 查看最近的
+查询和统计延迟。
+"""
+import atexit
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，只支持单进程写入
+    fcntl = None
+
+import numpy as np
+
+from src.config import get_logger
+
+# 获取模块专用的logger
+logger = get_logger(__name__)
+
+# 归档文件名中的时间戳，如 queries.20250724-112607.jsonl.gz
+_ARCHIVE_TIME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def _archive_pattern(path: Path) -> "re.Pattern":
+    stem, suffix = re.escape(path.stem), re.escape(path.suffix)
+    return re.compile(rf"^{stem}\.(\d{{8}}-\d{{6}})(?:-(\d+))?{suffix}(\.gz)?$")
+
+
+def list_log_files(path: Path) -> List[Path]:
+    """
+    按时间顺序列出日志文件：先是归档（从旧到新），最后是当前文件。
+
+    Args:
+        path (Path): 当前日志文件路径。
+
+    Returns:
+        List[Path]: 存在的日志文件。
+    """
+    path = Path(path)
+    pattern = _archive_pattern(path)
+    archives = []
+    if path.parent.is_dir():
+        for candidate in path.parent.iterdir():
+            match = pattern.match(candidate.name)
+            if match:
+                archives.append((match.group(1), int(match.group(2) or 0), candidate))
+    files = [candidate for _, _, candidate in sorted(archives)]
+    if path.exists():
+        files.append(path)
+    return files
+
+
+class QueryLogWriter:
+    """
+    后台线程写入的查询日志，线程安全；第一次写入时启动后台线程。
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_bytes: int,
+        rotate_seconds: float,
+        backup_count: int,
+        compress: bool = True,
+        flush_interval: float = 1.0,
+        queue_size: int = 10000,
+    ):
+        """
+        Args:
+            path (Path): 当前日志文件路径。
+            max_bytes (int): 当前文件超过该大小时轮转，0表示不按大小轮转。
+            rotate_seconds (float): 当前文件打开超过该时间（秒）时轮转，0表示不按时间轮转。
+            backup_count (int): 保留的归档数量，0表示不删除旧归档。
+            compress (bool): 是否用gzip压缩归档。
+            flush_interval (float): 缓冲的记录最多等待多久（秒）写入文件。
+            queue_size (int): 待写入记录的队列容量，队列满时新记录被丢弃。
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._file = None
+        self._opened_at = 0.0
+        self.written = 0
+        self.dropped = 0
+
+    # --- 请求路径 ---
+
+    def log(self, record: Dict[str, Any]) -> bool:
+        """
+        把一条记录放进写入队列，不做任何IO。
+
+        Returns:
+            bool: 是否入队；写入器已关闭或队列已满时返回False
+        """
+        if self._closed:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning(f"查询日志队列已满，已丢弃 {self.dropped} 条记录")
+            return False
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待队列中已有的记录写入文件，返回是否在timeout秒内完成。"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """写入剩余记录并停止后台线程。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("查询日志队列已满，关闭时部分记录未写入")
+            return
+        thread.join(timeout)
+
+    # --- 后台线程 ---
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="query-log-writer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        buffer: List[str] = []
+        deadline = None
+        running = True
+        while running:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            waiters = []
+            # 一次取走队列中已有的全部记录，攒成一批写入
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif item != ():
+                    try:
+                        buffer.append(json.dumps(item, ensure_ascii=False, default=str))
+                    except (TypeError, ValueError) as e:
+                        logger.warning(f"查询日志记录无法序列化: {e}")
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if buffer and (
+                not running or waiters or time.monotonic() >= (deadline or 0)
+            ):
+                self._write(buffer)
+                buffer = []
+                deadline = None
+            for waiter in waiters:
+                waiter.set()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, lines: List[str]):
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            if self._file is not None and self._rotated_elsewhere():
+                self._file.close()
+                self._file = None
+            if self._file is None:
+                self._open()
+            if self._should_rotate(len(data)):
+                with self._rotation_lock():
+                    # 等待锁期间其它进程可能已经完成了轮转
+                    if self._rotated_elsewhere():
+                        self._file.close()
+                        self._open()
+                    if self._should_rotate(len(data)):
+                        self._rotate()
+                        self._open()
+            self._file.write(data)
+            self._file.flush()
+            self.written += len(lines)
+        except OSError as e:
+            logger.error(f"写入查询日志失败: {e}")
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._opened_at = time.time()
+
+    def _rotated_elsewhere(self) -> bool:
+        """当前路径是否已不是打开的文件（被其它进程轮转或删除）。"""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    @contextmanager
+    def _rotation_lock(self) -> Iterator[None]:
+        """跨进程的轮转锁。"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path.with_name(self.path.name + ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _should_rotate(self, incoming: int) -> bool:
+        # 其它进程也在追加写入，文件大小以fstat为准
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            return False
+        if self.max_bytes and size + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self._opened_at >= self.rotate_seconds
+
+    def _rotate(self):
+        """把当前文件重命名为带时间戳的归档，压缩并清理旧归档。"""
+        self._file.close()
+        self._file = None
+
+        # 同一秒内多次轮转时追加序号，序号总是大于已有的归档，保证按名称排序即按时间排序
+        stamp = datetime.now().strftime(_ARCHIVE_TIME_FORMAT)
+        pattern = _archive_pattern(self.path)
+        counters = [
+            int(match.group(2) or 0)
+            for match in (pattern.match(p.name) for p in self.path.parent.iterdir())
+            if match and match.group(1) == stamp
+        ]
+        name = f"{self.path.stem}.{stamp}"
+        if counters:
+            name += f"-{max(counters) + 1}"
+        archive = self.path.with_name(name + self.path.suffix)
+        os.replace(self.path, archive)
+
+        if self.compress:
+            compressed = Path(f"{archive}.gz")
+            with open(archive, "rb") as src, gzip.open(compressed, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            archive.unlink()
+            archive = compressed
+        logger.info(f"查询日志已轮转: {archive}")
+
+        if self.backup_count:
+            archives = list_log_files(self.path)
+            if archives and archives[-1] == self.path:
+                archives.pop()
+            for old in archives[: max(0, len(archives) - self.backup_count)]:
+                old.unlink()
+
+
+def build_query_record(
+    query: str,
+    response: Dict[str, Any],
+    response_time_seconds: float,
+    relevance_threshold: float,
+    **extra: Any,
+) -> Dict[str, Any]:
+    """
+    构建一条查询明细记录。
+
+    Args:
+        query (str): 用户查询。
+        response (Dict[str, Any]): 流水线返回的回答（llm_answer和retrieved_context）。
+        response_time_seconds (float): 从收到查询到得到完整回答的耗时。
+        relevance_threshold (float): 判断相关度使用的阈值。
+        **extra: 附加字段，如 cached、filters。
+
+    Returns:
+        Dict[str, Any]: 可序列化为JSON的记录。
+    """
+    results = []
+    for rank, item in enumerate(response.get("retrieved_context") or [], start=1):
+        metadata = item.get("metadata") or {}
+        results.append(
+            {
+                "rank": rank,
+                "similarity_score": item.get("score"),
+                "has_context": metadata.get("has_context", False),
+                "source": metadata.get("source"),
+                "matched_sentence": item.get("sentence", item.get("text")),
+                "paragraph_context": item.get("paragraph"),
+            }
+        )
+    record = {
+        "timestamp": datetime.now().isoformat(),
+        "query": query,
+        "response_time_seconds": round(response_time_seconds, 4),
+        "llm_answer": response.get("llm_answer"),
+        "retrieval_details": {
+            "total_results": len(results),
+            "relevance_threshold": relevance_threshold,
+            "results": results,
+        },
+    }
+    record.update(extra)
+    return record
+
+
+def _open_log_file(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_query_records(files: Iterable[Path]) -> Iterator[Dict[str, Any]]:
+    """按顺序读取日志文件中的记录，跳过无法解析的行（如写入到一半的最后一行）。"""
+    for path in files:
+        try:
+            with _open_log_file(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except OSError as e:
+            logger.warning(f"读取查询日志 {path} 失败: {e}")
+
+
+def summarize_latency(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    统计记录的响应时间。
+
+    Returns:
+        Dict[str, Any]: count、cached（命中回答缓存的记录数）以及mean/p50/p90/p99/max秒数
+    """
+    latencies = []
+    cached = 0
+    for record in records:
+        value = record.get("response_time_seconds")
+        if value is None:
+            continue
+        latencies.append(float(value))
+        cached += bool(record.get("cached"))
+    if not latencies:
+        return {"count": 0, "cached": 0}
+    values = np.array(latencies)
+    return {
+        "count": len(latencies),
+        "cached": cached,
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p90": round(float(np.percentile(values, 90)), 4),
+        "p99": round(float(np.percentile(values, 99)), 4),
+        "max": round(float(values.max()), 4),
+    }
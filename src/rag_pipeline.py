@@ -1,24 +1,114 @@
+import asyncio
+import json
 import os
+import time
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
+import httpx
+import numpy as np
 import requests
 
+from src.answer_cache import AnswerCache
 from src.config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    BATCH_LLM_CONCURRENCY,
+    BATCH_SEARCH_SIZE,
+    DATA_DIR,
     DEEPSEEK_API_BASE,
     DEEPSEEK_CHAT_MODEL,
+    DEEPSEEK_CHAT_TIMEOUT,
+    DEEPSEEK_MAX_TOKENS,
+    DEEPSEEK_TEMPERATURE,
     LANCEDB_TABLE_NAME,
+    QUERY_LOG_BACKUPS,
+    QUERY_LOG_COMPRESS,
+    QUERY_LOG_ENABLED,
+    QUERY_LOG_FLUSH_INTERVAL,
+    QUERY_LOG_MAX_MB,
+    QUERY_LOG_PATH,
+    QUERY_LOG_QUEUE_SIZE,
+    QUERY_LOG_ROTATE_SECONDS,
+    RELEVANCE_THRESHOLD,
     TOP_K,
     get_logger,
 )
-from src.vector_store import get_db_connection, search_vector_store
+from src.db_manager import db_manager
+from src.embedding_model import embedding_model
+from src.http_client import get_async_client
+from src.metrics import QUERIES, observe_stage, record_token_usage, span
+from src.query_log import QueryLogWriter, build_query_record
+from src.vector_store import (
+    asearch_vector_store,
+    asearch_vector_store_many,
+    get_db_connection,
+    search_vector_store,
+)
 
 # 获取模块专用的logger
 logger = get_logger(__name__)
 
-# 相关度阈值配置
-RELEVANCE_THRESHOLD = 50000  # 相似度分数阈值，低于此值认为不相关
-KNOWLEDGE_BASE_FILE = "data/generated_qa.txt"  # 存储生成的问答对
+KNOWLEDGE_BASE_FILE = str(DATA_DIR / "generated_qa.txt")  # 存储生成的问答对
+
+# 回答缓存；知识库表发布新版本后整体失效
+answer_cache = (
+    AnswerCache(
+        ANSWER_CACHE_SIZE,
+        ANSWER_CACHE_TTL,
+        ANSWER_CACHE_SIMILARITY,
+        version_provider=lambda: db_manager.version_token(LANCEDB_TABLE_NAME),
+    )
+    if ANSWER_CACHE_ENABLED
+    else None
+)
+
+# 查询明细日志；请求路径只把记录放进队列，由后台线程写入
+query_log = (
+    QueryLogWriter(
+        QUERY_LOG_PATH,
+        int(QUERY_LOG_MAX_MB * 1024 * 1024),
+        QUERY_LOG_ROTATE_SECONDS,
+        QUERY_LOG_BACKUPS,
+        compress=QUERY_LOG_COMPRESS,
+        flush_interval=QUERY_LOG_FLUSH_INTERVAL,
+        queue_size=QUERY_LOG_QUEUE_SIZE,
+    )
+    if QUERY_LOG_ENABLED
+    else None
+)
+
+
+def _build_chat_request(prompt: str, system_message: str = None) -> Dict[str, Any]:
+    """构建聊天补全请求体。"""
+    # 构建完整的输入文本
+    full_input = prompt
+    if system_message:
+        full_input = f"{system_message}\n\n{prompt}"
+
+    logger.info(f"发送请求到DeepSeek聊天API，输入长度: {len(full_input)}")
+
+    # 重新构建为聊天格式
+    return {
+        "model": DEEPSEEK_CHAT_MODEL,
+        "messages": [{"role": "user", "content": full_input}],
+        "max_tokens": DEEPSEEK_MAX_TOKENS,
+        "temperature": DEEPSEEK_TEMPERATURE,
+    }
+
+
+def _extract_chat_answer(response_data: Dict[str, Any]) -> str:
+    """从聊天补全响应中提取回答文本，并记录响应中的token用量。"""
+    record_token_usage(response_data.get("usage"))
+    if "choices" in response_data and len(response_data["choices"]) > 0:
+        answer = response_data["choices"][0]["message"]["content"]
+        logger.info(f"成功获取DeepSeek聊天回答，长度: {len(answer)}")
+        return answer.strip()
+    else:
+        logger.warning(f"聊天API响应中没有找到choices字段: {response_data}")
+        return f"抱歉，API返回了意外的响应格式: {response_data}"
 
 
 def call_deepseek_api(prompt: str, system_message: str = None) -> str:
@@ -33,42 +123,21 @@ def call_deepseek_api(prompt: str, system_message: str = None) -> str:
         str: API响应或错误消息
     """
     try:
-        # 构建完整的输入文本
-        full_input = prompt
-        if system_message:
-            full_input = f"{system_message}\n\n{prompt}"
-
-        logger.info(f"发送请求到DeepSeek聊天API，输入长度: {len(full_input)}")
+        chat_request = _build_chat_request(prompt, system_message)
 
         # 发送请求到聊天端点
         chat_url = f"{DEEPSEEK_API_BASE}/chat/completions"
 
-        # 重新构建为聊天格式
-        chat_request = {
-            "model": DEEPSEEK_CHAT_MODEL,
-            "messages": [{"role": "user", "content": full_input}],
-            "max_tokens": 1000,
-            "temperature": 0.7,
-        }
-
-        response = requests.post(
-            chat_url,
-            json=chat_request,
-            headers={"Content-Type": "application/json"},
-            timeout=60,
-        )
+        with span("llm"):
+            response = requests.post(
+                chat_url,
+                json=chat_request,
+                headers={"Content-Type": "application/json"},
+                timeout=DEEPSEEK_CHAT_TIMEOUT,
+            )
 
         response.raise_for_status()
-        response_data = response.json()
-
-        # 提取聊天回答
-        if "choices" in response_data and len(response_data["choices"]) > 0:
-            answer = response_data["choices"][0]["message"]["content"]
-            logger.info(f"成功获取DeepSeek聊天回答，长度: {len(answer)}")
-            return answer.strip()
-        else:
-            logger.warning(f"聊天API响应中没有找到choices字段: {response_data}")
-            return f"抱歉，API返回了意外的响应格式: {response_data}"
+        return _extract_chat_answer(response.json())
 
     except requests.exceptions.Timeout:
         logger.error("DeepSeek预测API请求超时")
@@ -81,6 +150,152 @@ def call_deepseek_api(prompt: str, system_message: str = None) -> str:
         return f"抱歉，发生了未知错误: {str(e)}"
 
 
+async def acall_deepseek_api(prompt: str, system_message: str = None) -> str:
+    """
+    call_deepseek_api的异步版本，通过共享的异步HTTP客户端发送请求，
+    等待LLM响应期间不阻塞事件循环。
+
+    Args:
+        prompt (str): 用户提示
+        system_message (str, optional): 系统消息
+
+    Returns:
+        str: API响应或错误消息
+    """
+    try:
+        chat_request = _build_chat_request(prompt, system_message)
+
+        with span("llm"):
+            response = await get_async_client().post(
+                f"{DEEPSEEK_API_BASE}/chat/completions",
+                json=chat_request,
+                timeout=DEEPSEEK_CHAT_TIMEOUT,
+            )
+
+        response.raise_for_status()
+        return _extract_chat_answer(response.json())
+
+    except httpx.TimeoutException:
+        logger.error("DeepSeek预测API请求超时")
+        return "抱歉，请求超时。请稍后再试。"
+    except httpx.HTTPError as e:
+        logger.error(f"DeepSeek预测API请求失败: {e}")
+        return f"抱歉，API请求失败: {str(e)}"
+    except Exception as e:
+        logger.error(f"调用DeepSeek预测API时发生未知错误: {e}")
+        return f"抱歉，发生了未知错误: {str(e)}"
+
+
+def _parse_stream_line(line: str) -> Optional[str]:
+    """
+    解析流式聊天响应中的一行SSE数据，返回其中的增量文本。
+
+    最后一个数据块中的usage字段（请求时设置了include_usage）记入token用量。
+
+    Returns:
+        Optional[str]: 增量文本；非数据行、结束标记或没有内容的增量返回None
+    """
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    payload = line[len("data:"):].strip()
+    if not payload or payload == "[DONE]":
+        return None
+    try:
+        data = json.loads(payload)
+    except json.JSONDecodeError:
+        logger.warning(f"无法解析流式响应数据: {payload[:200]}")
+        return None
+    record_token_usage(data.get("usage"))
+    choices = data.get("choices") or []
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content") or None
+
+
+def stream_deepseek_api(prompt: str, system_message: str = None) -> Iterator[str]:
+    """
+    以流式方式调用DeepSeek聊天API，逐段产出生成的文本。
+
+    Args:
+        prompt (str): 用户提示
+        system_message (str, optional): 系统消息
+
+    Yields:
+        str: 增量文本；请求失败时产出一条错误消息后结束
+    """
+    try:
+        chat_request = _build_chat_request(prompt, system_message)
+        chat_request["stream"] = True
+        chat_request["stream_options"] = {"include_usage": True}
+
+        start = time.perf_counter()
+        first_token = True
+        with span("llm"), requests.post(
+            f"{DEEPSEEK_API_BASE}/chat/completions",
+            json=chat_request,
+            headers={"Content-Type": "application/json"},
+            timeout=DEEPSEEK_CHAT_TIMEOUT,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                delta = _parse_stream_line(line or "")
+                if delta:
+                    if first_token:
+                        first_token = False
+                        observe_stage("llm_first_token", time.perf_counter() - start)
+                    yield delta
+
+    except requests.exceptions.Timeout:
+        logger.error("DeepSeek预测API请求超时")
+        yield "抱歉，请求超时。请稍后再试。"
+    except requests.exceptions.RequestException as e:
+        logger.error(f"DeepSeek预测API请求失败: {e}")
+        yield f"抱歉，API请求失败: {str(e)}"
+    except Exception as e:
+        logger.error(f"调用DeepSeek预测API时发生未知错误: {e}")
+        yield f"抱歉，发生了未知错误: {str(e)}"
+
+
+async def astream_deepseek_api(
+    prompt: str, system_message: str = None
+) -> AsyncIterator[str]:
+    """stream_deepseek_api的异步版本，使用共享的异步HTTP客户端。"""
+    try:
+        chat_request = _build_chat_request(prompt, system_message)
+        chat_request["stream"] = True
+        chat_request["stream_options"] = {"include_usage": True}
+
+        start = time.perf_counter()
+        first_token = True
+        with span("llm"):
+            async with get_async_client().stream(
+                "POST",
+                f"{DEEPSEEK_API_BASE}/chat/completions",
+                json=chat_request,
+                timeout=DEEPSEEK_CHAT_TIMEOUT,
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    delta = _parse_stream_line(line)
+                    if delta:
+                        if first_token:
+                            first_token = False
+                            observe_stage("llm_first_token", time.perf_counter() - start)
+                        yield delta
+
+    except httpx.TimeoutException:
+        logger.error("DeepSeek预测API请求超时")
+        yield "抱歉，请求超时。请稍后再试。"
+    except httpx.HTTPError as e:
+        logger.error(f"DeepSeek预测API请求失败: {e}")
+        yield f"抱歉，API请求失败: {str(e)}"
+    except Exception as e:
+        logger.error(f"调用DeepSeek预测API时发生未知错误: {e}")
+        yield f"抱歉，发生了未知错误: {str(e)}"
+
+
 def save_qa_to_knowledge_base(question: str, answer: str):
     """
     将问答对保存到知识库文件中。
@@ -128,12 +343,12 @@ def check_relevance(retrieved_context: list) -> bool:
     if not retrieved_context:
         return False
 
-    # 检查最高相似度分数
-    max_score = max(item.get("score", 0) for item in retrieved_context)
+    # score是L2距离，越小越相似；检查距离最近的结果
+    min_score = min(item.get("score", float("inf")) for item in retrieved_context)
 
-    logger.info(f"最高相似度分数: {max_score}, 阈值: {RELEVANCE_THRESHOLD}")
+    logger.info(f"最小检索距离: {min_score}, 阈值: {RELEVANCE_THRESHOLD}")
 
-    return max_score >= RELEVANCE_THRESHOLD
+    return min_score <= RELEVANCE_THRESHOLD
 
 
 def build_prompt(query: str, context: List[Dict[str, Any]]) -> str:
@@ -183,90 +398,572 @@ def call_llm_api(prompt: str) -> str:
     return call_deepseek_api(prompt)
 
 
-def get_rag_response(query: str) -> Dict[str, Any]:
+def _build_answer_messages(
+    query: str, retrieved_context: List[Dict[str, Any]], is_relevant: bool
+) -> Tuple[str, str]:
     """
-    编排RAG流水线：搜索 -> 构建提示 -> 获取LLM响应。
+    根据相关度选择回答方式，返回 (prompt, system_message)。
+
+    相关度高时使用检索到的上下文；相关度低时让模型直接基于自身知识回答。
+    """
+    if is_relevant:
+        # 相关度高，使用检索到的上下文
+        context_str = "\n\n".join(
+            [
+                f"文档 {i + 1}:\n来源: {doc.get('metadata', {}).get('source', '未知')}\n内容: {doc.get('text', '')}"
+                for i, doc in enumerate(retrieved_context)
+            ]
+        )
+
+        system_message = (
+            "你是一个有用的AI助手。请根据提供的上下文信息回答用户的问题。"
+            "请保持回答的准确性和相关性。"
+        )
+
+        prompt = f"""基于以下上下文信息回答问题：
+
+上下文信息：
+{context_str}
+
+问题：{query}
+
+请根据上述上下文信息回答问题。"""
+
+    else:
+        # 相关度低，直接使用模型知识回答
+        system_message = (
+            "你是一个有用的AI助手。请直接基于你的知识回答用户的问题。"
+            "请提供准确、有用的信息。"
+        )
+
+        prompt = f"""问题：{query}
+
+请基于你的知识直接回答这个问题。"""
+
+    return prompt, system_message
+
+
+def _db_unavailable_response() -> Dict[str, Any]:
+    logger.error("无法连接到数据库")
+    return {
+        "llm_answer": "抱歉，系统暂时无法访问知识库。请稍后再试。",
+        "retrieved_context": [],
+    }
+
+
+def _error_response(e: Exception) -> Dict[str, Any]:
+    logger.error(f"RAG流水线执行失败: {e}")
+    return {
+        "llm_answer": f"抱歉，处理您的查询时遇到了问题: {str(e)}",
+        "retrieved_context": [],
+    }
+
+
+class _PreparedAnswer(NamedTuple):
+    """_prepare_answer的结果；cached不为None时表示命中回答缓存，其余字段为空。"""
+
+    retrieved_context: List[Dict[str, Any]]
+    is_relevant: bool
+    prompt: str
+    system_message: str
+    query_vector: Optional[np.ndarray] = None
+    cached: Optional[Dict[str, Any]] = None
+    cache_scope: str = ""
+
+
+def _cached_answer(response: Dict[str, Any]) -> _PreparedAnswer:
+    logger.info("回答缓存命中，跳过检索和LLM调用")
+    return _PreparedAnswer([], False, "", "", cached=response)
+
+
+def _cache_scope(filters: Optional[Dict[str, Any]]) -> str:
+    """不同的过滤条件检索到的上下文不同，回答缓存按过滤条件分区。"""
+    return json.dumps(filters, sort_keys=True, default=str) if filters else ""
+
+
+def _lookup_cache(query: str, scope: str) -> Optional[_PreparedAnswer]:
+    """按规范化后的查询文本精确查找回答缓存。"""
+    if answer_cache is None:
+        return None
+    cached = answer_cache.get(query, scope=scope)
+    return _cached_answer(cached) if cached is not None else None
+
+
+def _retrieve(
+    query: str,
+    query_vector: Optional[np.ndarray],
+    retrieved_context: List[Dict[str, Any]],
+    scope: str,
+) -> _PreparedAnswer:
+    logger.info(f"检索到 {len(retrieved_context)} 个相关文档片段")
+    with span("relevance"):
+        is_relevant = check_relevance(retrieved_context)
+    with span("prompt"):
+        prompt, system_message = _build_answer_messages(query, retrieved_context, is_relevant)
+    return _PreparedAnswer(
+        retrieved_context, is_relevant, prompt, system_message, query_vector, cache_scope=scope
+    )
+
+
+def _prepare_answer(
+    query: str,
+    nprobes: Optional[int],
+    refine_factor: Optional[int],
+    filters: Optional[Dict[str, Any]] = None,
+) -> Optional[_PreparedAnswer]:
+    """
+    查找回答缓存；未命中时检索上下文并构建提示。
+
+    查询只编码一次，同时用于缓存的近似匹配和向量检索。
+
+    Returns:
+        _PreparedAnswer；无法连接数据库时返回None
+    """
+    scope = _cache_scope(filters)
+    prepared = _lookup_cache(query, scope)
+    if prepared is not None:
+        return prepared
+
+    db_conn = get_db_connection()
+    if db_conn is None:
+        return None
+
+    query_vector = None
+    if answer_cache is not None:
+        query_vector = embedding_model.encode(query)
+        if query_vector is not None:
+            cached = answer_cache.get(query, query_vector, scope)
+            if cached is not None:
+                return _cached_answer(cached)
+
+    retrieved_context = search_vector_store(
+        query,
+        db_conn,
+        LANCEDB_TABLE_NAME,
+        top_k=TOP_K,
+        nprobes=nprobes,
+        refine_factor=refine_factor,
+        query_vector=query_vector,
+        filters=filters,
+    )
+    return _retrieve(query, query_vector, retrieved_context, scope)
+
+
+async def _aprepare_answer(
+    query: str,
+    nprobes: Optional[int],
+    refine_factor: Optional[int],
+    filters: Optional[Dict[str, Any]] = None,
+) -> Optional[_PreparedAnswer]:
+    """_prepare_answer的异步版本。"""
+    scope = _cache_scope(filters)
+    prepared = _lookup_cache(query, scope)
+    if prepared is not None:
+        return prepared
+
+    db_conn = get_db_connection()
+    if db_conn is None:
+        return None
+
+    query_vector = None
+    if answer_cache is not None:
+        query_vector = await embedding_model.aencode(query)
+        if query_vector is not None:
+            cached = answer_cache.get(query, query_vector, scope)
+            if cached is not None:
+                return _cached_answer(cached)
+
+    retrieved_context = await asearch_vector_store(
+        query,
+        db_conn,
+        LANCEDB_TABLE_NAME,
+        top_k=TOP_K,
+        nprobes=nprobes,
+        refine_factor=refine_factor,
+        query_vector=query_vector,
+        filters=filters,
+    )
+    return _retrieve(query, query_vector, retrieved_context, scope)
+
+
+def _after_answer(query: str, llm_answer: str, prepared: _PreparedAnswer):
+    """记录回答来源；相关度低时把问答对保存到知识库；成功的回答写入回答缓存。"""
+    if prepared.is_relevant:
+        logger.info("使用检索上下文生成回答")
+    else:
+        logger.info("检索上下文相关度低，使用模型直接回答")
+
+        # 将问答对保存到知识库
+        save_qa_to_knowledge_base(query, llm_answer)
+        logger.info("已将新的问答对保存到知识库，下次查询时可以检索到")
+
+    # 出错时的提示语不缓存，下次查询重新请求
+    if answer_cache is not None and llm_answer and not llm_answer.startswith("抱歉，"):
+        answer_cache.put(
+            query,
+            {"llm_answer": llm_answer, "retrieved_context": prepared.retrieved_context},
+            prepared.query_vector,
+            prepared.cache_scope,
+        )
+
+
+def _record_query(
+    query: str,
+    response: Dict[str, Any],
+    start_time: float,
+    filters: Optional[Dict[str, Any]] = None,
+    cached: bool = False,
+):
+    """记录查询的总耗时和计数指标，并把查询明细交给查询日志（不做IO）。"""
+    elapsed = time.perf_counter() - start_time
+    QUERIES.inc(cached=str(cached).lower())
+    observe_stage("total", elapsed)
+    if query_log is None:
+        return
+    extra: Dict[str, Any] = {"cached": cached}
+    if filters:
+        extra["filters"] = filters
+    query_log.log(build_query_record(query, response, elapsed, RELEVANCE_THRESHOLD, **extra))
+
+
+def get_rag_response(
+    query: str,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    编排RAG流水线：查缓存 -> 搜索 -> 构建提示 -> 获取LLM响应。
 
     Args:
         query (str): 用户查询
+        nprobes (int, optional): 覆盖本次检索的ANN nprobes参数
+        refine_factor (int, optional): 覆盖本次检索的ANN refine_factor参数
+        filters (Dict[str, Any], optional): 检索预过滤条件，见vector_store.build_where_clause
 
     Returns:
         Dict[str, Any]: 包含LLM回答和检索上下文的字典
     """
     logger.info(f"收到查询: {query}")
+    start_time = time.perf_counter()
+    cached = False
 
     try:
-        # 1. 连接数据库
-        db_conn = get_db_connection()
-        if db_conn is None:
-            logger.error("无法连接到数据库")
-            return {
-                "llm_answer": "抱歉，系统暂时无法访问知识库。请稍后再试。",
-                "retrieved_context": [],
+        # 1. 查找回答缓存，未命中时连接数据库并检索相关上下文
+        prepared = _prepare_answer(query, nprobes, refine_factor, filters)
+        if prepared is None:
+            response = _db_unavailable_response()
+        elif prepared.cached is not None:
+            cached = True
+            response = prepared.cached
+        else:
+            # 2. 生成回答
+            llm_answer = call_deepseek_api(prepared.prompt, prepared.system_message)
+            _after_answer(query, llm_answer, prepared)
+            response = {
+                "llm_answer": llm_answer,
+                "retrieved_context": prepared.retrieved_context,
             }
 
-        # 2. 检索相关上下文
-        retrieved_context = search_vector_store(
-            query, db_conn, LANCEDB_TABLE_NAME, top_k=TOP_K
-        )
+    except Exception as e:
+        response = _error_response(e)
 
-        logger.info(f"检索到 {len(retrieved_context)} 个相关文档片段")
+    _record_query(query, response, start_time, filters, cached)
+    return response
 
-        # 3. 检查相关度并生成回答
-        is_relevant = check_relevance(retrieved_context)
 
-        if is_relevant:
-            # 相关度高，使用检索到的上下文
-            context_str = "\n\n".join(
-                [
-                    f"文档 {i + 1}:\n来源: {doc.get('metadata', {}).get('source', '未知')}\n内容: {doc.get('text', '')}"
-                    for i, doc in enumerate(retrieved_context)
-                ]
-            )
+async def aget_rag_response(
+    query: str,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    get_rag_response的异步版本，供FastAPI使用。
 
-            system_message = (
-                "你是一个有用的AI助手。请根据提供的上下文信息回答用户的问题。"
-                "请保持回答的准确性和相关性。"
-            )
+    查询编码、LanceDB检索（在线程池中执行）和LLM调用都不会阻塞事件循环，
+    因此并发请求的吞吐量取决于LLM服务的容量，而不是单个worker。
+    参数和返回值同get_rag_response。
+    """
+    logger.info(f"收到查询: {query}")
+    start_time = time.perf_counter()
+    cached = False
 
-            prompt = f"""基于以下上下文信息回答问题：
+    try:
+        # 1. 查找回答缓存，未命中时连接数据库并检索相关上下文
+        prepared = await _aprepare_answer(query, nprobes, refine_factor, filters)
+        if prepared is None:
+            response = _db_unavailable_response()
+        elif prepared.cached is not None:
+            cached = True
+            response = prepared.cached
+        else:
+            # 2. 生成回答
+            llm_answer = await acall_deepseek_api(prepared.prompt, prepared.system_message)
+            await asyncio.to_thread(_after_answer, query, llm_answer, prepared)
+            response = {
+                "llm_answer": llm_answer,
+                "retrieved_context": prepared.retrieved_context,
+            }
 
-上下文信息：
-{context_str}
+    except Exception as e:
+        response = _error_response(e)
 
-问题：{query}
+    _record_query(query, response, start_time, filters, cached)
+    return response
 
-请根据上述上下文信息回答问题。"""
 
-            llm_answer = call_deepseek_api(prompt, system_message)
-            logger.info("使用检索上下文生成回答")
+def _cached_events(cached: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把缓存的回答转换成流式事件序列。"""
+    return [
+        {"event": "context", "data": {"retrieved_context": cached["retrieved_context"]}},
+        {"event": "token", "data": cached["llm_answer"]},
+        {"event": "done", "data": {"llm_answer": cached["llm_answer"]}},
+    ]
 
-        else:
-            # 相关度低，直接使用模型知识回答
-            system_message = (
-                "你是一个有用的AI助手。请直接基于你的知识回答用户的问题。"
-                "请提供准确、有用的信息。"
-            )
 
-            prompt = f"""问题：{query}
+def stream_rag_response(
+    query: str,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    get_rag_response的流式版本。
 
-请基于你的知识直接回答这个问题。"""
+    先产出检索到的上下文，再逐段产出LLM生成的文本，最后产出完整回答。
+    事件格式为 {"event": 事件名, "data": 数据}，事件名依次为：
+    "context"（data为{"retrieved_context": [...]}）、若干 "token"（data为增量文本）、
+    "done"（data为{"llm_answer": 完整回答}）；出错时产出 "error"。
+    命中回答缓存时，完整回答作为单个 "token" 事件产出。
 
-            llm_answer = call_deepseek_api(prompt, system_message)
-            logger.info("检索上下文相关度低，使用模型直接回答")
+    Args:
+        query (str): 用户查询
+        nprobes (int, optional): 覆盖本次检索的ANN nprobes参数
+        refine_factor (int, optional): 覆盖本次检索的ANN refine_factor参数
+        filters (Dict[str, Any], optional): 检索预过滤条件，见vector_store.build_where_clause
 
-            # 将问答对保存到知识库
-            save_qa_to_knowledge_base(query, llm_answer)
-            logger.info("已将新的问答对保存到知识库，下次查询时可以检索到")
+    Yields:
+        Dict[str, Any]: 流式事件
+    """
+    logger.info(f"收到流式查询: {query}")
+    start_time = time.perf_counter()
 
-        return {
-            "llm_answer": llm_answer,
-            "retrieved_context": retrieved_context,
-        }
+    try:
+        prepared = _prepare_answer(query, nprobes, refine_factor, filters)
+        if prepared is None:
+            yield {"event": "error", "data": _db_unavailable_response()["llm_answer"]}
+            return
+        if prepared.cached is not None:
+            _record_query(query, prepared.cached, start_time, filters, cached=True)
+            yield from _cached_events(prepared.cached)
+            return
+        yield {"event": "context", "data": {"retrieved_context": prepared.retrieved_context}}
+
+        parts = []
+        for delta in stream_deepseek_api(prepared.prompt, prepared.system_message):
+            parts.append(delta)
+            yield {"event": "token", "data": delta}
+
+        llm_answer = "".join(parts).strip()
+        _after_answer(query, llm_answer, prepared)
+        _record_query(
+            query,
+            {"llm_answer": llm_answer, "retrieved_context": prepared.retrieved_context},
+            start_time,
+            filters,
+        )
+        yield {"event": "done", "data": {"llm_answer": llm_answer}}
 
     except Exception as e:
-        logger.error(f"RAG流水线执行失败: {e}")
-        return {
-            "llm_answer": f"抱歉，处理您的查询时遇到了问题: {str(e)}",
-            "retrieved_context": [],
-        }
+        response = _error_response(e)
+        _record_query(query, response, start_time, filters)
+        yield {"event": "error", "data": response["llm_answer"]}
+
+
+async def astream_rag_response(
+    query: str,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """stream_rag_response的异步版本，供 /ask/stream 端点使用。"""
+    logger.info(f"收到流式查询: {query}")
+    start_time = time.perf_counter()
+
+    try:
+        prepared = await _aprepare_answer(query, nprobes, refine_factor, filters)
+        if prepared is None:
+            yield {"event": "error", "data": _db_unavailable_response()["llm_answer"]}
+            return
+        if prepared.cached is not None:
+            _record_query(query, prepared.cached, start_time, filters, cached=True)
+            for event in _cached_events(prepared.cached):
+                yield event
+            return
+        yield {"event": "context", "data": {"retrieved_context": prepared.retrieved_context}}
+
+        parts = []
+        async for delta in astream_deepseek_api(prepared.prompt, prepared.system_message):
+            parts.append(delta)
+            yield {"event": "token", "data": delta}
+
+        llm_answer = "".join(parts).strip()
+        await asyncio.to_thread(_after_answer, query, llm_answer, prepared)
+        _record_query(
+            query,
+            {"llm_answer": llm_answer, "retrieved_context": prepared.retrieved_context},
+            start_time,
+            filters,
+        )
+        yield {"event": "done", "data": {"llm_answer": llm_answer}}
+
+    except Exception as e:
+        response = _error_response(e)
+        _record_query(query, response, start_time, filters)
+        yield {"event": "error", "data": response["llm_answer"]}
+
+
+async def _aprepare_batch(
+    queries: List[str],
+    nprobes: Optional[int],
+    refine_factor: Optional[int],
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[Optional[_PreparedAnswer]]:
+    """
+    _aprepare_answer的批量版本：未命中精确缓存的查询一次批量编码，
+    未命中近似缓存的查询合并为一次多向量检索。
+
+    Returns:
+        List[Optional[_PreparedAnswer]]: 与queries一一对应；无法连接数据库时为None
+    """
+    scope = _cache_scope(filters)
+    prepared: List[Optional[_PreparedAnswer]] = [_lookup_cache(q, scope) for q in queries]
+    pending = [i for i, p in enumerate(prepared) if p is None]
+    if not pending:
+        return prepared
+
+    db_conn = get_db_connection()
+    if db_conn is None:
+        return prepared
+
+    query_vectors = await embedding_model.aencode([queries[i] for i in pending])
+    if query_vectors is not None and answer_cache is not None:
+        still_pending = []
+        for i, vector in zip(pending, query_vectors):
+            cached = answer_cache.get(queries[i], vector, scope)
+            if cached is not None:
+                prepared[i] = _cached_answer(cached)
+            else:
+                still_pending.append((i, vector))
+        if not still_pending:
+            return prepared
+        pending = [i for i, _ in still_pending]
+        query_vectors = np.vstack([vector for _, vector in still_pending])
+
+    contexts = await asearch_vector_store_many(
+        [queries[i] for i in pending],
+        db_conn,
+        LANCEDB_TABLE_NAME,
+        top_k=TOP_K,
+        nprobes=nprobes,
+        refine_factor=refine_factor,
+        query_vectors=query_vectors,
+        filters=filters,
+    )
+    vectors = query_vectors if query_vectors is not None else [None] * len(pending)
+    for i, context, vector in zip(pending, contexts, vectors):
+        prepared[i] = _retrieve(queries[i], vector, context, scope)
+    return prepared
+
+
+async def abatch_rag_responses(
+    queries: List[str],
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    concurrency: Optional[int] = None,
+) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    批量问答，供 /ask/batch 端点和 main.py ask --file 使用。
+
+    查询按BATCH_SEARCH_SIZE分组，每组一次批量编码、一次多向量检索；检索完成的
+    查询立即提交LLM生成，同时在途的生成请求不超过concurrency个。检索下一组与
+    生成上一组的回答重叠执行，因此吞吐量取决于LLM服务，而不是逐个查询的串行循环。
+
+    Args:
+        queries (List[str]): 查询列表
+        nprobes (int, optional): 覆盖本次检索的ANN nprobes参数
+        refine_factor (int, optional): 覆盖本次检索的ANN refine_factor参数
+        filters (Dict[str, Any], optional): 对所有查询生效的检索预过滤条件
+        concurrency (int, optional): LLM生成的最大并发数，默认使用BATCH_LLM_CONCURRENCY
+
+    Yields:
+        Tuple[int, Dict[str, Any]]: (查询在queries中的下标, 与get_rag_response相同格式的回答)，
+            按完成顺序产出
+    """
+    if not queries:
+        return
+    logger.info(f"收到批量查询: {len(queries)} 个")
+
+    start_time = time.perf_counter()
+    group_size = max(1, BATCH_SEARCH_SIZE)
+    semaphore = asyncio.Semaphore(max(1, concurrency or BATCH_LLM_CONCURRENCY))
+    completed: "asyncio.Queue[Tuple[int, Dict[str, Any]]]" = asyncio.Queue()
+    tasks = set()
+
+    async def answer(index: int, prepared: Optional[_PreparedAnswer], prepare_seconds: float):
+        # 单个查询的响应时间 = 所在分组的检索耗时 + 本查询自己的处理耗时，
+        # 不包括排队等待生成并发名额的时间，因此与查询在整批中的位置无关
+        query_start = time.perf_counter() - prepare_seconds
+        cached = False
+        try:
+            if prepared is None:
+                response = _db_unavailable_response()
+            elif prepared.cached is not None:
+                cached = True
+                response = prepared.cached
+            else:
+                async with semaphore:
+                    query_start = time.perf_counter() - prepare_seconds
+                    llm_answer = await acall_deepseek_api(
+                        prepared.prompt, prepared.system_message
+                    )
+                await asyncio.to_thread(_after_answer, queries[index], llm_answer, prepared)
+                response = {
+                    "llm_answer": llm_answer,
+                    "retrieved_context": prepared.retrieved_context,
+                }
+        except Exception as e:
+            response = _error_response(e)
+        _record_query(queries[index], response, query_start, filters, cached)
+        await completed.put((index, response))
+
+    async def produce():
+        for start in range(0, len(queries), group_size):
+            group = queries[start : start + group_size]
+            group_start = time.perf_counter()
+            try:
+                prepared = await _aprepare_batch(group, nprobes, refine_factor, filters)
+                prepare_seconds = time.perf_counter() - group_start
+            except Exception as e:
+                response = _error_response(e)
+                for offset in range(len(group)):
+                    await completed.put((start + offset, response))
+                continue
+            for offset, item in enumerate(prepared):
+                task = asyncio.ensure_future(answer(start + offset, item, prepare_seconds))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        for _ in range(len(queries)):
+            yield await completed.get()
+        logger.info(
+            f"批量查询完成: {len(queries)} 个，总耗时 {time.perf_counter() - start_time:.2f}s"
+        )
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
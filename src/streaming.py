@@ -0,0 +1,91 @@
+"""流式处理的通用工具。
+
+索引流水线的各阶段（加载、分割、编码、写入）都写成生成器，阶段之间用
+bounded() 连接：上游在独立线程中运行，产出的数据放进有界队列，队列满时
+上游阻塞。因此各阶段可以重叠执行，而内存占用只取决于队列长度和批大小，
+与语料总量无关。
+"""
+import queue
+import threading
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+_ITEM, _DONE, _ERROR = range(3)
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    把可迭代对象切分为长度为size的列表（最后一批可能更短）。
+
+    Args:
+        iterable (Iterable[T]): 输入。
+        size (int): 每批的元素数量。
+
+    Yields:
+        List[T]: 一批元素。
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def bounded(iterable: Iterable[T], maxsize: int, name: str = "stage") -> Iterator[T]:
+    """
+    在后台线程中迭代上游，通过容量为maxsize的队列把结果交给调用方。
+
+    上游抛出的异常会在调用方的迭代中重新抛出。调用方提前停止迭代（break、
+    异常或close()）时，上游线程在下一次放入队列时停止，并关闭上游生成器，
+    从而逐级释放整条流水线占用的资源。
+
+    Args:
+        iterable (Iterable[T]): 上游阶段。
+        maxsize (int): 队列容量。
+        name (str): 线程名，便于排查问题。
+
+    Yields:
+        T: 上游产出的元素，顺序不变。
+    """
+    channel: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(message) -> bool:
+        while not stop.is_set():
+            try:
+                channel.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((_ITEM, item)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_ERROR, e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = channel.get()
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:
+        stop.set()
+        thread.join()
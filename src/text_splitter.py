@@ -1,11 +1,6 @@
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List
 
-import nltk  # type: ignore
 from langchain.docstore.document import Document
-from langchain.text_splitter import (
-    NLTKTextSplitter,
-    RecursiveCharacterTextSplitter,
-)
 
 from src.config import get_logger
 
@@ -13,37 +8,46 @@ from src.config import get_logger
 logger = get_logger(__name__)
 
 
+_nltk_checked = False
+
+
 def ensure_nltk_data():
     """
     检查NLTK的'punkt'分词器是否可用，如果不可用则下载。
+
+    只在首次分割句子时检查一次；导入本模块不会加载nltk，也不会访问网络。
     """
+    global _nltk_checked
+    if _nltk_checked:
+        return
+    import nltk  # type: ignore
+
     try:
         nltk.data.find("tokenizers/punkt")
     except LookupError:
         logger.info("NLTK 'punkt' model not found. Downloading...")
         nltk.download("punkt")
         logger.info("NLTK 'punkt' download complete.")
+    _nltk_checked = True
 
 
-# 在模块加载时确保NLTK数据可用
-ensure_nltk_data()
-
-
-def split_documents(documents: List[Document]) -> List[Document]:
+def iter_split_documents(documents: Iterable[Document]) -> Iterator[Dict[str, Any]]:
     """
-    对文档列表执行两步分割。
+    split_documents的生成器版本：逐个文档分割，逐个产出段落块。
 
-    首先，使用RecursiveCharacterTextSplitter将文档分割成较大的块（段落）。
-    然后，使用NLTKTextSplitter将这些块分割成更小的块（句子）。
+    输入可以是任意可迭代对象，因此可以直接接在加载阶段之后，不需要先把
+    所有文档收集到列表中。
 
     Args:
-        documents (List[Document]): 要分割的文档列表。
+        documents (Iterable[Document]): 要分割的文档。
 
-    Returns:
-        List[Document]: 句子级别的文档块列表，包含丰富的元数据。
+    Yields:
+        Dict[str, Any]: {'para': 段落Document, 'sentences': [句子Document, ...]}
     """
-    logger.info(
-        f"Starting two-step text splitting on {len(documents)} documents."
+    # langchain.text_splitter会连带导入langsmith，耗时约半秒，只在真正分割时导入
+    from langchain.text_splitter import (
+        NLTKTextSplitter,
+        RecursiveCharacterTextSplitter,
     )
 
     # 第一步分割：分成段落/章节
@@ -56,9 +60,9 @@ def split_documents(documents: List[Document]) -> List[Document]:
 
     # 第二步分割：分成句子
     # 设置较小的chunk_size以确保NLTK按句子分割
+    ensure_nltk_data()
     sentence_splitter = NLTKTextSplitter(chunk_size=200)
 
-    final_chunks = []
     for doc in documents:
         paragraph_chunks = paragraph_splitter.split_documents([doc])
         for i, para_chunk in enumerate(paragraph_chunks):
@@ -70,13 +74,32 @@ def split_documents(documents: List[Document]) -> List[Document]:
                 sent_chunk.metadata["source"] = source
                 sent_chunk.metadata["paragraph_num"] = i
                 sent_chunk.metadata["sentence_num_in_para"] = j
-                chunk_item['sentences'].appen(sent_chunk)
-            final_chunks.append(chunk_item)
+                chunk_item['sentences'].append(sent_chunk)
+            yield chunk_item
+
+
+def split_documents(documents: List[Document]) -> List[Dict[str, Any]]:
+    """
+    对文档列表执行两步分割。
 
+    首先，使用RecursiveCharacterTextSplitter将文档分割成较大的块（段落）。
+    然后，使用NLTKTextSplitter将这些块分割成更小的块（句子）。
+
+    Args:
+        documents (List[Document]): 要分割的文档列表。
+
+    Returns:
+        List[Dict[str, Any]]: 段落级别的块列表，每项为
+            {'para': 段落Document, 'sentences': [句子Document, ...]}，
+            句子的元数据中包含来源、段落序号和段内句子序号。
+    """
     logger.info(
-        f"Splitting complete. Generated {len(final_chunks)} chunks."
+        f"Starting two-step text splitting on {len(documents)} documents."
     )
-    return final_chunks
-
 
+    final_chunks = list(iter_split_documents(documents))
 
+    logger.info(
+        f"Splitting complete. Generated {len(final_chunks)} chunks."
+    )
+    return final_chunks
@@ -1,59 +1,93 @@
+import asyncio
 import json
+import math
 import uuid
-from typing import Any, Dict, List, Optional, TYPE_CHECKING
-import sqlite3
-import lancedb  # type: ignore
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+import numpy as np
 import pyarrow as pa  # type: ignore
 from langchain.docstore.document import Document
 
-from src.config import LANCEDB_TABLE_NAME, LANCEDB_URI, get_logger
+from src.config import (
+    ANN_INDEX_MIN_ROWS,
+    ANN_INDEX_TYPE,
+    ANN_NUM_PARTITIONS,
+    ANN_NUM_SUB_VECTORS,
+    ANN_REBUILD_RATIO,
+    DATA_DIR,
+    HYBRID_CANDIDATE_FACTOR,
+    HYBRID_KEYWORD_WEIGHT,
+    HYBRID_RRF_K,
+    HYBRID_VECTOR_WEIGHT,
+    INDEX_QUEUE_SIZE,
+    INDEX_WRITE_BATCH_SIZE,
+    LANCEDB_TABLE_NAME,
+    LANCEDB_URI,
+    SEARCH_NPROBES,
+    SEARCH_MODE,
+    SEARCH_REFINE_FACTOR,
+    SMALL2BIG_ENABLED,
+    get_logger,
+)
+from src.chunk_store import attach_parent_paragraphs, paragraph_store
+from src.db_manager import db_manager, list_table_names, open_table
 from src.embedding_model import embedding_model
+from src.metrics import span
+from src.streaming import batched, bounded
 
 if TYPE_CHECKING:
     # 仅在类型检查时导入，避免运行时错误
-    from lancedb import Table
+    from lancedb import DBConnection, Table
 
 # 获取模块专用的logger
 logger = get_logger(__name__)
 
 
-def get_db_connection() -> Optional[lancedb.DBConnection]:
+def get_db_connection() -> Optional["DBConnection"]:
     """
-    建立与LanceDB数据库的连接。
+    返回进程共享的LanceDB连接。
+
+    连接由db_manager在首次调用时建立，之后的调用直接复用，
+    不会在每次查询时重新连接。
 
     Returns:
-        Optional[lancedb.DBConnection]: 数据库连接对象，如果连接失败则返回None
+        Optional["DBConnection"]: 数据库连接对象，如果连接失败则返回None
     """
-    vector_db, rel_db = None, None
-    try:
-        logger.info(f"正在连接到LanceDB: {LANCEDB_URI}")
-        vector_db = lancedb.connect(LANCEDB_URI)
+    return db_manager.connection
 
-        rel_db = sqlite3.connect('example.db')
 
-        cursor = rel_db.cursor()
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS detail_para_chunk (
-                chunk_id INTEGER PRIMARY KEY,
-                chunk_content TEXT
-            )
-        """)
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS rel_para_sentence (
-                id INTEGER PRIMARY KEY,
-                chunk_id INTEGER,
-                sentence_id VARCHAR(64)
-            )
-        """)
-        rel_db.commit()
-        cursor.close()
-    except Exception as e:
-        logger.error(f"连接LanceDB失败: {e}")
-        return vector_db, rel_db
+def table_schema(embedding_dim: int) -> pa.Schema:
+    """
+    返回向量表的结构。
+
+    metadata列保存完整的元数据JSON；常用于过滤的字段另外存成带类型的列，
+    并建立标量索引，检索时可以在LanceDB中预过滤，而不是取回后在Python中筛选。
+    """
+    return pa.schema(
+        [
+            pa.field("vector", pa.list_(pa.float32(), list_size=embedding_dim)),
+            pa.field("text", pa.string()),
+            pa.field("metadata", pa.string()),  # 将元数据存储为JSON字符串
+            pa.field("id", pa.string()), # 增加一个满足唯一性约束的ID字段
+            pa.field("source", pa.string()),  # 相对于数据目录的文件路径
+            pa.field("doc_type", pa.string()),  # 文件扩展名，如 "pdf"
+            pa.field("paragraph_num", pa.int32()),
+            pa.field("sentence_num_in_para", pa.int32()),
+            pa.field("ingested_at", pa.timestamp("us")),  # 写入时间（UTC）
+        ]
+    )
+
+
+def has_current_schema(db: "DBConnection", table_name: str) -> bool:
+    """检查已有的表是否包含当前结构的所有列（旧版本创建的表需要全量重建）。"""
+    table = db.open_table(table_name)
+    return set(table_schema(1).names) <= set(table.schema.names)
 
 
 def create_or_get_table(
-    db: lancedb.DBConnection, table_name: str, embedding_dim: int
+    db: "DBConnection", table_name: str, embedding_dim: int
 ) -> Optional["Table"]:
     """
     在LanceDB中创建表（如果不存在）或打开现有表。
@@ -67,139 +101,972 @@ def create_or_get_table(
         Optional[lancedb.Table]: 表对象，如果操作失败则返回None
     """
     try:
-        if table_name in db.table_names():
+        if table_name in list_table_names(db):
             logger.info(f"正在打开现有表: {table_name}")
             return db.open_table(table_name)
 
         logger.info(f"正在创建新表: {table_name}")
-        schema = pa.schema(
-            [
-                pa.field(
-                    "vector", pa.list_(pa.float32(), list_size=embedding_dim)
-                ),
-                pa.field("text", pa.string()),
-                pa.field("metadata", pa.string()),  # 将元数据存储为JSON字符串
-                pa.field("id", pa.string()), # 增加一个满足唯一性约束的ID字段
-            ]
-        )
+        schema = table_schema(embedding_dim)
         return db.create_table(table_name, schema=schema)
     except Exception as e:
         logger.error(f"创建或获取表 '{table_name}' 失败: {e}")
         return None
 
 
+def encode_documents(
+    documents: List[Document], ids: List[str]
+) -> Optional[Tuple[List[Document], List[str], np.ndarray]]:
+    """
+    并发编码文档内容，丢弃编码失败的文档。
+
+    Args:
+        documents: 要编码的文档列表
+        ids: 与documents一一对应的行id
+
+    Returns:
+        Optional[Tuple[List[Document], List[str], np.ndarray]]:
+            编码成功的 (文档, id, 嵌入矩阵)；全部失败时返回None
+    """
+    texts = [doc.page_content for doc in documents]
+    result = embedding_model.encode_concurrent(texts)
+
+    if result.embeddings is None:
+        logger.error("生成嵌入失败。无法添加文档。")
+        return None
+
+    embeddings = result.embeddings
+    if result.failed_indices:
+        # 部分批次失败时只写入编码成功的文档，失败的文档记录日志后跳过
+        failed = set(result.failed_indices)
+        for index in result.failed_indices:
+            logger.error(
+                f"文档编码失败，已跳过: "
+                f"{documents[index].metadata.get('source', 'N/A')}"
+            )
+        kept = [i for i in range(len(documents)) if i not in failed]
+        documents = [documents[i] for i in kept]
+        ids = [ids[i] for i in kept]
+        embeddings = embeddings[kept]
+
+    return documents, ids, embeddings
+
+
+def encode_document_batches(
+    batches: Iterable[Tuple[List[Document], List[str]]],
+) -> Iterator[Tuple[List[Document], List[str], np.ndarray]]:
+    """
+    流水线的编码阶段：逐批编码 (文档, id)，产出编码成功的 (文档, id, 嵌入矩阵)。
+
+    Args:
+        batches: 上游产出的 (文档列表, id列表) 批次
+
+    Yields:
+        Tuple[List[Document], List[str], np.ndarray]: 编码后的批次
+
+    Raises:
+        RuntimeError: 某一批全部编码失败
+    """
+    for documents, ids in batches:
+        encoded = encode_documents(documents, ids)
+        if encoded is None:
+            raise RuntimeError("生成嵌入失败")
+        yield encoded
+
+
+def _vector_array(embeddings: np.ndarray, vector_type: pa.DataType) -> pa.Array:
+    """
+    把嵌入矩阵转换为FixedSizeListArray。
+
+    矩阵已是C连续的float32时，Arrow直接引用NumPy缓冲区，不复制数据。
+    """
+    values = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1)
+    return pa.FixedSizeListArray.from_arrays(
+        pa.array(values, type=pa.float32()), type=vector_type
+    )
+
+
+def _relative_source(source: Optional[str]) -> Optional[str]:
+    """把元数据中的文件路径转换为相对于数据目录的POSIX路径。"""
+    if not source:
+        return None
+    path = Path(source)
+    try:
+        return path.resolve().relative_to(DATA_DIR.resolve()).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def _to_record_batch(
+    schema: pa.Schema, documents: List[Document], embeddings: np.ndarray, ids: List[str]
+) -> pa.RecordBatch:
+    """按表结构把一批已编码的文档转换成Arrow RecordBatch，按列构建，不逐行生成字典。"""
+    sources = [_relative_source(doc.metadata.get("source")) for doc in documents]
+    ingested_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    columns = {
+        "vector": _vector_array(embeddings, schema.field("vector").type),
+        "text": pa.array([doc.page_content for doc in documents], type=pa.string()),
+        "metadata": pa.array(
+            [json.dumps(doc.metadata) for doc in documents], type=pa.string()
+        ),
+        "id": pa.array(ids, type=pa.string()),
+        "source": pa.array(sources, type=pa.string()),
+        "doc_type": pa.array(
+            [Path(source).suffix.lstrip(".").lower() if source else None for source in sources],
+            type=pa.string(),
+        ),
+        "paragraph_num": pa.array(
+            [doc.metadata.get("paragraph_num") for doc in documents], type=pa.int32()
+        ),
+        "sentence_num_in_para": pa.array(
+            [doc.metadata.get("sentence_num_in_para") for doc in documents], type=pa.int32()
+        ),
+        "ingested_at": pa.array([ingested_at] * len(documents), type=pa.timestamp("us")),
+    }
+    return pa.RecordBatch.from_arrays(
+        [columns[name] for name in schema.names], schema=schema
+    )
+
+
+def write_document_batches(
+    db: "DBConnection",
+    table_name: str,
+    batches: Iterable[Tuple[List[Document], List[str], np.ndarray]],
+) -> Iterator[int]:
+    """
+    流水线的写入阶段：把每个已编码批次作为一个Arrow RecordBatch写入表。
+
+    表在第一批到达时按嵌入维度创建或打开，之后复用同一个句柄。
+
+    Args:
+        db: LanceDB数据库连接
+        table_name: 目标表名
+        batches: 上游产出的 (文档列表, id列表, 嵌入矩阵) 批次
+
+    Yields:
+        int: 每批写入的行数
+
+    Raises:
+        RuntimeError: 创建或获取表失败
+    """
+    table = None
+    for documents, ids, embeddings in batches:
+        if not documents:
+            yield 0
+            continue
+        if table is None:
+            table = create_or_get_table(db, table_name, embeddings.shape[1])
+            if table is None:
+                raise RuntimeError("创建或获取表失败。无法添加文档。")
+
+        logger.info(f"正在向表 '{table_name}' 添加 {len(documents)} 个文档。")
+        table.add(_to_record_batch(table.schema, documents, embeddings, ids))
+        yield len(documents)
+
+
+def write_documents(
+    db: "DBConnection",
+    table_name: str,
+    documents: List[Document],
+    embeddings: np.ndarray,
+    ids: List[str],
+) -> bool:
+    """
+    把已编码的文档写入表，表不存在时按嵌入维度创建。
+
+    Args:
+        db: LanceDB数据库连接
+        table_name: 目标表名
+        documents: 文档列表
+        embeddings: 与documents一一对应的嵌入矩阵
+        ids: 与documents一一对应的行id
+
+    Returns:
+        bool: 操作是否成功
+    """
+    try:
+        for _ in write_document_batches(db, table_name, [(documents, ids, embeddings)]):
+            pass
+        logger.info("文档添加成功。")
+        return True
+
+    except Exception as e:
+        logger.error(f"向存储添加文档失败: {e}")
+        return False
+
+
 def add_documents_to_store(
-    documents: List[Document], db: lancedb.DBConnection, table_name: str
+    documents: Iterable[Document],
+    db: "DBConnection",
+    table_name: str,
+    ids: Optional[Iterable[str]] = None,
+    batch_size: int = INDEX_WRITE_BATCH_SIZE,
 ) -> bool:
     """
-    将文档列表编码并添加到指定的LanceDB表中。
+    将文档编码并添加到指定的LanceDB表中。
     备注：这里应该使用一个关系数据库（MYSQL，SQLite），关联段落和句子
 
+    文档按batch_size分批流式处理：编码在后台线程中进行，与写入重叠，
+    内存中最多保留几批数据，因此documents可以是任意大小的生成器。
+
     Args:
-        documents: 要添加的文档列表
+        documents: 要添加的文档（列表或生成器）
         db: LanceDB数据库连接
         table_name: 目标表名
+        ids: 与documents一一对应的行id；为None时为每行生成随机UUID
+        batch_size: 每批编码和写入的文档数量
 
     Returns:
-        bool: 操作是否成功
+        bool: 操作是否成功；已写入的批次不会回滚
     """
-    if not documents:
+    if ids is None:
+        pairs = ((doc, str(uuid.uuid4())) for doc in documents)
+    else:
+        pairs = zip(documents, ids)
+    batches = (
+        ([doc for doc, _ in batch], [row_id for _, row_id in batch])
+        for batch in batched(pairs, batch_size)
+    )
+
+    total = 0
+    try:
+        encoded = bounded(encode_document_batches(batches), INDEX_QUEUE_SIZE, name="encode")
+        for rows in write_document_batches(db, table_name, encoded):
+            total += rows
+    except Exception as e:
+        logger.error(f"向存储添加文档失败: {e}")
+        return False
+
+    if total == 0:
         logger.warning("没有提供要添加到存储的文档。")
         return False
+    logger.info(f"文档添加成功，共 {total} 个。")
+    return True
+
+
+def delete_rows_by_id_prefix(
+    db: "DBConnection", table_name: str, prefixes: List[str]
+) -> bool:
+    """
+    删除id以给定前缀开头的所有行，用于增量索引时移除已修改或已删除文件的旧数据。
+
+    Args:
+        db: LanceDB数据库连接
+        table_name: 表名
+        prefixes: id前缀列表（由src.index_manifest.row_id_prefix生成）
+
+    Returns:
+        bool: 操作是否成功；表不存在时视为成功
+    """
+    if not prefixes or table_name not in list_table_names(db):
+        return True
 
     try:
-        texts = [doc.page_content for doc in documents]
-        embeddings = embedding_model.encode(texts)
+        table = db.open_table(table_name)
+        # 前缀只包含十六进制字符和'#'，无需转义
+        predicate = " OR ".join(f"id LIKE '{prefix}%'" for prefix in prefixes)
+        table.delete(predicate)
+        logger.info(f"已从表 '{table_name}' 删除 {len(prefixes)} 个文件的旧数据。")
+        return True
+    except Exception as e:
+        logger.error(f"删除旧数据失败: {e}")
+        return False
 
-        if embeddings is None:
-            logger.error("生成嵌入失败。无法添加文档。")
-            return False
 
-        embedding_dim = embeddings.shape[1]
-        table = create_or_get_table(db, table_name, embedding_dim)
+def _default_num_sub_vectors(embedding_dim: int) -> int:
+    """为PQ选择子向量个数：优先让每个子向量为8维，且必须整除向量维度。"""
+    for sub_dim in (8, 16, 4, 2, 1):
+        if embedding_dim % sub_dim == 0:
+            return embedding_dim // sub_dim
+    return 1
 
-        if table is None:
-            logger.error("创建或获取表失败。无法添加文档。")
+
+def _get_vector_index(table: "Table") -> Optional[Any]:
+    """返回表上vector列的索引配置，不存在时返回None。"""
+    for index in table.list_indices():
+        if "vector" in index.columns:
+            return index
+    return None
+
+
+def ensure_vector_index(db: "DBConnection", table_name: str) -> bool:
+    """
+    在表足够大时构建或维护ANN向量索引。
+
+    - 行数低于ANN_INDEX_MIN_ROWS：保持暴力扫描，不建索引；
+    - 尚无索引：按ANN_INDEX_TYPE训练新索引；
+    - 已有索引且未索引行占比超过ANN_REBUILD_RATIO：重新训练索引；
+    - 否则：通过optimize把新增行增量合并进现有索引。
+
+    Args:
+        db: LanceDB数据库连接
+        table_name: 表名
+
+    Returns:
+        bool: 操作后表上是否存在可用的向量索引
+    """
+    if table_name not in list_table_names(db):
+        return False
+
+    try:
+        table = db.open_table(table_name)
+        num_rows = table.count_rows()
+        if num_rows < ANN_INDEX_MIN_ROWS:
+            logger.info(
+                f"表 '{table_name}' 共 {num_rows} 行，低于阈值 {ANN_INDEX_MIN_ROWS}，"
+                f"使用暴力搜索。"
+            )
             return False
 
-        data = [
-            {
-                "vector": vector.tolist(),
-                "text": doc.page_content,
-                "metadata": json.dumps(doc.metadata),
-            }
-            for doc, vector in zip(documents, embeddings)
-        ]
+        index = _get_vector_index(table)
+        if index is not None:
+            stats = table.index_stats(index.name)
+            unindexed = stats.num_unindexed_rows if stats else 0
+            if unindexed <= num_rows * ANN_REBUILD_RATIO:
+                if unindexed:
+                    logger.info(f"正在把 {unindexed} 个新增行合并进向量索引。")
+                    table.optimize()
+                return True
+            logger.info(f"未索引行 {unindexed}/{num_rows} 超过阈值，重新训练向量索引。")
 
-        logger.info(f"正在向表 '{table_name}' 添加 {len(data)} 个文档。")
-        table.add(data)
-        logger.info("文档添加成功。")
+        embedding_dim = table.schema.field("vector").type.list_size
+        num_partitions = ANN_NUM_PARTITIONS or max(1, int(math.sqrt(num_rows)))
+        num_sub_vectors = ANN_NUM_SUB_VECTORS or _default_num_sub_vectors(embedding_dim)
+        logger.info(
+            f"正在为表 '{table_name}' 构建 {ANN_INDEX_TYPE} 索引: "
+            f"{num_rows} 行, num_partitions={num_partitions}, "
+            f"num_sub_vectors={num_sub_vectors}"
+        )
+        table.create_index(
+            metric="l2",
+            num_partitions=num_partitions,
+            num_sub_vectors=num_sub_vectors,
+            vector_column_name="vector",
+            index_type=ANN_INDEX_TYPE,
+            replace=True,
+        )
         return True
 
     except Exception as e:
-        logger.error(f"向存储添加文档失败: {e}")
+        logger.error(f"构建向量索引失败: {e}")
         return False
 
 
-def search_vector_store(
-    query: str, db: lancedb.DBConnection, table_name: str, top_k: int = 5
-) -> List[Dict[str, Any]]:
+# 结构化元数据列上的标量索引类型；低基数的列使用位图索引
+SCALAR_INDEX_TYPES = {
+    "source": "BTREE",
+    "doc_type": "BITMAP",
+    "paragraph_num": "BTREE",
+    "sentence_num_in_para": "BTREE",
+    "ingested_at": "BTREE",
+}
+
+
+def ensure_scalar_indices(db: "DBConnection", table_name: str) -> bool:
     """
-    在向量存储中搜索与查询最相似的文档。
+    为结构化元数据列建立标量索引；已有索引时把新增行合并进去。
+
+    Args:
+        db: LanceDB数据库连接
+        table_name: 表名
+
+    Returns:
+        bool: 操作是否成功
+    """
+    if table_name not in list_table_names(db):
+        return False
+
+    try:
+        from lancedb.index import Bitmap, BTree
+
+        index_configs = {"BTREE": BTree, "BITMAP": Bitmap}
+        table = db.open_table(table_name)
+        indexed = {
+            column: index.name for index in table.list_indices() for column in index.columns
+        }
+        needs_optimize = False
+        for column, index_type in SCALAR_INDEX_TYPES.items():
+            if column not in table.schema.names:
+                continue
+            if column in indexed:
+                stats = table.index_stats(indexed[column])
+                needs_optimize = needs_optimize or bool(stats and stats.num_unindexed_rows)
+                continue
+            logger.info(f"正在为表 '{table_name}' 的 {column} 列构建 {index_type} 索引")
+            table.create_index(column, config=index_configs[index_type]())
+        if needs_optimize:
+            table.optimize()
+        return True
+
+    except Exception as e:
+        logger.error(f"构建标量索引失败: {e}")
+        return False
+
+
+def _get_fts_index(table: "Table") -> Optional[Any]:
+    """返回表上text列的全文索引配置，不存在时返回None。"""
+    for index in table.list_indices():
+        if index.index_type == "FTS" and "text" in index.columns:
+            return index
+    return None
+
+
+def ensure_fts_index(db: "DBConnection", table_name: str) -> bool:
+    """
+    为text列建立全文（BM25）索引；已有索引时把新增行合并进去。
+
+    使用字符二元组（bigram）分词：中文没有空格分隔，按二元组切分既能匹配
+    任意中文词语，也能匹配 "XK-2041" 这样的产品编号，不依赖额外的分词词典。
 
     Args:
-        query: 查询字符串
         db: LanceDB数据库连接
         table_name: 表名
-        top_k: 返回的最相似结果数量
 
     Returns:
-        List[Dict[str, Any]]: 搜索结果列表，每个结果包含text、metadata和score
+        bool: 操作后表上是否存在可用的全文索引
     """
+    if table_name not in list_table_names(db):
+        return False
+
     try:
-        # 尝试打开表
+        from lancedb.index import FTS
+
         table = db.open_table(table_name)
+        index = _get_fts_index(table)
+        if index is not None:
+            stats = table.index_stats(index.name)
+            if stats and stats.num_unindexed_rows:
+                logger.info(f"正在把 {stats.num_unindexed_rows} 个新增行合并进全文索引。")
+                table.optimize()
+            return True
+
+        logger.info(f"正在为表 '{table_name}' 构建全文索引")
+        table.create_index(
+            "text",
+            config=FTS(
+                base_tokenizer="ngram",
+                ngram_min_length=2,
+                ngram_max_length=2,
+                lower_case=True,
+                ascii_folding=True,
+                stem=False,
+                remove_stop_words=False,
+            ),
+            replace=True,
+        )
+        return True
+
+    except Exception as e:
+        logger.error(f"构建全文索引失败: {e}")
+        return False
+
+
+def _sql_literal(value: Any) -> str:
+    """把过滤值转换为SQL字面量。"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _in_clause(column: str, value: Any) -> str:
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    if len(values) == 1:
+        return f"{column} = {_sql_literal(next(iter(values)))}"
+    return f"{column} IN ({', '.join(_sql_literal(v) for v in values)})"
+
+
+def _as_datetime(value: Any) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def build_where_clause(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    把结构化过滤条件转换为LanceDB的where谓词，各条件之间为AND关系。
+
+    支持的键：
+        source / doc_type / paragraph_num / sentence_num_in_para:
+            单个值表示相等，列表表示取其中任意一个值；
+        source_prefix: 相对路径前缀，如 "tenant_a/" 表示该子目录下的所有文档；
+        ingested_after / ingested_before: 写入时间范围（datetime或ISO格式字符串）。
+
+    Args:
+        filters: 过滤条件，None或空字典表示不过滤
+
+    Returns:
+        Optional[str]: where谓词，无条件时返回None
+
+    Raises:
+        ValueError: 包含不支持的键
+    """
+    if not filters:
+        return None
+
+    clauses = []
+    for key, value in filters.items():
+        if value is None:
+            continue
+        if key in ("source", "doc_type", "paragraph_num", "sentence_num_in_para"):
+            clauses.append(_in_clause(key, value))
+        elif key == "source_prefix":
+            clauses.append(f"source LIKE {_sql_literal(str(value) + '%')}")
+        elif key == "ingested_after":
+            clauses.append(f"ingested_at >= {_sql_literal(_as_datetime(value))}")
+        elif key == "ingested_before":
+            clauses.append(f"ingested_at < {_sql_literal(_as_datetime(value))}")
+        else:
+            raise ValueError(f"不支持的过滤条件: {key}")
+    return " AND ".join(f"({clause})" for clause in clauses) or None
+
+
+def _open_search_table(db: "DBConnection", table_name: str) -> Optional["Table"]:
+    """打开用于检索的表（共享连接上复用缓存句柄），失败时记录错误并返回None。"""
+    try:
+        table = open_table(db, table_name)
+        if table is None:
+            raise FileNotFoundError(table_name)
+        return table
     except FileNotFoundError:
         logger.error(f"表 '{table_name}' 未找到。请先创建它。")
-        return []
+        return None
     except Exception as e:
         logger.error(f"打开表 '{table_name}' 失败: {e}")
+        return None
+
+
+# 检索结果需要的列；_distance由LanceDB自动附加，id用于查找Small2Big父段落
+RESULT_COLUMNS = ["id", "text", "metadata"]
+
+
+def _results_from_arrow(results: pa.Table) -> List[Dict[str, Any]]:
+    """把检索返回的Arrow表转换为结果列表，元数据无法解析的行被跳过。"""
+    search_results = []
+    for row_id, text, metadata_str, distance in zip(
+        results.column("id").to_pylist(),
+        results.column("text").to_pylist(),
+        results.column("metadata").to_pylist(),
+        results.column("_distance").to_pylist(),
+    ):
+        try:
+            metadata = json.loads(metadata_str)
+        except (json.JSONDecodeError, TypeError) as e:
+            logger.warning(f"解析结果行失败: {e}")
+            continue
+        search_results.append(
+            {"id": row_id, "text": text, "metadata": metadata, "score": float(distance)}
+        )
+    return search_results
+
+
+def _vector_query(
+    table: "Table",
+    query: Any,
+    top_k: int,
+    nprobes: Optional[int],
+    refine_factor: Optional[int],
+    where: Optional[str],
+):
+    """构建向量检索查询；query可以是单个向量或向量列表。"""
+    nprobes = SEARCH_NPROBES if nprobes is None else nprobes
+    refine_factor = SEARCH_REFINE_FACTOR if refine_factor is None else refine_factor
+    search = table.search(query).limit(top_k).nprobes(nprobes)
+    if refine_factor:
+        search = search.refine_factor(refine_factor)
+    if where:
+        search = search.where(where, prefilter=True)
+    return search
+
+
+def search_by_vector(
+    table: "Table",
+    query_vector: Any,
+    top_k: int = 5,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    where: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    用已编码的查询向量在表中检索。
+
+    Args:
+        table: LanceDB表句柄
+        query_vector: 查询向量
+        top_k: 返回的最相似结果数量
+        nprobes: ANN索引搜索的分区数，None时使用SEARCH_NPROBES；表上没有索引时不起作用
+        refine_factor: 精排倍数，取 top_k * refine_factor 个候选用原始向量重算距离；
+                       None时使用SEARCH_REFINE_FACTOR，0表示不精排
+        where: 预过滤谓词（见build_where_clause），在向量检索之前应用
+
+    Returns:
+        List[Dict[str, Any]]: 搜索结果列表，每个结果包含id、text（命中的句子）、metadata和score
+    """
+    try:
+        search = _vector_query(table, query_vector, top_k, nprobes, refine_factor, where)
+        # 只取回需要的列，直接在Arrow列上构建结果，不经过pandas
+        results = search.select(RESULT_COLUMNS).to_arrow()
+        search_results = _results_from_arrow(results)
+
+        logger.info(f"找到 {len(search_results)} 个结果。")
+        return search_results
+
+    except Exception as e:
+        logger.error(f"搜索操作失败: {e}")
+        return []
+
+
+def search_by_vectors(
+    table: "Table",
+    query_vectors: np.ndarray,
+    top_k: int = 5,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    where: Optional[str] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    多向量检索：用一次LanceDB查询为多个查询向量分别检索top_k个结果。
+
+    参数同search_by_vector，query_vectors为 (查询数, 维度) 的矩阵。
+
+    Returns:
+        List[List[Dict[str, Any]]]: 与query_vectors一一对应的结果列表；检索失败时均为空列表
+    """
+    num_queries = len(query_vectors)
+    if num_queries == 0:
+        return []
+    if num_queries == 1:
+        # LanceDB只在多个查询向量时才返回query_index列
+        return [search_by_vector(table, query_vectors[0], top_k, nprobes, refine_factor, where)]
+    try:
+        search = _vector_query(table, list(query_vectors), top_k, nprobes, refine_factor, where)
+        results = search.select(RESULT_COLUMNS).to_arrow()
+    except Exception as e:
+        logger.error(f"批量搜索操作失败: {e}")
+        return [[] for _ in range(num_queries)]
+
+    # 按query_index分组：稳定排序保持每个查询内部的距离顺序
+    query_index = results.column("query_index").to_numpy()
+    results = results.take(pa.array(np.argsort(query_index, kind="stable")))
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(query_index, minlength=num_queries))])
+    grouped = [
+        _results_from_arrow(results.slice(int(offsets[i]), int(offsets[i + 1] - offsets[i])))
+        for i in range(num_queries)
+    ]
+    logger.info(f"批量检索 {num_queries} 个查询，共找到 {results.num_rows} 个结果。")
+    return grouped
+
+
+def search_by_keywords(
+    table: "Table", query: str, top_k: int = 5, where: Optional[str] = None
+) -> Optional[pa.Table]:
+    """
+    在text列的全文索引上做BM25检索。
+
+    Args:
+        table: LanceDB表句柄
+        query: 查询字符串
+        top_k: 返回的结果数量
+        where: 预过滤谓词（见build_where_clause）
+
+    Returns:
+        Optional[pa.Table]: 按BM25得分降序的命中行（RESULT_COLUMNS、vector和_score列）；
+            表上没有全文索引或检索失败时返回None
+    """
+    try:
+        search = table.search(query, query_type="fts").limit(top_k)
+        if where:
+            search = search.where(where, prefilter=True)
+        return search.select(RESULT_COLUMNS + ["vector", "_score"]).to_arrow()
+    except Exception as e:
+        logger.warning(f"全文检索失败，只使用向量检索结果: {e}")
+        return None
+
+
+def _keyword_results(hits: pa.Table, query_vector: Any) -> List[Dict[str, Any]]:
+    """
+    把全文检索命中转换为结果列表。score与向量检索一致，是到查询向量的L2距离
+    （平方），因此融合后的结果仍可以用同一个相关度阈值判断。
+    """
+    if hits.num_rows == 0:
+        return []
+    vectors = hits.column("vector").combine_chunks()
+    matrix = vectors.flatten().to_numpy().reshape(len(vectors), -1)
+    query = np.asarray(query_vector, dtype=matrix.dtype)
+    distances = ((matrix - query) ** 2).sum(axis=1)
+    return _results_from_arrow(
+        hits.select(RESULT_COLUMNS).append_column(
+            "_distance", pa.array(distances, type=pa.float32())
+        )
+    )
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Dict[str, List[Dict[str, Any]]],
+    weights: Dict[str, float],
+    top_k: int,
+    k: int = HYBRID_RRF_K,
+) -> List[Dict[str, Any]]:
+    """
+    加权倒数排名融合：结果在每个列表中的得分为 weight / (k + 名次)，按得分之和排序。
+
+    Args:
+        ranked_lists: {列表名: 按相关度排序的结果}，结果按id识别
+        weights: {列表名: 权重}，缺省为1
+        top_k: 返回的结果数量
+        k: 平滑常数，越大越弱化头部名次的优势
+
+    Returns:
+        List[Dict[str, Any]]: 融合后的结果，每个结果增加rrf_score和 "<列表名>_rank"
+            （从1开始，未出现在该列表中时为None）
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for name, results in ranked_lists.items():
+        weight = weights.get(name, 1.0)
+        for rank, result in enumerate(results, start=1):
+            item = fused.get(result["id"])
+            if item is None:
+                item = dict(result, rrf_score=0.0)
+                for list_name in ranked_lists:
+                    item[f"{list_name}_rank"] = None
+                fused[result["id"]] = item
+            item[f"{name}_rank"] = rank
+            item["rrf_score"] += weight / (k + rank)
+    return sorted(fused.values(), key=lambda item: item["rrf_score"], reverse=True)[:top_k]
+
+
+def _finish_results(
+    table: "Table",
+    vector_results: List[Dict[str, Any]],
+    keyword_hits: Optional[pa.Table],
+    query_vector: Any,
+    top_k: int,
+) -> List[Dict[str, Any]]:
+    """融合两路检索结果（混合模式），启用Small2Big时批量附加父段落并按段落去重。"""
+    results = vector_results
+    if keyword_hits is not None:
+        keyword_results = _keyword_results(keyword_hits, query_vector)
+        results = reciprocal_rank_fusion(
+            {"vector": vector_results, "keyword": keyword_results},
+            {"vector": HYBRID_VECTOR_WEIGHT, "keyword": HYBRID_KEYWORD_WEIGHT},
+            top_k,
+        )
+        logger.info(
+            f"混合检索: 向量 {len(vector_results)} 个、全文 {len(keyword_results)} 个候选，"
+            f"融合为 {len(results)} 个结果"
+        )
+    else:
+        results = results[:top_k]
+    if SMALL2BIG_ENABLED and results:
+        results = attach_parent_paragraphs(paragraph_store, table.name, results)
+    return results
+
+
+def _resolve_search_mode(search_mode: Optional[str]) -> str:
+    search_mode = (search_mode or SEARCH_MODE).lower()
+    if search_mode not in ("vector", "hybrid"):
+        raise ValueError(f"不支持的检索模式: {search_mode}")
+    return search_mode
+
+
+# 全文检索在独立线程中与查询编码、向量检索并行执行
+_keyword_executor = ThreadPoolExecutor(thread_name_prefix="keyword-search")
+
+
+def search_vector_store(
+    query: str,
+    db: "DBConnection",
+    table_name: str,
+    top_k: int = 5,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    query_vector: Optional[np.ndarray] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    search_mode: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    在向量存储中搜索与查询最相似的文档。
+
+    混合模式下全文检索与查询编码、向量检索并行执行，两路结果用RRF融合，
+    总延迟约等于较慢的一路。
+
+    Args:
+        query: 查询字符串
+        db: LanceDB数据库连接
+        table_name: 表名
+        top_k: 返回的最相似结果数量
+        nprobes: 见search_by_vector
+        refine_factor: 见search_by_vector
+        query_vector: 已编码的查询向量；提供时跳过查询编码
+        filters: 结构化过滤条件（见build_where_clause），只在匹配的行中检索
+        search_mode: "vector" 或 "hybrid"，None时使用SEARCH_MODE
+
+    Returns:
+        List[Dict[str, Any]]: 搜索结果列表，每个结果包含id、text、metadata和score
+            （到查询向量的L2距离）；混合模式下按融合得分排序，另含rrf_score、
+            vector_rank和keyword_rank字段（见reciprocal_rank_fusion）；
+            启用Small2Big时text为父段落，另含sentence、paragraph字段
+            （见chunk_store.attach_parent_paragraphs）
+
+    Raises:
+        ValueError: filters包含不支持的键，或search_mode不受支持
+    """
+    where = build_where_clause(filters)
+    hybrid = _resolve_search_mode(search_mode) == "hybrid"
+    table = _open_search_table(db, table_name)
+    if table is None:
         return []
 
+    # 全文检索不依赖查询向量，先提交，与编码和向量检索重叠执行
+    candidates = top_k * max(1, HYBRID_CANDIDATE_FACTOR) if hybrid else top_k
+    keyword_future: Optional[Future] = None
+    if hybrid:
+        keyword_future = _keyword_executor.submit(
+            search_by_keywords, table, query, candidates, where
+        )
+
     try:
         # 编码查询
-        query_vector = embedding_model.encode(query)
+        if query_vector is None:
+            query_vector = embedding_model.encode(query)
         if query_vector is None:
             logger.error("查询编码失败。搜索中止。")
             return []
 
         logger.info(f"正在搜索查询 '{query}' 的前 {top_k} 个结果")
+        with span("search"):
+            vector_results = search_by_vector(
+                table, query_vector, candidates, nprobes, refine_factor, where
+            )
+            keyword_hits = keyword_future.result() if keyword_future is not None else None
+            return _finish_results(table, vector_results, keyword_hits, query_vector, top_k)
+    finally:
+        # 提前返回时取消尚未开始的全文检索，避免占用全文检索线程池
+        if keyword_future is not None and not keyword_future.done():
+            keyword_future.cancel()
 
-        # 执行搜索
-        results = table.search(query_vector).limit(top_k).to_df()
-
-        search_results = []
-        for _, row in results.iterrows():
-            try:
-                metadata_str = str(row["metadata"])
-                metadata = json.loads(metadata_str)
-                search_results.append(
-                    {
-                        "text": str(row["text"]),
-                        "metadata": metadata,
-                        "score": float(row["_distance"]),
-                    }
-                )
-            except (json.JSONDecodeError, KeyError) as e:
-                logger.warning(f"解析结果行失败: {e}")
-                continue
 
-        logger.info(f"找到 {len(search_results)} 个结果。")
-        return search_results
+async def asearch_vector_store(
+    query: str,
+    db: "DBConnection",
+    table_name: str,
+    top_k: int = 5,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    query_vector: Optional[np.ndarray] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    search_mode: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    search_vector_store的异步版本。
 
-    except Exception as e:
-        logger.error(f"搜索操作失败: {e}")
+    查询编码通过共享的异步HTTP客户端完成；打开表和LanceDB检索是阻塞调用，
+    放到线程池中执行，不占用事件循环。参数和返回值同search_vector_store。
+    """
+    where = build_where_clause(filters)
+    hybrid = _resolve_search_mode(search_mode) == "hybrid"
+    table = await asyncio.to_thread(_open_search_table, db, table_name)
+    if table is None:
+        return []
+
+    candidates = top_k * max(1, HYBRID_CANDIDATE_FACTOR) if hybrid else top_k
+    keyword_task: Optional[asyncio.Future] = None
+    if hybrid:
+        keyword_task = asyncio.ensure_future(
+            asyncio.to_thread(search_by_keywords, table, query, candidates, where)
+        )
+
+    try:
+        if query_vector is None:
+            query_vector = await embedding_model.aencode(query)
+        if query_vector is None:
+            logger.error("查询编码失败。搜索中止。")
+            return []
+
+        logger.info(f"正在搜索查询 '{query}' 的前 {top_k} 个结果")
+        with span("search"):
+            vector_results = await asyncio.to_thread(
+                search_by_vector, table, query_vector, candidates, nprobes, refine_factor, where
+            )
+            keyword_hits = await keyword_task if keyword_task is not None else None
+            return await asyncio.to_thread(
+                _finish_results, table, vector_results, keyword_hits, query_vector, top_k
+            )
+    finally:
+        if keyword_task is not None and not keyword_task.done():
+            keyword_task.cancel()
+
+
+async def asearch_vector_store_many(
+    queries: List[str],
+    db: "DBConnection",
+    table_name: str,
+    top_k: int = 5,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    query_vectors: Optional[np.ndarray] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    search_mode: Optional[str] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    asearch_vector_store的批量版本，用于离线评测等一次提交大量查询的场景。
+
+    所有查询一次批量编码，向量检索合并为一次多向量查询（见search_by_vectors）；
+    混合模式下各查询的全文检索在线程池中并发执行，与编码和向量检索重叠。
+    filters对所有查询生效，其余参数同search_vector_store。
+
+    Args:
+        queries: 查询字符串列表
+        query_vectors: 已编码的查询向量矩阵，与queries一一对应；提供时跳过编码
+
+    Returns:
+        List[List[Dict[str, Any]]]: 与queries一一对应的结果列表，格式同search_vector_store；
+            无法打开表或编码失败时均为空列表
+    """
+    where = build_where_clause(filters)
+    hybrid = _resolve_search_mode(search_mode) == "hybrid"
+    if not queries:
         return []
+    table = await asyncio.to_thread(_open_search_table, db, table_name)
+    if table is None:
+        return [[] for _ in queries]
+
+    candidates = top_k * max(1, HYBRID_CANDIDATE_FACTOR) if hybrid else top_k
+    keyword_tasks: List[asyncio.Future] = []
+    if hybrid:
+        loop = asyncio.get_running_loop()
+        keyword_tasks = [
+            loop.run_in_executor(
+                _keyword_executor, search_by_keywords, table, query, candidates, where
+            )
+            for query in queries
+        ]
+
+    try:
+        if query_vectors is None:
+            query_vectors = await embedding_model.aencode(list(queries))
+        if query_vectors is None:
+            logger.error("查询编码失败。批量搜索中止。")
+            return [[] for _ in queries]
 
+        logger.info(f"正在批量搜索 {len(queries)} 个查询的前 {top_k} 个结果")
+        with span("batch_search"):
+            vector_results = await asyncio.to_thread(
+                search_by_vectors, table, query_vectors, candidates, nprobes, refine_factor, where
+            )
+            keyword_hits = (
+                await asyncio.gather(*keyword_tasks) if hybrid else [None] * len(queries)
+            )
 
+            def finish_all() -> List[List[Dict[str, Any]]]:
+                return [
+                    _finish_results(table, results, hits, vector, top_k)
+                    for results, hits, vector in zip(vector_results, keyword_hits, query_vectors)
+                ]
 
+            return await asyncio.to_thread(finish_all)
+    finally:
+        for task in keyword_tasks:
+            task.cancel()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+测试回答缓存：精确命中、近似命中、版本变化后失效，以及命中时跳过LLM调用
+"""
+
+import numpy as np
+
+import src.embedding_model as embedding_module
+import src.rag_pipeline as rag_module
+from src.answer_cache import AnswerCache
+from src.embedding_model import embedding_model
+from tools.mock_server import start_mock_server
+
+
+def test_exact_semantic_and_version_invalidation():
+    """规范化后的相同查询精确命中，相近向量近似命中，表版本变化后清空"""
+    version = [0]
+    cache = AnswerCache(10, 60, 0.95, version_provider=lambda: version[0])
+    response = {"llm_answer": "答案", "retrieved_context": []}
+    cache.put("什么是RAG？", response, np.array([1.0, 0.0, 0.0]))
+
+    assert cache.get("  什么是rag ") == response
+    assert cache.get("RAG是什么", np.array([0.99, 0.05, 0.0])) == response
+    assert cache.get("无关问题", np.array([0.0, 1.0, 0.0])) is None
+
+    version[0] = 1
+    assert cache.get("什么是RAG？") is None
+    assert cache.stats()["entries"] == 0
+
+
+
+def test_expired_nearest_entry_does_not_hide_valid_match(monkeypatch):
+    """最相似的条目过期时，仍能近似命中阈值以上的其他有效条目"""
+    now = [1000.0]
+    monkeypatch.setattr("src.answer_cache.time.time", lambda: now[0])
+    cache = AnswerCache(10, 60, 0.9)
+    cache.put("旧问题", {"llm_answer": "旧"}, np.array([1.0, 0.0, 0.0]))
+    now[0] += 50
+    cache.put("新问题", {"llm_answer": "新"}, np.array([0.95, 0.3, 0.0]))
+    now[0] += 20
+
+    assert cache.get("相近问题", np.array([1.0, 0.01, 0.0])) == {"llm_answer": "新"}
+    assert cache.stats()["entries"] == 1
+
+def test_cached_answer_skips_llm(monkeypatch):
+    """第二次相同查询不再请求聊天接口"""
+    server = start_mock_server(dim=8)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", None)
+        monkeypatch.setattr(rag_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(rag_module, "save_qa_to_knowledge_base", lambda q, a: None)
+        monkeypatch.setattr(rag_module, "answer_cache", AnswerCache(10, 60, 0.95))
+
+        first = rag_module.get_rag_response("缓存测试问题")
+        second = rag_module.get_rag_response("缓存测试问题？")
+
+        chat_calls = [p for p, _ in server.request_log if p.endswith("/chat/completions")]
+        assert first["llm_answer"].startswith("模拟回答")
+        assert second == first
+        assert len(chat_calls) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
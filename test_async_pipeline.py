@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+测试异步RAG流水线：并发请求不会因为等待LLM而串行化
+"""
+
+import asyncio
+import time
+
+import lancedb
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+import src.embedding_model as embedding_module
+import src.rag_pipeline as rag_module
+import src.vector_store as vector_store
+from src.embedding_model import embedding_model
+from src.http_client import aclose_async_client
+from src.vector_store import write_documents
+from tools.mock_server import start_mock_server
+
+
+def test_concurrent_ask_does_not_serialise(monkeypatch):
+    """并发的aget_rag_response总耗时接近单次LLM延迟，而不是延迟之和"""
+    chat_delay = 0.5
+    server = start_mock_server(dim=8, chat_delay=chat_delay)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", None)
+        monkeypatch.setattr(rag_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(rag_module, "save_qa_to_knowledge_base", lambda q, a: None)
+        monkeypatch.setattr(rag_module, "answer_cache", None)
+
+        async def ask_many(n):
+            try:
+                return await asyncio.gather(
+                    *(rag_module.aget_rag_response(f"问题{i}") for i in range(n))
+                )
+            finally:
+                await aclose_async_client()
+
+        start = time.perf_counter()
+        responses = asyncio.run(ask_many(4))
+        elapsed = time.perf_counter() - start
+
+        assert all(r["llm_answer"].startswith("模拟回答") for r in responses)
+        assert elapsed < chat_delay * 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stream_rag_response_events(monkeypatch):
+    """流式接口先产出上下文，再逐段产出token，最后产出完整回答"""
+    server = start_mock_server(dim=8)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_model, "cache", None)
+        monkeypatch.setattr(rag_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(rag_module, "save_qa_to_knowledge_base", lambda q, a: None)
+        monkeypatch.setattr(rag_module, "answer_cache", None)
+
+        async def collect():
+            try:
+                return [event async for event in rag_module.astream_rag_response("问题")]
+            finally:
+                await aclose_async_client()
+
+        for events in (asyncio.run(collect()), list(rag_module.stream_rag_response("问题"))):
+            names = [event["event"] for event in events]
+            assert names[0] == "context" and names[-1] == "done"
+            tokens = [event["data"] for event in events if event["event"] == "token"]
+            assert len(tokens) > 1
+            assert "".join(tokens) == events[-1]["data"]["llm_answer"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_batch_ask_embeds_once_and_bounds_concurrency(monkeypatch):
+    """批量问答只发一次嵌入请求，LLM生成按并发上限分批进行，结果按完成顺序逐个产出"""
+    chat_delay = 0.3
+    server = start_mock_server(dim=8, chat_delay=chat_delay)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_module, "EMBEDDING_BATCH_SIZE", 64)
+        monkeypatch.setattr(embedding_model, "cache", None)
+        monkeypatch.setattr(rag_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(rag_module, "save_qa_to_knowledge_base", lambda q, a: None)
+        monkeypatch.setattr(rag_module, "answer_cache", None)
+
+        queries = [f"批量问题{i}" for i in range(6)]
+
+        async def ask_batch():
+            try:
+                return [
+                    item
+                    async for item in rag_module.abatch_rag_responses(queries, concurrency=3)
+                ]
+            finally:
+                await aclose_async_client()
+
+        start = time.perf_counter()
+        results = asyncio.run(ask_batch())
+        elapsed = time.perf_counter() - start
+
+        assert sorted(index for index, _ in results) == list(range(6))
+        assert all(r["llm_answer"].startswith("模拟回答") for _, r in results)
+        # 6个问题、并发3：两轮生成
+        assert chat_delay * 2 <= elapsed < chat_delay * 4
+        embedding_calls = [n for path, n in server.request_log if path == "/v1/embeddings"]
+        assert embedding_calls == [6]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_batch_ask_records_per_query_latency(monkeypatch):
+    """批量问答记录的每个查询耗时不包括排队等待生成的时间，不随在批中的位置增长"""
+    chat_delay = 0.2
+    server = start_mock_server(dim=8, chat_delay=chat_delay)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(rag_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(rag_module, "save_qa_to_knowledge_base", lambda q, a: None)
+        monkeypatch.setattr(rag_module, "answer_cache", None)
+        totals = []
+        monkeypatch.setattr(
+            rag_module,
+            "observe_stage",
+            lambda stage, seconds: totals.append(seconds) if stage == "total" else None,
+        )
+
+        async def ask_batch():
+            try:
+                queries = [f"排队问题{i}" for i in range(4)]
+                return [
+                    item
+                    async for item in rag_module.abatch_rag_responses(queries, concurrency=1)
+                ]
+            finally:
+                await aclose_async_client()
+
+        assert len(asyncio.run(ask_batch())) == 4
+        # 串行生成：整批约4 * chat_delay，但每个查询只计自己的一次生成
+        assert len(totals) == 4
+        assert all(chat_delay <= seconds < chat_delay * 2 for seconds in totals)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("num_queries", [1, 65])
+def test_batch_ask_with_single_query_group(monkeypatch, tmp_path, num_queries):
+    """只有一个查询的分组（单个问题、64个一组时的第65个）也能完成多向量检索"""
+    db = lancedb.connect(tmp_path)
+    docs = [Document(page_content=f"句子{i}", metadata={"source": "a.txt"}) for i in range(20)]
+    embeddings = np.random.default_rng(0).random((20, 8), dtype=np.float32)
+    assert write_documents(db, "docs", docs, embeddings, [str(i) for i in range(20)])
+
+    server = start_mock_server(dim=8)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", None)
+        monkeypatch.setattr(vector_store, "SMALL2BIG_ENABLED", False)
+        monkeypatch.setattr(rag_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(rag_module, "get_db_connection", lambda: db)
+        monkeypatch.setattr(rag_module, "LANCEDB_TABLE_NAME", "docs")
+        monkeypatch.setattr(rag_module, "BATCH_SEARCH_SIZE", 64)
+        monkeypatch.setattr(rag_module, "save_qa_to_knowledge_base", lambda q, a: None)
+        monkeypatch.setattr(rag_module, "answer_cache", None)
+
+        queries = [f"批量问题{i}" for i in range(num_queries)]
+
+        async def ask_batch():
+            try:
+                return [item async for item in rag_module.abatch_rag_responses(queries)]
+            finally:
+                await aclose_async_client()
+
+        results = asyncio.run(ask_batch())
+        assert sorted(index for index, _ in results) == list(range(num_queries))
+        assert all(r["llm_answer"].startswith("模拟回答") for _, r in results)
+    finally:
+        server.shutdown()
+        server.server_close()
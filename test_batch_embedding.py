@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+测试批量嵌入接口：使用本地桩服务验证分批请求和结果顺序
+"""
+
+import asyncio
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.embedding_cache import EmbeddingCache
+
+import src.embedding_model as embedding_module
+from src.embedding_model import embedding_model
+import src.indexing as indexing_module
+from src.indexing import _Chunk, _encode_chunk_batches, _Progress
+from tools.mock_server import FAIL_MARKER, deterministic_embedding, start_mock_server
+
+
+def test_batched_encode(monkeypatch):
+    """按EMBEDDING_BATCH_SIZE分批请求，结果保持输入顺序"""
+    server = start_mock_server(dim=16)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", None)
+
+        texts = [f"第{i}个句子" for i in range(10)]
+        result = embedding_model.encode_concurrent(texts, batch_size=4, max_workers=3)
+        embeddings = result.embeddings
+
+        assert result.ok
+        assert embeddings.shape == (10, 16)
+        batch_sizes = [size for path, size in server.request_log if path == "/v1/embeddings"]
+        assert sorted(batch_sizes) == [2, 4, 4]
+        np.testing.assert_allclose(
+            embeddings[7], np.array(deterministic_embedding(texts[7], 16), dtype=np.float32)
+        )
+
+        # 单个字符串返回一维向量
+        single = embedding_model.encode("单个查询")
+        assert single.shape == (16,)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_concurrent_encode_partial_failure(monkeypatch):
+    """失败批次重试后仍失败时，只报告该批次的文本，其它批次正常返回"""
+    server = start_mock_server(dim=8)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", None)
+
+        texts = ["a", "b", "c", f"d {FAIL_MARKER}", "e", "f"]
+        result = embedding_model.encode_concurrent(
+            texts, batch_size=2, max_workers=2, max_retries=2, backoff=0.01
+        )
+
+        assert not result.ok
+        assert result.failed_indices == [2, 3]
+        assert result.failed_batches == 1 and result.num_batches == 3
+        assert np.isnan(result.embeddings[2:4]).all()
+        assert not np.isnan(result.embeddings[[0, 1, 4, 5]]).any()
+        # 失败批次共请求 1 + 2 次（首次 + 两次重试）
+        failing = [size for path, size in server.request_log if path == "/v1/embeddings"]
+        assert len(failing) == 3 + 2
+
+        # encode保持全部成功或返回None的语义
+        assert embedding_model.encode(texts) is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_analyze_mode_fails_batch_instead_of_mixing_vectors(monkeypatch):
+    """analyze模式无法提取特征时整批失败，不写入其它向量空间的备用向量"""
+    server = start_mock_server(dim=8)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "analyze")
+
+        result = embedding_model.encode_concurrent(["甲", "乙"], batch_size=2, max_retries=0)
+        assert result.ok and result.embeddings.shape == (2, 128)
+
+        monkeypatch.setattr(
+            embedding_model, "_extract_features_from_analysis", lambda analysis, text: None
+        )
+        result = embedding_model.encode_concurrent(["甲", "乙"], batch_size=2, max_retries=0)
+        assert result.embeddings is None and result.failed_indices == [0, 1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_index_encode_stage_counts_kept_chunks_per_file(monkeypatch):
+    """索引的编码阶段按文件统计编码成功的块，被encode_documents丢弃的块不计入"""
+
+    def drop_failed(documents, ids):
+        kept = [i for i, doc in enumerate(documents) if FAIL_MARKER not in doc.page_content]
+        return [documents[i] for i in kept], [ids[i] for i in kept], np.zeros((len(kept), 8))
+
+    monkeypatch.setattr(indexing_module, "encode_documents", drop_failed)
+    batch = [
+        _Chunk(Document(page_content="a"), "a#0", "a.txt"),
+        _Chunk(None, None, completes=("a.txt", {}, 1, 1)),
+        _Chunk(Document(page_content=f"b {FAIL_MARKER}"), "b#0", "b.txt"),
+        _Chunk(Document(page_content="b"), "b#1", "b.txt"),
+    ]
+    [(encoded, kept, completed)] = list(
+        _encode_chunk_batches([batch], _Progress(None, None))
+    )
+
+    assert encoded[1] == ["a#0", "b#1"]
+    assert kept == {"a.txt": 1, "b.txt": 1}
+    assert completed == [("a.txt", {}, 1, 1)]
+
+
+def test_embedding_cache_skips_http(monkeypatch, tmp_path):
+    """重复编码相同文本时直接命中缓存，不再发起嵌入请求"""
+    server = start_mock_server(dim=8)
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=1024 * 1024)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", cache)
+
+        texts = [f"句子{i}" for i in range(6)]
+        first = embedding_model.encode_concurrent(texts, batch_size=4)
+        requests_after_first = len(server.request_log)
+
+        # 全部命中：不发请求
+        second = embedding_model.encode_concurrent(texts, batch_size=4)
+        assert len(server.request_log) == requests_after_first
+        np.testing.assert_array_equal(first.embeddings, second.embeddings)
+
+        # 部分命中：只编码新文本，结果按输入顺序合并
+        mixed = embedding_model.encode_concurrent(["新句子", texts[3]], batch_size=4)
+        assert server.request_log[-1] == ("/v1/embeddings", 1)
+        np.testing.assert_array_equal(mixed.embeddings[1], first.embeddings[3])
+
+        stats = cache.stats()
+        assert stats["hits"] == 7 and stats["misses"] == 7
+        assert stats["entries"] == 7
+    finally:
+        cache.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_aencode_rejects_cached_vectors_of_another_dim(monkeypatch, tmp_path):
+    """缓存中的向量与新编码向量维度不一致时，异步编码返回None而不是在合并时抛出异常"""
+    server = start_mock_server(dim=8)
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=1024 * 1024)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", cache)
+        cache.put_many(embedding_model.cache_model_key, ["旧句子"], np.ones((1, 4), dtype=np.float32))
+
+        assert asyncio.run(embedding_model.aencode(["旧句子", "新句子"])) is None
+    finally:
+        cache.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_encode_concurrent_does_not_cache_vectors_of_another_dim(monkeypatch, tmp_path):
+    """新编码向量与缓存维度不一致时不写入缓存，缓存中只保留原有向量"""
+    server = start_mock_server(dim=8)
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=1024 * 1024)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "embeddings")
+        monkeypatch.setattr(embedding_model, "cache", cache)
+        cache.put_many(embedding_model.cache_model_key, ["旧句子"], np.ones((1, 4), dtype=np.float32))
+
+        result = embedding_model.encode_concurrent(["旧句子", "新句子"], batch_size=1)
+        assert result.embeddings.shape == (2, 8)
+        assert list(cache.get_many(embedding_model.cache_model_key, ["旧句子", "新句子"])) == [0]
+    finally:
+        cache.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_embedding_cache_lru_eviction(tmp_path):
+    """超过容量时淘汰最久未访问的条目"""
+    vector_bytes = 4 * 4
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=vector_bytes * 3)
+    try:
+        vectors = np.arange(16, dtype=np.float32).reshape(4, 4)
+        cache.put_many("m", ["a", "b", "c"], vectors[:3])
+        cache.get_many("m", ["a"])  # a成为最近访问
+        cache.put_many("m", ["d"], vectors[3:])
+
+        hits = cache.get_many("m", ["a", "b", "c", "d"])
+        assert 1 not in hits  # b最久未访问，被淘汰
+        assert {0, 3} <= set(hits)
+        assert cache.stats()["bytes"] <= vector_bytes * 3
+    finally:
+        cache.close()
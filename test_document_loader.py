@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+测试文档加载：递归扫描子目录，进程池并行加载与顺序加载结果一致
+"""
+
+import src.document_loader as loader_module
+from src.document_loader import iter_load_files, list_document_files, load_documents
+
+
+def _make_tree(root):
+    (root / "sub" / "deeper").mkdir(parents=True)
+    (root / ".hidden").mkdir()
+    (root / "a.txt").write_text("第一篇", encoding="utf-8")
+    (root / "sub" / "b.txt").write_text("第二篇", encoding="utf-8")
+    (root / "sub" / "deeper" / "c.txt").write_text("第三篇", encoding="utf-8")
+    (root / ".hidden" / "d.txt").write_text("隐藏", encoding="utf-8")
+    (root / "e.csv").write_text("不支持", encoding="utf-8")
+
+
+def test_list_document_files_recurses(tmp_path):
+    """子目录中的文件被列出，隐藏目录和不支持的格式被跳过"""
+    _make_tree(tmp_path)
+    files = list_document_files(tmp_path)
+    assert [p.relative_to(tmp_path).as_posix() for p in files] == [
+        "a.txt",
+        "sub/b.txt",
+        "sub/deeper/c.txt",
+    ]
+
+
+def test_parallel_load_matches_sequential(tmp_path):
+    """并行加载返回相同的文档（按文件路径排序），并为每个文件记录统计"""
+    _make_tree(tmp_path)
+    sequential = load_documents(tmp_path, workers=1)
+    parallel = load_documents(tmp_path, workers=2, timeout=60)
+    assert [d.page_content for d in parallel] == [d.page_content for d in sequential]
+    assert [d.page_content for d in sequential] == ["第一篇", "第二篇", "第三篇"]
+
+    results = list(iter_load_files(list_document_files(tmp_path), workers=2))
+    assert all(stats.ok and stats.num_docs == 1 for _, _, stats in results)
+
+
+def test_few_files_load_inline(monkeypatch, tmp_path):
+    """文件数不超过阈值时在当前进程中加载，不启动进程池"""
+    def no_pool(*args, **kwargs):
+        raise AssertionError("不应为少量文件启动进程池")
+
+    monkeypatch.setattr(loader_module, "ProcessPoolExecutor", no_pool)
+    (tmp_path / "a.txt").write_text("第一篇", encoding="utf-8")
+    (tmp_path / "b.txt").write_text("第二篇", encoding="utf-8")
+    docs = load_documents(tmp_path, workers=4)
+    assert [d.page_content for d in docs] == ["第一篇", "第二篇"]
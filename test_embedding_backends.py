@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试本地嵌入后端：字符n-gram哈希投影，以及EmbeddingModel的local模式不访问网络
+"""
+
+import asyncio
+
+import lancedb
+import numpy as np
+from langchain.docstore.document import Document
+
+import src.embedding_model as embedding_module
+import src.vector_store as vector_store
+from src.embedding_backends import HashingNgramBackend, get_local_backend
+from src.embedding_model import embedding_model
+from src.rag_pipeline import check_relevance
+from src.vector_store import search_vector_store, write_documents
+
+
+def test_hashing_backend_batches_and_similarity():
+    """整批编码与逐条编码一致，向量单位长度，字面相近的文本更相似"""
+    backend = HashingNgramBackend(dim=64, max_ngram=3)
+    texts = ["什么是检索增强生成", "检索增强生成是什么", "今天天气很好", ""]
+    vectors = backend.encode(texts)
+
+    assert vectors.shape == (4, 64) and vectors.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(vectors[:3], axis=1), 1.0, rtol=1e-5)
+    # 空文本没有n-gram，返回零向量而不是NaN
+    assert not vectors[3].any()
+    for i, text in enumerate(texts):
+        np.testing.assert_allclose(backend.encode([text])[0], vectors[i], rtol=1e-6)
+    similarity = vectors @ vectors.T
+    assert similarity[0, 1] > similarity[0, 2] + 0.3
+    # 大小写不敏感
+    np.testing.assert_allclose(backend.encode(["LanceDB"]), backend.encode(["lancedb"]))
+
+
+def test_local_mode_skips_network_and_cache(monkeypatch):
+    """local模式下encode和aencode都在进程内完成，不探测API、不查询嵌入缓存"""
+
+    class FailingCache:
+        def get_many(self, *args):
+            raise AssertionError("local模式不应查询嵌入缓存")
+
+    monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "local")
+    monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", "http://127.0.0.1:9/v1")
+    monkeypatch.setattr(embedding_model, "cache", FailingCache())
+
+    texts = ["第一个句子", "第二个句子"]
+    embeddings = embedding_model.encode(texts)
+    expected = get_local_backend().encode(texts)
+    np.testing.assert_allclose(embeddings, expected)
+    np.testing.assert_allclose(asyncio.run(embedding_model.aencode(texts[0])), expected[0])
+    assert embedding_model.cache_model_key == f"local:{get_local_backend().name}"
+
+
+def test_exact_match_query_is_relevant(monkeypatch, tmp_path):
+    """score是L2距离：与文档完全相同的查询距离为0，判定为相关；无关查询距离超过阈值"""
+    monkeypatch.setattr(vector_store, "SMALL2BIG_ENABLED", False)
+    backend = HashingNgramBackend(dim=256, max_ngram=3)
+    texts = ["LanceDB是一个开源的向量数据库", "RAG系统结合了检索和生成", "今天的午餐是面条"]
+    db = lancedb.connect(tmp_path)
+    docs = [Document(page_content=text, metadata={}) for text in texts]
+    assert write_documents(db, "docs", docs, backend.encode(texts), ["0", "1", "2"])
+
+    query_vector = backend.encode([texts[1]])[0]
+    results = search_vector_store(
+        texts[1], db, "docs", top_k=2, query_vector=query_vector, search_mode="vector"
+    )
+    assert results[0]["id"] == "1" and results[0]["score"] < 1e-6
+    assert check_relevance(results)
+
+    query_vector = backend.encode(["明天下雨吗"])[0]
+    results = search_vector_store(
+        "明天下雨吗", db, "docs", top_k=2, query_vector=query_vector, search_mode="vector"
+    )
+    assert not check_relevance(results)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+测试混合检索：全文检索与向量检索的结果用RRF融合
+"""
+
+from concurrent.futures import Future
+
+import lancedb
+import numpy as np
+from langchain.docstore.document import Document
+
+import src.vector_store as vector_store
+from src.vector_store import (
+    ensure_fts_index,
+    reciprocal_rank_fusion,
+    search_vector_store,
+    write_documents,
+)
+
+
+def test_rrf_rewards_items_ranked_by_both_lists():
+    """两路都排在前面的结果胜过只在一路排第一的结果，权重为0的列表不参与排序"""
+    vector = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    keyword = [{"id": "d"}, {"id": "b"}]
+
+    fused = reciprocal_rank_fusion({"vector": vector, "keyword": keyword}, {}, top_k=3)
+    assert [r["id"] for r in fused] == ["b", "a", "d"]
+    assert fused[0]["vector_rank"] == 2 and fused[0]["keyword_rank"] == 2
+    assert fused[2]["vector_rank"] is None
+
+    fused = reciprocal_rank_fusion(
+        {"vector": vector, "keyword": keyword}, {"keyword": 0.0}, top_k=2
+    )
+    assert [r["id"] for r in fused] == ["a", "b"]
+
+
+def test_hybrid_search_finds_exact_keyword_match(tmp_path, monkeypatch):
+    """向量检索排不到的产品编号通过全文检索被召回，score仍是向量距离"""
+    monkeypatch.setattr(vector_store, "SMALL2BIG_ENABLED", False)
+    db = lancedb.connect(tmp_path)
+    texts = [f"普通的说明文字第{i}条" for i in range(30)] + ["产品编号 XK-7391 的保修期为两年"]
+    embeddings = np.random.default_rng(0).random((len(texts), 8), dtype=np.float32)
+    docs = [Document(page_content=text, metadata={}) for text in texts]
+    assert write_documents(db, "docs", docs, embeddings, [str(i) for i in range(len(texts))])
+    assert ensure_fts_index(db, "docs")
+
+    # 查询向量与第0行完全相同，产品编号所在的行在向量检索中排不进前3
+    query_vector = embeddings[0]
+    results = search_vector_store(
+        "XK-7391", db, "docs", top_k=3, query_vector=query_vector, search_mode="vector"
+    )
+    assert "30" not in [r["id"] for r in results]
+
+    results = search_vector_store(
+        "XK-7391", db, "docs", top_k=3, query_vector=query_vector, search_mode="hybrid"
+    )
+    ids = [r["id"] for r in results]
+    assert set(ids[:2]) == {"0", "30"}
+    hit = results[ids.index("30")]
+    assert hit["keyword_rank"] == 1
+    expected = float(((embeddings[30] - query_vector) ** 2).sum())
+    assert abs(hit["score"] - expected) < 1e-4
+
+
+def test_keyword_search_cancelled_when_query_encoding_fails(tmp_path, monkeypatch):
+    """查询编码失败提前返回时，取消已提交但尚未执行的全文检索"""
+    db = lancedb.connect(tmp_path)
+    embeddings = np.random.default_rng(0).random((3, 8), dtype=np.float32)
+    docs = [Document(page_content=f"句子{i}", metadata={}) for i in range(3)]
+    assert write_documents(db, "docs", docs, embeddings, ["0", "1", "2"])
+
+    pending = Future()
+
+    class PendingExecutor:
+        def submit(self, *args):
+            return pending
+
+    monkeypatch.setattr(vector_store, "_keyword_executor", PendingExecutor())
+    monkeypatch.setattr(vector_store.embedding_model, "encode", lambda query: None)
+
+    assert search_vector_store("句子", db, "docs", top_k=2, search_mode="hybrid") == []
+    assert pending.cancelled()
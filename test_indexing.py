@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+测试增量索引：运行期间和被取消后，查询读取上一个已提交的表版本；加载期间被修改的文件不记入清单
+"""
+
+import threading
+
+from langchain.docstore.document import Document
+
+import src.embedding_model as embedding_module
+import src.indexing as indexing_module
+from src.chunk_store import paragraph_store
+from src.db_manager import db_manager
+from src.index_manifest import row_id_prefix
+
+TABLE_NAME = "incremental_docs"
+
+
+def _split_sentences(documents):
+    """按句号分句的简单分割器，代替依赖NLTK数据的iter_split_documents"""
+    for doc in documents:
+        texts = [text for text in doc.page_content.split("。") if text]
+        sentences = [
+            Document(
+                page_content=text,
+                metadata={**doc.metadata, "paragraph_num": 0, "sentence_num_in_para": j},
+            )
+            for j, text in enumerate(texts)
+        ]
+        yield {"para": doc, "sentences": sentences}
+
+
+def _live_view():
+    """查询路径看到的 (全部句子, a.txt第一句的父段落)"""
+    table = db_manager.get_table(TABLE_NAME)
+    texts = sorted(table.to_arrow()["text"].to_pylist())
+    parents = paragraph_store.fetch_parents(table.name, [f"{row_id_prefix('a.txt')}0"])
+    return texts, [text for _, text in parents.values()]
+
+
+def test_incremental_run_is_invisible_until_committed(monkeypatch, tmp_path):
+    """增量运行的删除和写入在提交前对查询不可见，被取消后回滚，成功后一起生效"""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("甲一。甲二。", encoding="utf-8")
+    (data_dir / "b.txt").write_text("乙一。", encoding="utf-8")
+    monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "local")
+    monkeypatch.setattr(indexing_module, "DATA_DIR", data_dir)
+    monkeypatch.setattr(indexing_module, "INDEX_MANIFEST_PATH", tmp_path / "manifest.json")
+    monkeypatch.setattr(indexing_module, "LANCEDB_TABLE_NAME", TABLE_NAME)
+    monkeypatch.setattr(indexing_module, "SMALL2BIG_ENABLED", True)
+    monkeypatch.setattr(indexing_module, "iter_split_documents", _split_sentences)
+
+    assert indexing_module.run_indexing()["status"] == "success"
+    committed = (["乙一", "甲一", "甲二"], ["甲一。甲二。"])
+    assert _live_view() == committed
+
+    # 修改a.txt后运行增量索引，在第一批写入后取消
+    (data_dir / "a.txt").write_text("甲新。", encoding="utf-8")
+    cancel_event = threading.Event()
+    seen_during_run = []
+
+    def progress(stage, counters):
+        if counters["rows_written"] and not cancel_event.is_set():
+            seen_during_run.append(_live_view())
+            cancel_event.set()
+
+    result = indexing_module.run_indexing(progress=progress, cancel_event=cancel_event)
+    assert result["status"] == "cancelled"
+    assert seen_during_run == [committed]
+    assert _live_view() == committed
+    # 表的最新版本也回滚到了已提交的内容
+    latest = db_manager.connection.open_table(db_manager.resolve_table_name(TABLE_NAME))
+    assert sorted(latest.to_arrow()["text"].to_pylist()) == committed[0]
+
+    # 再次运行：新内容和新段落一起生效
+    assert indexing_module.run_indexing()["status"] == "success"
+    assert _live_view() == (["乙一", "甲新"], ["甲新。"])
+
+
+def test_file_modified_during_load_is_not_recorded(monkeypatch, tmp_path):
+    """加载期间被修改的文件不记入清单，下次运行时按新内容重新索引"""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("甲一。", encoding="utf-8")
+    monkeypatch.setattr(embedding_module, "EMBEDDING_API_MODE", "local")
+    monkeypatch.setattr(indexing_module, "DATA_DIR", data_dir)
+    monkeypatch.setattr(indexing_module, "INDEX_MANIFEST_PATH", tmp_path / "manifest.json")
+    monkeypatch.setattr(indexing_module, "LANCEDB_TABLE_NAME", "modified_docs")
+    monkeypatch.setattr(indexing_module, "iter_split_documents", _split_sentences)
+    load_files = indexing_module.iter_load_files
+
+    def load_then_modify(files):
+        for path, docs, stats in load_files(files):
+            path.write_text("甲一已修改。", encoding="utf-8")
+            yield path, docs, stats
+
+    monkeypatch.setattr(indexing_module, "iter_load_files", load_then_modify)
+    indexing_module.run_indexing()
+    assert "a.txt" not in indexing_module.load_manifest(tmp_path / "manifest.json")
+
+    monkeypatch.setattr(indexing_module, "iter_load_files", load_files)
+    assert indexing_module.run_indexing()["status"] == "success"
+    texts = db_manager.get_table("modified_docs").to_arrow()["text"].to_pylist()
+    assert texts == ["甲一已修改"]
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+测试压测工具：桩服务的延迟分布、从 /metrics 差值计算服务端指标
+"""
+
+import pytest
+
+from src.metrics import MetricsRegistry
+from tools.loadgen import parse_metrics, server_metrics
+from tools.mock_server import LatencyModel
+
+
+def test_latency_model_parse_and_sample():
+    """各种延迟分布按写法解析，抽样结果非负且在分布范围内"""
+    assert LatencyModel.parse("0.25").sample() == 0.25
+    uniform = LatencyModel.parse("uniform:0.1,0.2", seed=1)
+    assert all(0.1 <= uniform.sample() <= 0.2 for _ in range(100))
+    lognormal = LatencyModel.parse("lognormal:0.5,0.8", seed=1)
+    assert all(lognormal.sample() > 0 for _ in range(100))
+    assert all(LatencyModel.parse("normal:0,1", seed=2).sample() >= 0 for _ in range(100))
+    with pytest.raises(ValueError):
+        LatencyModel.parse("uniform:0.1")
+    with pytest.raises(ValueError):
+        LatencyModel.parse("pareto:1,2")
+
+
+def test_server_metrics_from_scrape_delta():
+    """只统计两次抓取之间新增的事件循环延迟和阶段耗时"""
+    registry = MetricsRegistry()
+    lag = registry.histogram("rag_event_loop_lag_seconds", "lag", buckets=[0.001, 0.01, 0.1])
+    stages = registry.histogram("rag_stage_duration_seconds", "stage", ["stage"])
+    lag.observe(0.5)
+    stages.observe(10.0, stage="llm")
+    before = parse_metrics(registry.render())
+
+    for _ in range(99):
+        lag.observe(0.0005)
+    lag.observe(0.05)
+    stages.observe(0.2, stage="llm")
+    stages.observe(0.4, stage="llm")
+    stages.observe(0.01, stage="search")
+    report = server_metrics(before, parse_metrics(registry.render()))
+
+    assert report["event_loop_lag"]["samples"] == 100
+    assert report["event_loop_lag"]["p99_le_ms"] == 1.0
+    assert report["event_loop_lag"]["mean_ms"] == pytest.approx((99 * 0.5 + 50) / 100)
+    assert report["stages_ms"] == {"llm": 300.0, "search": 10.0}
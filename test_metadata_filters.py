@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试结构化元数据列：写入时填充类型化列，过滤条件在LanceDB中预过滤
+"""
+
+import lancedb
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+from pydantic import ValidationError
+
+from src.api import SearchFilters
+from src.config import DATA_DIR
+from src.vector_store import (
+    build_where_clause,
+    ensure_scalar_indices,
+    search_by_vector,
+    write_documents,
+)
+
+
+def _write_sample_table(db):
+    docs = [
+        Document(
+            page_content=f"句子{i}",
+            metadata={
+                "source": str(DATA_DIR / ("tenant_a/x.pdf" if i % 2 else "tenant_b/y.txt")),
+                "paragraph_num": i % 3,
+                "sentence_num_in_para": i,
+            },
+        )
+        for i in range(20)
+    ]
+    embeddings = np.random.default_rng(0).random((20, 8), dtype=np.float32)
+    assert write_documents(db, "docs", docs, embeddings, [str(i) for i in range(20)])
+    assert ensure_scalar_indices(db, "docs")
+    return db.open_table("docs"), embeddings
+
+
+def test_where_clause_quotes_values():
+    """字符串值中的单引号被转义，列表转换为IN"""
+    where = build_where_clause({"source": "o'neil.txt", "paragraph_num": [0, 1]})
+    assert where == "(source = 'o''neil.txt') AND (paragraph_num IN (0, 1))"
+
+
+def test_filtered_search_only_returns_matching_rows(tmp_path):
+    """按路径前缀和文件类型过滤后，只返回对应文档集中的结果"""
+    table, embeddings = _write_sample_table(lancedb.connect(tmp_path))
+
+    indexed = {column for index in table.list_indices() for column in index.columns}
+    assert {"source", "doc_type", "paragraph_num", "sentence_num_in_para", "ingested_at"} <= indexed
+
+    where = build_where_clause({"source_prefix": "tenant_a/"})
+    results = search_by_vector(table, embeddings[0], top_k=50, where=where)
+    assert len(results) == 10
+    assert all("tenant_a/" in r["metadata"]["source"] for r in results)
+
+    where = build_where_clause({"doc_type": "txt", "paragraph_num": 0})
+    results = search_by_vector(table, embeddings[0], top_k=50, where=where)
+    assert {r["metadata"]["paragraph_num"] for r in results} == {0}
+    assert all(r["metadata"]["source"].endswith(".txt") for r in results)
+
+
+def test_search_filters_reject_empty_lists():
+    """空列表会生成非法的IN ()，在请求校验时拒绝；sentence_num_in_para可作为过滤条件"""
+    with pytest.raises(ValidationError):
+        SearchFilters(source=[])
+    with pytest.raises(ValidationError):
+        SearchFilters(sentence_num_in_para=[])
+
+    filters = SearchFilters(sentence_num_in_para=[0, 1]).model_dump(exclude_none=True)
+    assert build_where_clause(filters) == "(sentence_num_in_para IN (0, 1))"
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+测试进程内指标：Prometheus文本格式、直方图分桶、请求级分阶段耗时
+"""
+
+import asyncio
+
+import src.embedding_model as embedding_module
+import src.rag_pipeline as rag_module
+from src.embedding_model import embedding_model
+from src.http_client import aclose_async_client
+from src.metrics import LLM_TOKENS, MetricsRegistry, collect_timings, span
+from tools.mock_server import start_mock_server
+
+
+def test_render_histogram_and_collectors():
+    """直方图按累计分桶导出，采集函数的结果追加在注册的指标之后"""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("stage_seconds", "阶段耗时", ["stage"], buckets=[0.1, 1.0])
+    counter = registry.counter("queries_total", "查询数")
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, stage="llm")
+    counter.inc()
+    registry.register_collector(
+        lambda: [("cache_hit_ratio", "gauge", "命中率", [({"cache": 'a"b'}, 0.25)])]
+    )
+
+    lines = registry.render().splitlines()
+    assert "# TYPE stage_seconds histogram" in lines
+    assert 'stage_seconds_bucket{stage="llm",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="llm",le="1.0"} 2' in lines
+    assert 'stage_seconds_bucket{stage="llm",le="+Inf"} 3' in lines
+    assert 'stage_seconds_sum{stage="llm"} 5.55' in lines
+    assert 'stage_seconds_count{stage="llm"} 3' in lines
+    assert "queries_total 1" in lines
+    assert lines[-1] == 'cache_hit_ratio{cache="a\\"b"} 0.25'
+
+
+def test_collect_timings_follows_worker_threads():
+    """asyncio.to_thread中的阶段耗时计入发起请求的上下文，并发请求之间互不干扰"""
+
+    def work(stage):
+        with span(stage):
+            pass
+
+    async def request(stage):
+        with collect_timings() as timings:
+            await asyncio.to_thread(work, stage)
+            await asyncio.to_thread(work, stage)
+        return timings
+
+    async def both():
+        return await asyncio.gather(request("test_a"), request("test_b"))
+
+    first, second = asyncio.run(both())
+    assert set(first) == {"test_a"} and set(second) == {"test_b"}
+    assert first["test_a"] >= 0
+
+
+def test_pipeline_records_stage_timings_and_tokens(monkeypatch):
+    """一次问答记录LLM和总耗时，并累加LLM服务报告的token用量"""
+    server = start_mock_server(dim=8)
+    try:
+        monkeypatch.setattr(embedding_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(embedding_model, "cache", None)
+        monkeypatch.setattr(rag_module, "DEEPSEEK_API_BASE", server.base_url)
+        monkeypatch.setattr(rag_module, "save_qa_to_knowledge_base", lambda q, a: None)
+        monkeypatch.setattr(rag_module, "answer_cache", None)
+        monkeypatch.setattr(rag_module, "query_log", None)
+        before = LLM_TOKENS.value(type="completion")
+
+        async def ask():
+            try:
+                with collect_timings() as timings:
+                    response = await rag_module.aget_rag_response("问题")
+                return response, timings
+            finally:
+                await aclose_async_client()
+
+        response, timings = asyncio.run(ask())
+        assert response["llm_answer"].startswith("模拟回答")
+        assert {"llm", "total"} <= set(timings)
+        assert timings["total"] >= timings["llm"]
+        assert LLM_TOKENS.value(type="completion") - before == len(response["llm_answer"])
+    finally:
+        server.shutdown()
+        server.server_close()
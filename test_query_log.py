@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+测试查询明细日志：后台写入、按大小轮转压缩、按时间顺序读取
+"""
+
+import gzip
+
+from src.query_log import (
+    QueryLogWriter,
+    build_query_record,
+    iter_query_records,
+    list_log_files,
+    summarize_latency,
+)
+
+
+def _record(i):
+    response = {
+        "llm_answer": f"回答{i}",
+        "retrieved_context": [
+            {
+                "text": "段落",
+                "sentence": "句子",
+                "paragraph": "段落",
+                "metadata": {"source": "a.txt", "has_context": True},
+                "score": 1.5,
+            }
+        ],
+    }
+    return build_query_record(f"问题{i}", response, i / 10, 50000, cached=i % 2 == 0)
+
+
+def test_writer_rotates_compresses_and_keeps_backups(tmp_path):
+    """超过大小上限后轮转为gzip归档，只保留最近的归档，读取时顺序不变"""
+    path = tmp_path / "queries.jsonl"
+    writer = QueryLogWriter(path, max_bytes=1500, rotate_seconds=0, backup_count=2)
+    written = []
+    for i in range(30):
+        assert writer.log(_record(i))
+        written.append(i)
+        # 每条记录单独写入，让每次写入都检查一次是否需要轮转
+        assert writer.flush()
+    writer.close()
+
+    files = list_log_files(path)
+    archives = files[:-1]
+    assert files[-1] == path
+    assert len(archives) == 2
+    assert all(p.name.endswith(".jsonl.gz") for p in archives)
+    with gzip.open(archives[0], "rt", encoding="utf-8") as f:
+        assert f.readline().startswith("{")
+
+    records = list(iter_query_records(files))
+    queries = [r["query"] for r in records]
+    # 最旧的归档被删除，保留下来的记录是连续的最新一段
+    assert queries == [f"问题{i}" for i in written[-len(queries):]]
+    assert records[-1]["retrieval_details"]["results"][0]["matched_sentence"] == "句子"
+    assert not writer.log(_record(99))
+
+
+def test_summarize_latency():
+    """统计响应时间分位数和缓存命中数"""
+    stats = summarize_latency([_record(i) for i in range(1, 11)])
+    assert stats["count"] == 10
+    assert stats["cached"] == 5
+    assert stats["max"] == 1.0
+    assert 0.5 <= stats["p50"] <= 0.6
+
+
+def test_writers_in_several_processes_share_one_log(tmp_path):
+    """多个写入器（模拟多个工作进程）写同一个文件并各自触发轮转，记录不丢失也不重复"""
+    path = tmp_path / "queries.jsonl"
+    writers = [
+        QueryLogWriter(path, max_bytes=2000, rotate_seconds=0, backup_count=0, compress=False)
+        for _ in range(2)
+    ]
+    for i in range(40):
+        writer = writers[i % 2]
+        assert writer.log(_record(i))
+        assert writer.flush()
+    for writer in writers:
+        writer.close()
+
+    files = list_log_files(path)
+    assert len(files) > 2
+    queries = sorted(int(r["query"][2:]) for r in iter_query_records(files))
+    assert queries == list(range(40))
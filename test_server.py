@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+测试生产部署相关的端点：就绪探测、关闭时等待正在处理的请求、多工作进程共享的索引任务及其状态写入节流
+"""
+
+import asyncio
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import src.api as api_module
+import src.indexing as indexing_module
+import src.jobs as jobs_module
+from src.api import InflightTracker, app
+from src.jobs import IndexingJobManager, JobConflictError
+
+
+def test_readiness_reports_table_and_draining(monkeypatch):
+    """表未打开或服务正在关闭时就绪探测返回503，存活探测始终返回200"""
+    client = TestClient(app)
+    monkeypatch.setattr(api_module, "inflight", InflightTracker())
+
+    monkeypatch.setattr(api_module.db_manager, "get_table", lambda name: None)
+    assert client.get("/health/ready").status_code == 503
+    assert client.get("/health/live").status_code == 200
+
+    monkeypatch.setattr(api_module.db_manager, "get_table", lambda name: object())
+    response = client.get("/health/ready")
+    assert response.status_code == 200 and response.json()["status"] == "ready"
+
+    api_module.inflight.draining = True
+    assert client.get("/health/ready").status_code == 503
+    assert client.get("/health/live").status_code == 200
+
+
+def test_sigterm_fails_readiness_before_shutdown(monkeypatch):
+    """SIGTERM先让就绪探测失败，延迟之后才交给uvicorn关闭；再次SIGTERM立即关闭"""
+    monkeypatch.setattr(api_module, "inflight", InflightTracker())
+    received = []
+    original = signal.signal(signal.SIGTERM, lambda sig, frame: received.append(time.monotonic()))
+    try:
+
+        async def scenario():
+            api_module.install_drain_handler(asyncio.get_running_loop(), 0.2)
+            handler = signal.getsignal(signal.SIGTERM)
+            start = time.monotonic()
+            handler(signal.SIGTERM, None)
+            assert api_module.inflight.draining and not received
+            await asyncio.sleep(0.4)
+            assert len(received) == 1 and received[0] - start >= 0.2
+            handler(signal.SIGTERM, None)
+            assert len(received) == 2
+
+        asyncio.run(scenario())
+    finally:
+        signal.signal(signal.SIGTERM, original)
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "等待超时"
+        time.sleep(0.02)
+
+
+def test_jobs_are_shared_between_workers(monkeypatch, tmp_path):
+    """一个工作进程提交的任务可以由另一个查询、取消，且不能同时提交第二个任务"""
+    monkeypatch.setattr(indexing_module, "INDEX_LOCK_PATH", tmp_path / "indexing.lock")
+
+    def fake_run_indexing(reindex, progress, cancel_event):
+        progress("ingesting", {"rows_written": 1})
+        while not cancel_event.is_set():
+            time.sleep(0.02)
+        return {"status": "cancelled"}
+
+    monkeypatch.setattr(jobs_module, "run_indexing", fake_run_indexing)
+    owner = IndexingJobManager(tmp_path / "jobs")
+    other = IndexingJobManager(tmp_path / "jobs")
+    try:
+        job_id = owner.submit().job_id
+        _wait_for(lambda: other.get(job_id)["stage"] == "ingesting")
+        assert [job["job_id"] for job in other.list()] == [job_id]
+        with pytest.raises(JobConflictError):
+            other.submit()
+
+        assert other.cancel(job_id)["cancel_requested"]
+        _wait_for(lambda: other.get(job_id)["status"] == "cancelled")
+        assert other.get("missing") is None
+    finally:
+        owner.shutdown()
+        other.shutdown()
+
+
+
+def test_progress_state_writes_are_throttled(monkeypatch, tmp_path):
+    """同一阶段内的进度不是每次都写状态文件，阶段变化和任务结束时总是写入"""
+    monkeypatch.setattr(indexing_module, "INDEX_LOCK_PATH", tmp_path / "indexing.lock")
+
+    def fake_run_indexing(reindex, progress, cancel_event):
+        for rows in range(100):
+            progress("ingesting", {"rows_written": rows})
+        progress("finalizing", {"rows_written": 100})
+        return {"status": "success"}
+
+    monkeypatch.setattr(jobs_module, "run_indexing", fake_run_indexing)
+    manager = IndexingJobManager(tmp_path / "jobs")
+    saved = []
+    save = manager._save
+    monkeypatch.setattr(manager, "_save", lambda job: saved.append(job.stage) or save(job))
+    try:
+        job_id = manager.submit().job_id
+        _wait_for(lambda: manager.get(job_id)["status"] == "succeeded")
+    finally:
+        manager.shutdown()
+    # 提交、开始运行、两次阶段变化和结束各写一次
+    assert saved == ["pending", "pending", "ingesting", "finalizing", "finalizing"]
+    assert manager._load(manager._state_path(job_id))["progress"] == {"rows_written": 100}
+
+def test_indexing_lock_is_held_across_processes(monkeypatch, tmp_path):
+    """另一个进程持有索引锁时，run_indexing不运行流水线而是返回错误"""
+    lock_path = tmp_path / "indexing.lock"
+    monkeypatch.setattr(indexing_module, "INDEX_LOCK_PATH", lock_path)
+    holder = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import fcntl, sys, time\n"
+            f"f = open({str(lock_path)!r}, 'a')\n"
+            "fcntl.flock(f, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "time.sleep(30)\n",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        assert indexing_module.indexing_in_progress()
+        assert indexing_module.run_indexing()["status"] == "error"
+    finally:
+        holder.kill()
+        holder.wait()
+    assert not indexing_module.indexing_in_progress()
@@ -3,7 +3,9 @@
 测试Small2Big技术的检索效果
 """
 
+from src.chunk_store import ParagraphStore, attach_parent_paragraphs
 from src.config import LANCEDB_TABLE_NAME
+from src.db_manager import DatabaseManager
 from src.vector_store import get_db_connection, search_vector_store
 
 
@@ -49,5 +51,34 @@ def test_small2big_retrieval():
         print()
 
 
+def test_parent_paragraphs_fetched_and_deduplicated(tmp_path):
+    """命中的句子换成父段落，同一段落只保留得分最好的一次"""
+    manager = DatabaseManager(tmp_path / "db", tmp_path / "rel.db", 2)
+    store = ParagraphStore(manager)
+    store.put_file(
+        "t1",
+        "f",
+        [("f#p0", "段落零"), ("f#p1", "段落一")],
+        [("f#0", "f#p0"), ("f#1", "f#p0"), ("f#2", "f#p1")],
+    )
+    hits = [
+        {"id": "f#1", "text": "句子1", "metadata": {}, "score": 0.1},
+        {"id": "f#0", "text": "句子0", "metadata": {}, "score": 0.2},
+        {"id": "f#2", "text": "句子2", "metadata": {}, "score": 0.3},
+        {"id": "g#0", "text": "没有段落", "metadata": {}, "score": 0.4},
+    ]
+
+    results = attach_parent_paragraphs(store, "t1", hits)
+    assert [r["sentence"] for r in results] == ["句子1", "句子2", "没有段落"]
+    assert [r["paragraph"] for r in results] == ["段落零", "段落一", None]
+    assert [r["metadata"]["has_context"] for r in results] == [True, True, False]
+
+    # 其它代的表和删除后的文件不再返回段落
+    assert store.fetch_parents("t2", ["f#0"]) == {}
+    store.delete_files("t1", ["f"])
+    assert store.fetch_parents("t1", ["f#0", "f#2"]) == {}
+    manager.close()
+
+
 if __name__ == "__main__":
     test_small2big_retrieval()
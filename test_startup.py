@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+测试命令行启动：子命令开始工作前不导入用不到的重依赖，也不访问网络
+"""
+
+import subprocess
+import sys
+
+from bench.startup import _DENY_NETWORK, ROOT_DIR, isolated_environment, parse_importtime
+
+
+def test_subcommand_imports_are_lazy(tmp_path):
+    """ask和index的导入路径不加载lancedb、nltk，ask不加载文档加载器和分割器"""
+    code = _DENY_NETWORK + (
+        "import sys\n"
+        "import main\n"
+        "import src.rag_pipeline\n"
+        "ask = set(sys.modules)\n"
+        "import src.indexing\n"
+        "index = set(sys.modules)\n"
+        "heavy = ['lancedb', 'nltk', 'langchain_community', 'langsmith']\n"
+        "print([m for m in heavy if m in ask], [m for m in heavy if m in index])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT_DIR,
+        env=isolated_environment(tmp_path),
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[] []"
+
+
+def test_parse_importtime():
+    """解析importtime输出时跳过表头和其它行"""
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   _io\n"
+        "import time:      2500 |       2620 | main\n"
+        "其它输出\n"
+    )
+    assert parse_importtime(stderr) == [("_io", 120, 120), ("main", 2500, 2620)]
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+测试流水线工具：有界队列限制上游领先的数量，异常和提前停止都能正确传递
+"""
+
+import threading
+
+import pytest
+
+from src.streaming import batched, bounded
+
+
+def test_bounded_limits_read_ahead_and_closes_upstream():
+    """上游最多领先队列容量加一个元素；调用方停止后上游生成器被关闭"""
+    produced = []
+    closed = threading.Event()
+
+    def source():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    stream = bounded(source(), maxsize=2)
+    assert next(stream) == 0
+    stream.close()
+
+    assert closed.wait(5)
+    assert len(produced) <= 4
+
+
+def test_bounded_propagates_errors_in_order():
+    """上游异常在已产出的元素之后重新抛出"""
+
+    def source():
+        yield from range(4)
+        raise ValueError("boom")
+
+    received = []
+    with pytest.raises(ValueError, match="boom"):
+        for item in bounded(batched(source(), 2), maxsize=1):
+            received.append(item)
+    assert received == [[0, 1], [2, 3]]
@@ -0,0 +1,418 @@
+"""API服务压测工具。
+
+默认启动两个子进程：模型服务桩（tools.mock_server，延迟分布和生成速度可配置）
+和指向它的API服务（uvicorn src.api:app），然后压测 /ask 或 /ask/stream：
+
+- 开环（--rps）：按固定间隔或泊松过程发出请求，不等待之前的请求完成，
+  用于观察服务在目标负载下的排队和延迟；
+- 闭环（--concurrency）：固定数量的工作协程，每完成一个请求立即发出下一个，
+  用于测量饱和吞吐。
+
+报告吞吐、延迟分位数（流式请求另报首token延迟）、按类型统计的错误率，以及
+压测期间从服务 /metrics 读取的事件循环延迟和流水线各阶段平均耗时。
+
+启动的API服务默认关闭回答缓存和嵌入缓存（重复的问题会直接命中缓存），
+查询日志和低相关度问答对写入临时目录；向量表使用项目的 db/，需要先运行索引。
+
+用法:
+    python -m tools.loadgen --rps 20 --duration 30
+    python -m tools.loadgen --concurrency 32 --endpoint stream
+    python -m tools.loadgen --rps 50 --chat-latency lognormal:0.8,0.5 --tokens-per-second 40 \\
+        --answer-chars 300 --output load.json
+    # 压测已运行的服务（此时桩服务参数无效）
+    python -m tools.loadgen --url http://127.0.0.1:8000 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from tools.mock_server import add_mock_arguments, free_port, mock_arguments, start_mock_process
+
+DEFAULT_QUERIES = [
+    "什么是RAG系统？",
+    "LanceDB有什么特点？",
+    "向量相似度搜索有哪些方法？",
+    "Small2Big检索是如何工作的？",
+    "如何提高检索的召回率？",
+    "混合检索和纯向量检索有什么区别？",
+]
+
+# Prometheus文本格式中的一行样本，如 name{a="1",b="2"} 0.5
+_SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# 写入结果文件的压测参数
+_REPORTED_PARAMS = (
+    "rps",
+    "concurrency",
+    "duration",
+    "arrival",
+    "endpoint",
+    "url",
+    "cache",
+    "chat_latency",
+    "embed_latency",
+    "tokens_per_second",
+    "answer_chars",
+)
+
+
+class RequestResult(NamedTuple):
+    """一次请求的结果，时间单位为秒。"""
+
+    latency: float
+    first_token: Optional[float]
+    error: Optional[str]
+
+
+def read_queries(path: Optional[str]) -> List[str]:
+    """读取问题文件：每行一个问题，或包含query字段的JSON对象；未指定时使用内置问题。"""
+    if not path:
+        return list(DEFAULT_QUERIES)
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = str(json.loads(line).get("query", "")).strip()
+            if line:
+                queries.append(line)
+    if not queries:
+        raise SystemExit(f"{path} 中没有问题")
+    return queries
+
+
+# --- 发送请求 ---
+
+
+async def send_request(client: httpx.AsyncClient, endpoint: str, query: str) -> RequestResult:
+    """发送一个问答请求并计时；HTTP错误、流中的error事件和异常都记为错误。"""
+    start = time.perf_counter()
+    first_token = None
+    try:
+        if endpoint == "stream":
+            error = None
+            async with client.stream("POST", "/ask/stream", json={"query": query}) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    return RequestResult(time.perf_counter() - start, None, f"http_{response.status_code}")
+                async for line in response.aiter_lines():
+                    if line == "event: token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                    elif line == "event: error":
+                        error = "stream_error"
+            return RequestResult(time.perf_counter() - start, first_token, error)
+
+        response = await client.post("/ask", json={"query": query})
+        error = None if response.status_code == 200 else f"http_{response.status_code}"
+        return RequestResult(time.perf_counter() - start, None, error)
+    except httpx.HTTPError as e:
+        return RequestResult(time.perf_counter() - start, first_token, type(e).__name__)
+
+
+async def run_open_loop(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    queries: List[str],
+    rps: float,
+    duration: float,
+    arrival: str = "constant",
+    seed: int = 42,
+) -> List[RequestResult]:
+    """按目标RPS发出请求，直到duration秒后停止发送，再等待在途请求完成。"""
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    tasks = []
+    start = loop.time()
+    next_send = start
+    i = 0
+    while next_send < start + duration:
+        delay = next_send - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send_request(client, endpoint, queries[i % len(queries)])))
+        i += 1
+        next_send += rng.expovariate(rps) if arrival == "poisson" else 1 / rps
+    return list(await asyncio.gather(*tasks))
+
+
+async def run_closed_loop(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    queries: List[str],
+    concurrency: int,
+    duration: float,
+) -> List[RequestResult]:
+    """concurrency个工作协程循环发送请求，duration秒后不再发出新请求。"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    counter = iter(range(sys.maxsize))
+
+    async def worker() -> List[RequestResult]:
+        results = []
+        while loop.time() < deadline:
+            query = queries[next(counter) % len(queries)]
+            results.append(await send_request(client, endpoint, query))
+        return results
+
+    per_worker = await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return [result for results in per_worker for result in results]
+
+
+# --- 统计 ---
+
+
+def _percentiles_ms(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    array = np.array(values) * 1000
+    return {
+        "mean": round(float(array.mean()), 2),
+        "p50": round(float(np.percentile(array, 50)), 2),
+        "p90": round(float(np.percentile(array, 90)), 2),
+        "p95": round(float(np.percentile(array, 95)), 2),
+        "p99": round(float(np.percentile(array, 99)), 2),
+        "max": round(float(array.max()), 2),
+    }
+
+
+def summarize(results: List[RequestResult], elapsed: float) -> Dict:
+    """
+    汇总请求结果。
+
+    Returns:
+        Dict: requests、ok、error_rate、errors（按类型计数）、throughput_rps（成功请求/秒）、
+            latency_ms，流式请求另有first_token_ms；延迟只统计成功的请求
+    """
+    ok = [r for r in results if r.error is None]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r.error is not None:
+            errors[r.error] = errors.get(r.error, 0) + 1
+    summary = {
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": _percentiles_ms([r.latency for r in ok]),
+    }
+    first_tokens = [r.first_token for r in ok if r.first_token is not None]
+    if first_tokens:
+        summary["first_token_ms"] = _percentiles_ms(first_tokens)
+    return summary
+
+
+def parse_metrics(text: str) -> Dict[MetricKey, float]:
+    """解析Prometheus文本格式，返回 {(指标名, 排序后的标签): 值}。"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_PATTERN.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        key = tuple(sorted(_LABEL_PATTERN.findall(labels or "")))
+        samples[(name, key)] = float(value)
+    return samples
+
+
+def _delta(before: Dict[MetricKey, float], after: Dict[MetricKey, float], name: str, **labels: str):
+    key = (name, tuple(sorted(labels.items())))
+    return after.get(key, 0.0) - before.get(key, 0.0)
+
+
+def server_metrics(before: Dict[MetricKey, float], after: Dict[MetricKey, float]) -> Dict:
+    """
+    根据压测前后两次 /metrics 的差值计算压测期间的服务端指标。
+
+    Returns:
+        Dict: event_loop_lag（采样数、平均值和p99的分桶上界，毫秒）和
+            stages_ms（各阶段平均耗时，毫秒）
+    """
+    lag_name = "rag_event_loop_lag_seconds"
+    lag_count = _delta(before, after, f"{lag_name}_count")
+    report: Dict = {}
+    if lag_count > 0:
+        bounds = sorted(
+            {dict(key)["le"] for name, key in after if name == f"{lag_name}_bucket"}, key=float
+        )
+        p99 = None
+        for bound in bounds:
+            if _delta(before, after, f"{lag_name}_bucket", le=bound) >= 0.99 * lag_count:
+                p99 = float(bound) * 1000
+                break
+        report["event_loop_lag"] = {
+            "samples": int(lag_count),
+            "mean_ms": round(_delta(before, after, f"{lag_name}_sum") / lag_count * 1000, 3),
+            "p99_le_ms": p99,
+        }
+
+    stages = {}
+    stage_name = "rag_stage_duration_seconds"
+    for name, key in after:
+        if name != f"{stage_name}_count":
+            continue
+        stage = dict(key).get("stage")
+        count = _delta(before, after, name, stage=stage)
+        if count > 0:
+            total = _delta(before, after, f"{stage_name}_sum", stage=stage)
+            stages[stage] = round(total / count * 1000, 2)
+    if stages:
+        report["stages_ms"] = dict(sorted(stages.items()))
+    return report
+
+
+# --- 子进程 ---
+
+
+def start_api_process(api_base: str, workdir: Path, cache: bool, timeout: float = 120.0):
+    """
+    启动指向桩服务的API服务子进程并等待 /metrics 可访问。
+
+    Returns:
+        Tuple[subprocess.Popen, str]: 子进程和服务地址
+    """
+    port = free_port()
+    env = dict(
+        os.environ,
+        DEEPSEEK_API_BASE=api_base,
+        DATA_DIR=str(workdir / "data"),
+        QUERY_LOG_PATH=str(workdir / "queries.jsonl"),
+        ANSWER_CACHE_ENABLED=str(cache).lower(),
+        EMBEDDING_CACHE_ENABLED=str(cache).lower(),
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+    )
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.api:app",
+            f"--port={port}",
+            "--host=127.0.0.1",
+            "--log-level=warning",
+        ],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if httpx.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("API服务启动失败")
+
+
+async def run_load(args: argparse.Namespace, url: str, queries: List[str]) -> Dict:
+    """预热后压测，并在压测前后读取服务的 /metrics。"""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        for query in queries[: args.warmup]:
+            await send_request(client, args.endpoint, query)
+        before = parse_metrics((await client.get("/metrics")).text)
+
+        start = time.perf_counter()
+        if args.rps:
+            results = await run_open_loop(
+                client, args.endpoint, queries, args.rps, args.duration, args.arrival, args.seed
+            )
+        else:
+            results = await run_closed_loop(
+                client, args.endpoint, queries, args.concurrency, args.duration
+            )
+        elapsed = time.perf_counter() - start
+
+        after = parse_metrics((await client.get("/metrics")).text)
+    return {**summarize(results, elapsed), "server": server_metrics(before, after)}
+
+
+def print_report(report: Dict):
+    print(
+        f"请求 {report['requests']}，成功 {report['ok']}，错误率 {report['error_rate']:.2%}，"
+        f"吞吐 {report['throughput_rps']:.2f} 请求/秒（{report['elapsed_seconds']}s）"
+    )
+    if report["errors"]:
+        print("错误: " + ", ".join(f"{k}={v}" for k, v in report["errors"].items()))
+    for title, field in (("延迟", "latency_ms"), ("首token", "first_token_ms")):
+        stats = report.get(field)
+        if stats:
+            print(f"{title}(ms): " + "  ".join(f"{k} {v:.1f}" for k, v in stats.items()))
+    server = report["server"]
+    lag = server.get("event_loop_lag")
+    if lag:
+        print(
+            f"事件循环延迟: 平均 {lag['mean_ms']:.2f}ms，p99 ≤ {lag['p99_le_ms']}ms"
+            f"（{lag['samples']} 次采样）"
+        )
+    if server.get("stages_ms"):
+        print("阶段平均耗时(ms): " + "  ".join(f"{k} {v}" for k, v in server["stages_ms"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API服务压测。")
+    load = parser.add_mutually_exclusive_group(required=True)
+    load.add_argument("--rps", type=float, help="开环压测的目标请求速率")
+    load.add_argument("--concurrency", type=int, help="闭环压测的并发数")
+    parser.add_argument("--duration", type=float, default=30.0, help="发送请求的时长（秒）")
+    parser.add_argument("--arrival", choices=["constant", "poisson"], default="constant")
+    parser.add_argument("--endpoint", choices=["ask", "stream"], default="ask")
+    parser.add_argument("--queries-file", help="问题文件，每行一个问题或一个JSON对象")
+    parser.add_argument("--warmup", type=int, default=2, help="压测前顺序发送的预热请求数")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求的超时（秒）")
+    parser.add_argument("--url", help="压测已运行的服务，不启动子进程")
+    parser.add_argument("--cache", action="store_true", help="启动的API服务开启回答缓存和嵌入缓存")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries_file)
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            url = args.url
+            if url is None:
+                mock, api_base = start_mock_process(mock_arguments(args))
+                processes.append(mock)
+                api, url = start_api_process(api_base, Path(tmp_dir), args.cache)
+                processes.append(api)
+            report = asyncio.run(run_load(args, url, queries))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+
+    report["params"] = {key: getattr(args, key) for key in _REPORTED_PARAMS}
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""本地模型服务桩（stub server）。
+
+模拟DeepSeek服务的 `/api/config`、`/api/analyze`、OpenAI兼容的 `/v1/embeddings`
+和 `/v1/chat/completions` 接口，用于在没有真实模型服务时测试嵌入和问答逻辑，
+以及对API服务做离线压测（见 tools/loadgen.py）。
+向量由文本哈希确定性生成，相同文本总是得到相同向量；包含 FAIL_MARKER 的
+请求会返回500。
+
+聊天接口先等待一段首token延迟（按 --chat-latency 分布抽样），再按
+--tokens-per-second 的速度生成回答（每个字符计为一个token，0表示瞬间生成）；
+请求体中 stream 为true时以SSE逐字符返回。嵌入接口每个请求等待
+--embed-latency 分布抽样的时间。延迟分布的写法见 LatencyModel.parse。
+
+用法:
+    python -m tools.mock_server --port 1234
+    python -m tools.mock_server --chat-latency lognormal:0.8,0.5 --tokens-per-second 40 \\
+        --answer-chars 300 --embed-latency uniform:0.01,0.05
+然后设置 DEEPSEEK_API_BASE=http://127.0.0.1:1234/v1
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Sequence, Tuple
+
+DEFAULT_DIM = 128
+# 输入文本中包含该标记时返回HTTP 500，用于测试重试和部分失败
+FAIL_MARKER = "[[mock-fail]]"
+
+
+def deterministic_embedding(text: str, dim: int = DEFAULT_DIM) -> List[float]:
+    """根据文本的SHA-256摘要生成取值在[-1, 1)之间的确定性向量。"""
+    values: List[float] = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        for (word,) in struct.iter_unpack("<I", digest):
+            values.append(word / 2**31 - 1.0)
+        counter += 1
+    return values[:dim]
+
+
+# 用于把回答补足到指定长度的文本
+_FILLER = "这是由模拟服务生成的回答文本，用于测量流式输出和生成速度。"
+
+
+class LatencyModel:
+    """
+    可抽样的延迟分布（秒），线程安全。
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "exp")
+
+    def __init__(self, kind: str = "fixed", params: Sequence[float] = (0.0,), seed: Optional[int] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"未知的延迟分布: {kind}，可选 {self.KINDS}")
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}[kind]
+        if len(params) != expected:
+            raise ValueError(f"延迟分布 {kind} 需要 {expected} 个参数，实际为 {len(params)}")
+        self.kind = kind
+        self.params = tuple(float(p) for p in params)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "LatencyModel":
+        """
+        解析延迟分布的文字描述。
+
+        Args:
+            spec (str): "0.2"（固定0.2秒）、"uniform:最小,最大"、"normal:均值,标准差"、
+                "lognormal:中位数,sigma"（长尾，最接近真实LLM延迟）或 "exp:均值"。
+            seed (int, optional): 随机种子。
+
+        Returns:
+            LatencyModel: 延迟分布。
+        """
+        kind, _, args = spec.partition(":")
+        if not args:
+            return cls("fixed", (float(kind),), seed)
+        return cls(kind.strip().lower(), [float(x) for x in args.split(",")], seed)
+
+    def sample(self) -> float:
+        """抽样一个非负的延迟（秒）。"""
+        with self._lock:
+            if self.kind == "fixed":
+                value = self.params[0]
+            elif self.kind == "uniform":
+                value = self._random.uniform(*self.params)
+            elif self.kind == "normal":
+                value = self._random.gauss(*self.params)
+            elif self.kind == "lognormal":
+                median, sigma = self.params
+                value = self._random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+            else:
+                value = self._random.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+        return max(0.0, value)
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+
+def analyze_result(text: str) -> dict:
+    """根据文本哈希生成确定性的 /api/analyze 结果（情感和主题权重）。"""
+    values = deterministic_embedding(text, 16)
+    weights = [(v + 1) / 2 for v in values]
+    positive, negative = weights[0] / 2, weights[1] / 2
+    return {
+        "text_length": len(text),
+        "sentiment": {"positive": positive, "negative": negative, "neutral": 1 - positive - negative},
+        "topics": [{"name": f"topic_{i}", "weight": w} for i, w in enumerate(weights[2:12])],
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """处理桩服务请求，并把每次请求记录到server.request_log中。"""
+
+    server: "MockServer"
+
+    def log_message(self, format, *args):  # noqa: A002
+        # 静默默认的访问日志，避免污染测试输出
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, answer: str, model: Optional[str], usage: Optional[dict] = None):
+        """以OpenAI流式格式逐字符发送回答，连接关闭即表示流结束。"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        rate = self.server.tokens_per_second
+        for char in answer:
+            if rate > 0:
+                time.sleep(1 / rate)
+            chunk = {
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": char}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        if usage is not None:
+            chunk = {"object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/config":
+            self.server.record(self.path, 0)
+            self._send_json(200, {"mock": True, "dim": self.server.dim})
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path == "/api/analyze":
+            payload = self._read_json()
+            self.server.record(self.path, 1)
+            time.sleep(self.server.embed_latency.sample())
+            text = str(payload.get("text", ""))
+            if FAIL_MARKER in text:
+                self._send_json(500, {"error": "injected failure"})
+                return
+            self._send_json(200, analyze_result(text))
+        elif self.path == "/v1/embeddings":
+            payload = self._read_json()
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self.server.record(self.path, len(inputs))
+            time.sleep(self.server.embed_latency.sample())
+            if any(FAIL_MARKER in text for text in inputs):
+                self._send_json(500, {"error": "injected failure"})
+                return
+            data = [
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": deterministic_embedding(text, self.server.dim),
+                }
+                for i, text in enumerate(inputs)
+            ]
+            # 倒序返回，确保客户端按index字段重排而不是依赖返回顺序
+            data.reverse()
+            self._send_json(
+                200,
+                {"object": "list", "data": data, "model": payload.get("model")},
+            )
+        elif self.path == "/v1/chat/completions":
+            payload = self._read_json()
+            self.server.record(self.path, 1)
+            time.sleep(self.server.chat_latency.sample())
+            content = payload.get("messages", [{}])[-1].get("content", "")
+            answer = f"模拟回答（输入长度 {len(content)}）"
+            if self.server.answer_chars > len(answer):
+                filler = _FILLER * (self.server.answer_chars // len(_FILLER) + 1)
+                answer += filler[: self.server.answer_chars - len(answer)]
+            # 按字符数近似token数
+            usage = {
+                "prompt_tokens": len(content),
+                "completion_tokens": len(answer),
+                "total_tokens": len(content) + len(answer),
+            }
+            if payload.get("stream"):
+                include_usage = (payload.get("stream_options") or {}).get("include_usage")
+                self._send_stream(answer, payload.get("model"), usage if include_usage else None)
+                return
+            if self.server.tokens_per_second > 0:
+                time.sleep(len(answer) / self.server.tokens_per_second)
+            self._send_json(
+                200,
+                {
+                    "object": "chat.completion",
+                    "model": payload.get("model"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": answer},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+
+class MockServer(ThreadingHTTPServer):
+    """带请求记录的多线程HTTP桩服务。"""
+
+    daemon_threads = True
+    # 压测时会同时到达大量连接，默认的5个监听队列会导致连接被拒绝
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        dim: int = DEFAULT_DIM,
+        chat_delay: float = 0.0,
+        chat_latency: Optional[LatencyModel] = None,
+        embed_latency: Optional[LatencyModel] = None,
+        tokens_per_second: float = 0.0,
+        answer_chars: int = 0,
+    ):
+        super().__init__(address, MockHandler)
+        self.dim = dim
+        self.chat_latency = chat_latency or LatencyModel("fixed", (chat_delay,))
+        self.embed_latency = embed_latency or LatencyModel("fixed", (0.0,))
+        self.tokens_per_second = tokens_per_second
+        self.answer_chars = answer_chars
+        self.request_log: List[Tuple[str, int]] = []
+        self._log_lock = threading.Lock()
+
+    def record(self, path: str, batch_size: int):
+        with self._log_lock:
+            self.request_log.append((path, batch_size))
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_mock_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    dim: int = DEFAULT_DIM,
+    chat_delay: float = 0.0,
+    **options,
+) -> MockServer:
+    """
+    在后台线程中启动桩服务。
+
+    Args:
+        host (str): 监听地址。
+        port (int): 监听端口，0表示由系统分配空闲端口。
+        dim (int): 返回向量的维度。
+        chat_delay (float): 聊天接口返回前等待的秒数，模拟LLM生成耗时。
+        **options: MockServer的其它参数（chat_latency、embed_latency、
+            tokens_per_second、answer_chars）。
+
+    Returns:
+        MockServer: 已启动的服务，使用完毕后调用 shutdown() 关闭。
+    """
+    server = MockServer((host, port), dim=dim, chat_delay=chat_delay, **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def free_port() -> int:
+    """返回一个当前空闲的本地端口。"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_process(args: Sequence[str] = (), timeout: float = 30.0):
+    """
+    在子进程中启动桩服务并等待其就绪，避免桩服务与被测代码争用同一个GIL。
+
+    Args:
+        args (Sequence[str]): 额外的命令行参数，如 ["--chat-latency", "0.5"]。
+        timeout (float): 等待就绪的最长时间（秒）。
+
+    Returns:
+        Tuple[subprocess.Popen, str]: 子进程和API地址（以 /v1 结尾），
+            使用完毕后调用 terminate() 关闭子进程。
+
+    Raises:
+        RuntimeError: 子进程退出或在timeout秒内没有就绪
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "tools.mock_server", "--port", str(port), *args],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/config", timeout=1).close()
+            return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("模型服务桩启动失败")
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    """添加桩服务的延迟和生成速度参数，供本模块和压测工具共用。"""
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM, help="返回向量的维度")
+    parser.add_argument(
+        "--chat-latency", default="0", help="聊天接口首token延迟的分布，如 lognormal:0.8,0.5"
+    )
+    parser.add_argument("--embed-latency", default="0", help="嵌入接口每个请求的延迟分布")
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=0.0, help="生成速度，0表示瞬间生成"
+    )
+    parser.add_argument("--answer-chars", type=int, default=0, help="把回答补足到该长度")
+
+
+def mock_arguments(args: argparse.Namespace) -> List[str]:
+    """把add_mock_arguments解析出的参数还原为命令行参数，用于start_mock_process。"""
+    return [
+        f"--dim={args.dim}",
+        f"--chat-latency={args.chat_latency}",
+        f"--embed-latency={args.embed_latency}",
+        f"--tokens-per-second={args.tokens_per_second}",
+        f"--answer-chars={args.answer_chars}",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动本地模型服务桩。")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--seed", type=int, default=None, help="延迟抽样的随机种子")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer(
+        (args.host, args.port),
+        dim=args.dim,
+        chat_latency=LatencyModel.parse(args.chat_latency, args.seed),
+        embed_latency=LatencyModel.parse(args.embed_latency, args.seed),
+        tokens_per_second=args.tokens_per_second,
+        answer_chars=args.answer_chars,
+    )
+    print(f"Mock server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""查询明细日志的查看工具。
+
+用法:
+    # 最近20条查询
+    python -m tools.query_log tail -n 20
+    # 持续输出新写入的查询（日志轮转后自动切换到新文件）
+    python -m tools.query_log tail -f
+    # 统计全部日志（包括归档）的响应时间，或只统计某个时间之后的查询
+    python -m tools.query_log stats
+    python -m tools.query_log stats --since 2025-07-24T00:00:00
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from src.config import QUERY_LOG_PATH
+from src.query_log import iter_query_records, list_log_files, summarize_latency
+
+
+def format_record(record: Dict[str, Any], width: int = 60) -> str:
+    """把一条记录格式化为一行摘要。"""
+    answer = (record.get("llm_answer") or "").replace("\n", " ")
+    if len(answer) > width:
+        answer = answer[: width - 1] + "…"
+    details = record.get("retrieval_details") or {}
+    flag = " [cached]" if record.get("cached") else ""
+    return (
+        f"{record.get('timestamp', '-')}  {record.get('response_time_seconds', 0):>8.3f}s  "
+        f"{details.get('total_results', 0)} ctx{flag}  {record.get('query')!r} -> {answer}"
+    )
+
+
+def tail_records(files: List[Path], n: int) -> List[Dict[str, Any]]:
+    """从最新的文件开始向前读取，返回最后n条记录（按时间顺序）。"""
+    recent: List[Dict[str, Any]] = []
+    for path in reversed(files):
+        needed = n - len(recent)
+        if needed <= 0:
+            break
+        recent = list(iter_query_records([path]))[-needed:] + recent
+    return recent
+
+
+def _emit(record: Dict[str, Any], as_json: bool):
+    if as_json:
+        print(json.dumps(record, ensure_ascii=False), flush=True)
+    else:
+        print(format_record(record), flush=True)
+
+
+def follow(path: Path, as_json: bool, poll_interval: float = 0.5):
+    """持续读取当前日志文件新增的行；文件被轮转（inode变化）后从头读取新文件。"""
+    handle = None
+    inode = None
+    partial = ""
+    # 启动时已存在的文件从末尾开始读；之后新建（轮转）的文件从头读取
+    if path.exists():
+        handle = open(path, "r", encoding="utf-8")
+        handle.seek(0, os.SEEK_END)
+        inode = os.fstat(handle.fileno()).st_ino
+    try:
+        while True:
+            if handle is None and path.exists():
+                handle = open(path, "r", encoding="utf-8")
+                inode = os.fstat(handle.fileno()).st_ino
+            if handle is not None:
+                chunk = handle.read()
+                if chunk:
+                    partial += chunk
+                    *lines, partial = partial.split("\n")
+                    for line in lines:
+                        if line.strip():
+                            try:
+                                _emit(json.loads(line), as_json)
+                            except json.JSONDecodeError:
+                                continue
+                    continue
+                try:
+                    rotated = os.stat(path).st_ino != inode
+                except FileNotFoundError:
+                    rotated = True
+                if rotated:
+                    handle.close()
+                    handle = None
+                    partial = ""
+                    continue
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看查询明细日志。")
+    parser.add_argument("--path", type=Path, default=QUERY_LOG_PATH, help="当前日志文件路径")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_tail = subparsers.add_parser("tail", help="输出最近的查询。")
+    parser_tail.add_argument("-n", type=int, default=20, help="输出的记录数")
+    parser_tail.add_argument("-f", "--follow", action="store_true", help="持续输出新写入的查询")
+    parser_tail.add_argument("--json", action="store_true", help="输出完整的JSON记录")
+
+    parser_stats = subparsers.add_parser("stats", help="统计响应时间。")
+    parser_stats.add_argument("--since", help="只统计该时间（ISO格式）之后的查询")
+    args = parser.parse_args()
+
+    if args.command == "tail":
+        for record in tail_records(list_log_files(args.path), args.n):
+            _emit(record, args.json)
+        if args.follow:
+            follow(args.path, args.json)
+        return
+
+    records = iter_query_records(list_log_files(args.path))
+    if args.since:
+        records = (r for r in records if str(r.get("timestamp", "")) >= args.since)
+    print(json.dumps(summarize_latency(records), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()